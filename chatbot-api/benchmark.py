@@ -0,0 +1,334 @@
+# benchmark.py
+"""
+Benchmark suite for the Python story pipeline.
+
+Generates a synthetic corpus (see synthetic_corpus.py), starts stub LLM and Photon servers with
+configurable latency and error rates, and runs each pipeline stage against them:
+
+    corpus    write N synthetic story files
+    load      read the story files (as preprocess_data.py does)
+    analyze   preprocess_data.analyze_stories_concurrently (one LLM request per story or batch)
+    analyze_chunked   preprocess_data.analyze_stories_chunked on the full texts (with --chunked)
+    analyze_local     preprocess_data.analyze_stories with the local sentiment pre-classifier trained
+                      on analyzed_stories.json; only uncertain stories reach the LLM (with --preclassify)
+    geocode   geocode_stories.geocode_story_stream + JSON output + columnar store
+    map       visualize_map.create_fast_story_map (and create_story_map with --legacy-map)
+
+Each stage reports wall time, throughput, per-item latency percentiles (where the stage has
+per-item work) and peak memory; analyze stages also report LLM requests and accuracy against the
+sentiment each synthetic story was written with (the stub LLM classifies by keywords). The report
+is saved as JSON; pass --compare with an earlier report to see the change per stage. The corpus is generated from a fixed seed and every cache
+starts cold, so runs with the same options are comparable.
+
+Examples:
+    python benchmark.py --stories 2000
+    python benchmark.py --stories 100000 --llm-latency 0.2 --llm-concurrency 16 --batch-size 8
+    python benchmark.py --stories 2000 --compare benchmark_results/benchmark-20261017-101500.json
+    python benchmark.py --stories 500 --max-sentences 120 --llm-prompt-token-latency 0.0005 --chunked
+    python benchmark.py --stories 1000 --llm-latency 0.5 --preclassify
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BASE_DIR, "benchmark_results")
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far (None where unavailable)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def timed(iterable, latencies):
+    """Passes items through, appending the seconds spent producing each one to `latencies`."""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        latencies.append(time.perf_counter() - start)
+        yield item
+
+
+def run_stage(name, function, log_file, trace_memory=False):
+    """
+    Runs one stage with its console output sent to `log_file` and measures it.
+
+    `function` returns (items processed, per-item latencies in seconds or None).
+    """
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(log_file), contextlib.redirect_stderr(log_file):
+        items, latencies = function()
+    elapsed = time.perf_counter() - started
+
+    result = {"items": items, "seconds": round(elapsed, 4),
+              "items_per_sec": round(items / elapsed, 2) if elapsed else None,
+              "peak_rss_mb": peak_rss_mb()}
+    if trace_memory:
+        result["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+        tracemalloc.stop()
+    if latencies:
+        latencies = sorted(latencies)
+        for pct in (50, 95, 99):
+            result[f"latency_p{pct}_ms"] = round(percentile(latencies, pct) * 1000, 3)
+        result["latency_max_ms"] = round(latencies[-1] * 1000, 3)
+
+    print(f"   {name:<15} {items:>7} items in {elapsed:8.2f}s  ({result['items_per_sec']:.1f}/s)"
+          + (f"  p50 {result['latency_p50_ms']:.1f} ms  p99 {result['latency_p99_ms']:.1f} ms" if latencies else "")
+          + (f"  peak RSS {result['peak_rss_mb']:.0f} MB" if result["peak_rss_mb"] else ""))
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(report, baseline):
+    """Prints the throughput change of every stage present in both reports."""
+    print(f"\n📊 Compared with {baseline.get('timestamp')} (commit {baseline.get('git_commit')}):")
+    changed = {key: (baseline.get("config", {}).get(key), value) for key, value in report["config"].items()
+               if baseline.get("config", {}).get(key) != value}
+    if changed:
+        print("   ⚠️ Options differ: " + ", ".join(f"{key} {old} -> {new}" for key, (old, new) in changed.items()))
+    for name, stage in report["stages"].items():
+        before = baseline.get("stages", {}).get(name)
+        if not before or not before.get("items_per_sec") or not stage.get("items_per_sec"):
+            continue
+        change = (stage["items_per_sec"] / before["items_per_sec"] - 1) * 100
+        print(f"   {name:<15} {before['items_per_sec']:>10.1f}/s -> {stage['items_per_sec']:>10.1f}/s  ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the story pipeline against stub servers.")
+    parser.add_argument("--stories", type=int, default=1000, help="Synthetic corpus size.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-sentences", type=int, default=25, help="Longest synthetic story, in sentences.")
+    parser.add_argument("--work-dir", help="Directory for the corpus and outputs (default: a new temp dir).")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Stub LLM seconds per request.")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-prompt-token-latency", type=float, default=0.0,
+                        help="Extra stub LLM seconds per prompt word (makes long prompts slower).")
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    parser.add_argument("--llm-backends", type=int, default=1,
+                        help="Stub LLM servers to balance across (LM_STUDIO_API with several URLs).")
+    parser.add_argument("--batch-size", type=int, default=1, help="Stories per LLM request.")
+    parser.add_argument("--photon-latency", type=float, default=0.01, help="Stub Photon seconds per request.")
+    parser.add_argument("--photon-error-rate", type=float, default=0.0)
+    parser.add_argument("--use-gazetteer", action="store_true",
+                        help="Let geocoding answer from the offline gazetteer (default: every lookup goes to Photon).")
+    parser.add_argument("--chunked", action="store_true",
+                        help="Also analyze the full stories in chunks (map-reduce) and compare with truncation.")
+    parser.add_argument("--preclassify", action="store_true",
+                        help="Also analyze with the local sentiment pre-classifier in front of the LLM.")
+    parser.add_argument("--legacy-map", action="store_true", help="Also time visualize_map.create_story_map.")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Report peak Python allocations per stage (tracemalloc; slows stages down).")
+    parser.add_argument("--output", help="Report path (default: benchmark_results/benchmark-<time>.json).")
+    parser.add_argument("--compare", help="Earlier report to compare throughput against.")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="story-bench-")
+    corpus_dir = os.path.join(work_dir, "stories")
+    os.makedirs(work_dir, exist_ok=True)
+
+    # Every run starts from cold caches and talks only to the stub servers. These settings are read
+    # when the pipeline modules are imported, so they are set before the imports below.
+    os.environ["MODEL"] = "benchmark-model"
+    os.environ["LLM_CACHE_PATH"] = ""
+    # Defaults of preprocess_data.analyze_stories (the stages below that call lower-level
+    # functions pass these explicitly).
+    os.environ["LLM_MAX_CONCURRENCY"] = str(max(1, args.llm_concurrency // args.llm_backends))
+    os.environ["LLM_BATCH_SIZE"] = str(args.batch_size)
+    os.environ["GEOCODE_CACHE_PATH"] = os.path.join(work_dir, f"geocode_cache-{time.time_ns()}.sqlite3")
+    if not args.use_gazetteer:
+        os.environ["GAZETTEER_PATH"] = os.path.join(work_dir, "no-gazetteer.json")
+
+    from stub_llm_server import start_stub_server_in_background as start_stub_llm
+    from stub_photon_server import start_stub_server_in_background as start_stub_photon
+    llm_servers = [start_stub_llm(latency=args.llm_latency, error_rate=args.llm_error_rate,
+                                  prompt_token_latency=args.llm_prompt_token_latency)
+                   for _ in range(max(1, args.llm_backends))]
+    photon_server, photon_url = start_stub_photon(latency=args.photon_latency, error_rate=args.photon_error_rate)
+    os.environ["LM_STUDIO_API"] = ",".join(url for _, url in llm_servers)
+
+    import geocode_stories
+    import preprocess_data
+    import visualize_map
+    from story_store import StoryStoreWriter
+    from story_stream import iter_stories, write_stories
+    from synthetic_corpus import generate_corpus
+    geocode_stories.PHOTON_URL = photon_url
+    visualize_map.PHOTON_URL = photon_url
+
+    analyzed_path = os.path.join(work_dir, "analyzed_stories.jsonl")
+    geocoded_path = os.path.join(work_dir, "geocoded_stories.json")
+    contents = {}
+    labels = {}
+    predictions = {}
+
+    def corpus_stage():
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+        labels.update(generate_corpus(corpus_dir, args.stories, args.seed, args.max_sentences))
+        return len(labels), None
+
+    def llm_usage():
+        with preprocess_data.token_usage_lock:
+            usage = preprocess_data.token_usage
+            return usage["requests"], usage["prompt_tokens"] + usage["completion_tokens"]
+
+    def quality(name, results, usage_before):
+        """Accuracy against the synthetic labels, LLM cost, and agreement with the truncating analysis."""
+        requests_sent, tokens = (after - before for after, before in zip(llm_usage(), usage_before))
+        predictions[name] = {f: sentiment for f, sentiment, _, _ in results}
+        extra = {"accuracy": round(sum(labels.get(f) == s for f, s in predictions[name].items()) / len(results), 4),
+                 "llm_requests": requests_sent, "tokens_per_story": round(tokens / len(results), 1)}
+        if name != "analyze" and "analyze" in predictions:
+            extra["agreement_with_truncation"] = round(
+                sum(predictions["analyze"].get(f) == s for f, s in predictions[name].items()) / len(results), 4)
+        stages_extra.setdefault(name, {}).update(extra)
+
+    def track_llm_latencies(latencies):
+        hooks = preprocess_data.http_session.hooks["response"]
+        hooks.clear()
+        hooks.append(lambda response, *hook_args, **hook_kwargs: latencies.append(response.elapsed.total_seconds()))
+
+    def load_stage():
+        latencies = []
+        for file_name in timed(sorted(os.listdir(corpus_dir)), latencies):
+            with open(os.path.join(corpus_dir, file_name), "r", encoding="utf-8") as f:
+                contents[file_name] = f.read().strip()
+        return len(contents), latencies
+
+    def analyze_stage():
+        latencies = []
+        track_llm_latencies(latencies)
+        usage_before = llm_usage()
+        results = preprocess_data.analyze_stories_concurrently(
+            [(f, text[:preprocess_data.STORY_TRUNCATE_CHARS]) for f, text in contents.items()],
+            max_workers=args.llm_concurrency, batch_size=args.batch_size)
+        quality("analyze", results, usage_before)
+        write_stories(analyzed_path, (
+            {"story_id": f, "text": contents[f], "sentiment": sentiment, "summary": summary, "method": "lmstudio"}
+            for f, sentiment, summary, _ in results))
+        if len(preprocess_data.llm_client.backends) > 1:
+            stages_extra["analyze"]["backends"] = preprocess_data.llm_client.backend_stats()
+        return len(results), latencies
+
+    def analyze_chunked_stage():
+        latencies = []
+        track_llm_latencies(latencies)
+        usage_before = llm_usage()
+        results = preprocess_data.analyze_stories_chunked(list(contents.items()), max_in_flight=args.llm_concurrency)
+        quality("analyze_chunked", results, usage_before)
+        return len(results), latencies
+
+    def analyze_local_stage():
+        from sentiment_classifier import ANALYZED_DATA_FILE, SentimentPreClassifier
+
+        latencies = []
+        track_llm_latencies(latencies)
+        started = time.perf_counter()
+        classifier = SentimentPreClassifier.train(iter_stories(ANALYZED_DATA_FILE))
+        train_seconds = time.perf_counter() - started
+        usage_before = llm_usage()
+        results = preprocess_data.analyze_stories(list(contents.items()), preclassifier=classifier)
+        quality("analyze_local", results, usage_before)
+        stages_extra["analyze_local"]["train_seconds"] = round(train_seconds, 3)
+        stages_extra["analyze_local"]["llm_calls_saved"] = round(
+            1 - stages_extra["analyze_local"]["llm_requests"] / len(results), 4)
+        return len(results), latencies
+
+    def geocode_stage():
+        latencies = []
+        store = StoryStoreWriter(os.path.splitext(geocoded_path)[0] + ".store")
+        stories = timed(geocode_stories.geocode_story_stream(iter_stories(analyzed_path)), latencies)
+        count = write_stories(geocoded_path, store.tee(stories))
+        store.close()
+        return count, latencies
+
+    def map_stage():
+        report = visualize_map.create_fast_story_map(geocoded_path, os.path.join(work_dir, "story_map.html"))
+        stages_extra["map"] = {"markers": report["markers"], "html_bytes": report["html_bytes"]}
+        return report["stories"], None
+
+    def legacy_map_stage():
+        visualize_map.OUTPUT_MAP_FILE = os.path.join(work_dir, "story_map_legacy.html")
+        visualize_map.create_story_map(geocoded_path)
+        return args.stories, None
+
+    stages = [("corpus", corpus_stage), ("load", load_stage), ("analyze", analyze_stage)]
+    if args.chunked:
+        stages.append(("analyze_chunked", analyze_chunked_stage))
+    if args.preclassify:
+        stages.append(("analyze_local", analyze_local_stage))
+    stages += [("geocode", geocode_stage), ("map", map_stage)]
+    if args.legacy_map:
+        stages.append(("map_old", legacy_map_stage))
+
+    print(f"🏁 Benchmarking {args.stories} stories in {work_dir}")
+    stages_extra = {}
+    report = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "work_dir")},
+        "stages": {},
+    }
+    try:
+        with open(os.path.join(work_dir, "benchmark.log"), "w", encoding="utf-8") as log_file:
+            for name, function in stages:
+                report["stages"][name] = run_stage(name, function, log_file, args.trace_memory)
+                report["stages"][name].update(stages_extra.get(name, {}))
+    finally:
+        for llm_server, _ in llm_servers:
+            llm_server.shutdown()
+        photon_server.shutdown()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"\n✅ Report saved to {output} (stage output in {os.path.join(work_dir, 'benchmark.log')})")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print_comparison(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+# evaluate_sentiment.py
+# Evaluation harness for the sentiment step of preprocess_data.py.
+# Scores one or more variants (LLM model x system prompt, and optionally the local classifier of
+# sentiment_classifier.py) against the manual labels stored in manual_labels.json, without
+# re-running the pipeline or re-labelling anything:
+#   - Story texts come from analyzed_stories.json (or the caller), not from the story files.
+#   - Predictions already in the persistent LLM cache are reused, so after editing one prompt
+#     only that variant's stories are sent to the LLM.
+#   - The requests of all variants share one worker pool, so variants are evaluated concurrently.
+# For every variant the accuracy, classification_report metrics, confusion matrix and timing are
+# written to evaluation_results/ (plus a confusion matrix chart with --plots).
+#
+# Usage:
+#   python evaluate_sentiment.py                                  # current MODEL and prompt
+#   python evaluate_sentiment.py --models mistral-7b,llama-3-8b   # compare models
+#   python evaluate_sentiment.py --prompts prompts/terse.txt      # a system prompt from a file
+#   python evaluate_sentiment.py --local                          # add the local classifier (alone and
+#                                                                 # in front of the default LLM)
+
+import argparse
+import importlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+from story_stream import iter_stories
+
+load_dotenv()
+
+# --- Configuration ---
+BASE_DIR = os.path.dirname(__file__)
+ANALYZED_DATA_FILE = os.path.join(BASE_DIR, "analyzed_stories.json")
+# A relative MANUAL_LABELS_PATH is resolved against BASE_DIR, not the working directory.
+MANUAL_LABELS_PATH = os.path.join(BASE_DIR, os.getenv("MANUAL_LABELS_PATH", "manual_labels.json"))
+RESULTS_DIR = os.path.join(BASE_DIR, "evaluation_results")
+
+# Order of the rows / columns of every confusion matrix and report.
+SENTIMENT_LABELS = ["positive", "neutral", "negative"]
+
+
+# -----------------------
+# Manual labels file
+# -----------------------
+def load_labels(path=MANUAL_LABELS_PATH):
+    """Returns the stored manual labels {story_id: sentiment} ({} if the file does not exist)."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_labels(labels, path=MANUAL_LABELS_PATH):
+    """Writes the manual labels atomically, sorted by story id."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(dict(sorted(labels.items())), f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def labels_from_records(records):
+    """Manual labels contained in analyzed story records (method "manual")."""
+    return {record["story_id"]: record["sentiment"] for record in records
+            if record.get("method") == "manual" and record.get("sentiment") in SENTIMENT_LABELS}
+
+
+def load_or_extract_labels(path=MANUAL_LABELS_PATH, data_file=ANALYZED_DATA_FILE):
+    """Loads the labels file, creating it from the manual rows of `data_file` on first use."""
+    labels = load_labels(path)
+    if not labels and os.path.exists(data_file):
+        labels = labels_from_records(iter_stories(data_file))
+        if labels:
+            save_labels(labels, path)
+            print(f"🏷️ Stored {len(labels)} manual labels from {data_file} in {path}")
+    return labels
+
+
+# -----------------------
+# Variants
+# -----------------------
+class Variant:
+    """
+    One configuration to evaluate:
+      - "llm": a model and system prompt (None = the preprocess_data defaults).
+      - "local": the local classifier alone, trained without the gold stories.
+      - "hybrid": the local classifier, with stories below LOCAL_SENTIMENT_THRESHOLD sent to the
+        LLM (what preprocess_data does with LOCAL_SENTIMENT=1).
+      - "chunked": map-reduce analysis of the full texts (LLM_CHUNKED=1) with the default model
+        and prompt; it is one task, so its requests are counted per story.
+    """
+
+    def __init__(self, name, kind="llm", model=None, system_prompt=None):
+        self.name = name
+        self.kind = kind
+        self.model = model
+        self.system_prompt = system_prompt
+
+
+def build_variants(models=(), prompt_files=(), local=False):
+    """Every combination of the given models and prompt files (the defaults when none are given)."""
+    prompts = [("default", None)]
+    if prompt_files:
+        prompts = []
+        for path in prompt_files:
+            with open(path, "r", encoding="utf-8") as f:
+                prompts.append((os.path.splitext(os.path.basename(path))[0], f.read()))
+    variants = []
+    for model in (models or [None]):
+        for prompt_name, system_prompt in prompts:
+            name = f"{model or 'default'}:{prompt_name}"
+            variants.append(Variant(name, "llm", model, system_prompt))
+    if local:
+        variants.append(Variant("local", "local"))
+        variants.append(Variant("hybrid", "hybrid"))
+    return variants
+
+
+def _safe_name(name):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
+
+
+# -----------------------
+# Evaluation
+# -----------------------
+def score(gold, predicted):
+    """
+    Accuracy, classification_report (as a dict) and confusion matrix of `predicted` against
+    `gold`, always over all three labels - also when the gold set or the predictions miss one.
+    """
+    from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
+
+    return {
+        "accuracy": accuracy_score(gold, predicted),
+        "report": classification_report(gold, predicted, labels=SENTIMENT_LABELS, target_names=SENTIMENT_LABELS,
+                                        output_dict=True, zero_division=0),
+        "confusion_matrix": confusion_matrix(gold, predicted, labels=SENTIMENT_LABELS).tolist(),
+    }
+
+
+def evaluate_variants(variants, gold, texts, max_workers=None, training_data=ANALYZED_DATA_FILE, pipeline=None):
+    """
+    Predicts the sentiment of every gold story with every variant and scores the predictions.
+
+    LLM variants analyze the first STORY_TRUNCATE_CHARS characters of each story, exactly as the
+    default preprocessing does; cached predictions are used without a request.
+
+    Args:
+        variants (list): Variant objects.
+        gold (dict): {story_id: manual sentiment}.
+        texts (dict): {story_id: story text} for every gold story.
+        max_workers (int): LLM requests in flight across all variants. Defaults to
+            LLM_MAX_CONCURRENCY per LLM server.
+        training_data (str or list): Records the local classifier is trained on (gold stories are
+            left out).
+        pipeline (module): The preprocess_data module to analyze with; preprocess_data.py passes
+            itself when it runs as a script, so its LLM client and cache are shared.
+
+    Returns:
+        dict: {variant name: {"predictions", "accuracy", "report", "confusion_matrix", "seconds",
+        "llm_requests", "cached", "errors"}}
+    """
+    # Importing preprocess_data sets up the LLM client; the labels helpers above do not need it.
+    preprocess_data = pipeline or importlib.import_module("preprocess_data")
+    from sentiment_classifier import LOCAL_SENTIMENT_THRESHOLD, SentimentPreClassifier
+
+    story_ids = [story_id for story_id in gold if story_id in texts]
+    missing = len(gold) - len(story_ids)
+    if missing:
+        print(f"⚠️ {missing} labelled stories have no text and are skipped.")
+    truncated = {story_id: texts[story_id][:preprocess_data.STORY_TRUNCATE_CHARS] for story_id in story_ids}
+    max_workers = preprocess_data.size_llm_pool(max_workers)
+
+    classifier = None
+    if any(variant.kind in ("local", "hybrid") for variant in variants):
+        records = iter_stories(training_data) if isinstance(training_data, str) else training_data
+        classifier = SentimentPreClassifier.train([record for record in records if record["story_id"] not in gold])
+
+    results = {}
+    chunked = []
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # One request per (model, prompt, story), shared by the variants that need it.
+        requests_by_key = {}
+        waiting = {}
+        for variant in variants:
+            state = results[variant.name] = {"predictions": {}, "llm_requests": 0, "cached": 0, "errors": 0,
+                                             "started": time.perf_counter(), "finished": None}
+            if variant.kind == "chunked":
+                chunked.append(variant)
+                continue
+
+            llm_stories = story_ids
+            if classifier is not None and variant.kind != "llm":
+                threshold = 0.0 if variant.kind == "local" else LOCAL_SENTIMENT_THRESHOLD
+                confident, uncertain = classifier.route([texts[story_id] for story_id in story_ids], threshold)
+                state["predictions"] = {story_ids[position]: label for position, (label, _) in confident.items()}
+                llm_stories = [story_ids[position] for position in uncertain]
+
+            for story_id in llm_stories:
+                # Keyed like sentiment_cache_key, so naming the default model or prompt explicitly
+                # shares the default variant's requests.
+                key = (variant.model or preprocess_data.MODEL,
+                       variant.system_prompt or preprocess_data.SENTIMENT_SYSTEM_PROMPT, story_id)
+                if key not in requests_by_key:
+                    # Each text is looked up in the cache once; a miss is not looked up again by
+                    # analyze_sentiment_lmstudio or by a later variant sharing the request.
+                    cached = None
+                    if preprocess_data.llm_cache is not None:
+                        cached = preprocess_data.llm_cache.get(preprocess_data.sentiment_cache_key(
+                            truncated[story_id], variant.model, variant.system_prompt))
+                    if cached is not None:
+                        state["predictions"][story_id] = cached[0]
+                        state["cached"] += 1
+                        continue
+                    requests_by_key[key] = executor.submit(
+                        preprocess_data.analyze_sentiment_lmstudio, truncated[story_id],
+                        model=variant.model, system_prompt=variant.system_prompt, cache_checked=True)
+                waiting.setdefault(requests_by_key[key], []).append((variant.name, story_id))
+            if len(state["predictions"]) == len(story_ids):
+                state["finished"] = time.perf_counter()
+
+        for future in as_completed(waiting):
+            sentiment, summary, _ = future.result()
+            for position, (name, story_id) in enumerate(waiting[future]):
+                state = results[name]
+                state["predictions"][story_id] = sentiment
+                # A request shared by several variants is counted once, for the first of them.
+                state["llm_requests"] += position == 0
+                state["errors"] += summary in preprocess_data.FAILED_SUMMARIES
+                state["finished"] = time.perf_counter()
+
+    # Chunked variants run their own pool of chunk and reduce requests, after the shared requests,
+    # so the LLM request counter (successful responses, cache hits excluded) covers only them.
+    for variant in chunked:
+        state = results[variant.name]
+        state["started"] = time.perf_counter()
+        with preprocess_data.token_usage_lock:
+            requests_before = preprocess_data.token_usage["requests"]
+        for story_id, sentiment, summary, _ in preprocess_data.analyze_stories_chunked(
+                [(story_id, texts[story_id]) for story_id in story_ids]):
+            state["predictions"][story_id] = sentiment
+            state["errors"] += summary in preprocess_data.FAILED_SUMMARIES
+        with preprocess_data.token_usage_lock:
+            state["llm_requests"] = preprocess_data.token_usage["requests"] - requests_before
+        state["finished"] = time.perf_counter()
+
+    for name, state in results.items():
+        predicted = [state["predictions"][story_id] for story_id in story_ids]
+        state.update(score([gold[story_id] for story_id in story_ids], predicted))
+        state["seconds"] = round(state.pop("finished") - state.pop("started"), 3)
+    print(f"⏱️ Evaluated {len(variants)} variants on {len(story_ids)} labelled stories in "
+          f"{time.perf_counter() - start_time:.1f}s")
+    return results
+
+
+def save_confusion_matrix_plot(matrix, path, title, predicted_label="Predicted"):
+    """Draws a confusion matrix (rows: manual labels) as a heatmap PNG."""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    plt.figure(figsize=(5, 4))
+    sns.heatmap(matrix, annot=True, fmt="d", cmap="Blues",
+                xticklabels=SENTIMENT_LABELS, yticklabels=SENTIMENT_LABELS)
+    plt.xlabel(predicted_label)
+    plt.ylabel("Actual (Manual)")
+    plt.title(title)
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+
+def write_results(results, variants, output_dir=RESULTS_DIR, plots=False):
+    """Writes one JSON file per variant and a summary.json comparing them; returns the summary."""
+    os.makedirs(output_dir, exist_ok=True)
+    summary = []
+    for variant in variants:
+        result = results[variant.name]
+        record = {"variant": variant.name, "kind": variant.kind, "model": variant.model,
+                  "system_prompt": variant.system_prompt, **result}
+        file_name = _safe_name(variant.name)
+        with open(os.path.join(output_dir, f"{file_name}.json"), "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, indent=4)
+        if plots:
+            save_confusion_matrix_plot(result["confusion_matrix"],
+                                       os.path.join(output_dir, f"confusion_matrix-{file_name}.png"),
+                                       f"Confusion Matrix - {variant.name}")
+        row = {key: record[key] for key in ("variant", "accuracy", "seconds", "llm_requests", "cached", "errors")}
+        row["macro_f1"] = result["report"]["macro avg"]["f1-score"]
+        summary.append(row)
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=4)
+    return summary
+
+
+def print_summary(summary):
+    print(f"\n{'variant':<40} {'accuracy':>8} {'macro F1':>8} {'seconds':>8} {'requests':>8} {'cached':>6}")
+    for row in summary:
+        print(f"{row['variant']:<40} {row['accuracy']:>8.3f} {row['macro_f1']:>8.3f} {row['seconds']:>8.2f} "
+              f"{row['llm_requests']:>8} {row['cached']:>6}"
+              + (f"  ({row['errors']} failed requests)" if row["errors"] else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate sentiment variants against the stored manual labels.")
+    parser.add_argument("--models", default="", help="Comma-separated model names (default: MODEL).")
+    parser.add_argument("--prompts", default="", help="Comma-separated files, each holding a system prompt.")
+    parser.add_argument("--local", action="store_true",
+                        help="Also evaluate the local sentiment classifier, alone and in front of the LLM.")
+    parser.add_argument("--labels", default=MANUAL_LABELS_PATH, help="Manual labels file.")
+    parser.add_argument("--data", default=ANALYZED_DATA_FILE, help="Story texts (analyzed_stories.json).")
+    parser.add_argument("--workers", type=int, default=None, help="LLM requests in flight across all variants.")
+    parser.add_argument("--output-dir", default=RESULTS_DIR)
+    parser.add_argument("--plots", action="store_true", help="Also draw a confusion matrix PNG per variant.")
+    args = parser.parse_args()
+
+    gold = load_or_extract_labels(args.labels, args.data)
+    if not gold:
+        print(f"❌ No manual labels found in {args.labels} or {args.data}.")
+        sys.exit(1)
+    texts = {record["story_id"]: record["text"] for record in iter_stories(args.data)}
+    variants = build_variants([m for m in args.models.split(",") if m],
+                              [p for p in args.prompts.split(",") if p], args.local)
+    results = evaluate_variants(variants, gold, texts, args.workers, args.data)
+    print_summary(write_results(results, variants, args.output_dir, args.plots))
+    print(f"\n📊 Per-variant metrics written to {args.output_dir}")
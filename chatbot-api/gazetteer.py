@@ -0,0 +1,182 @@
+# gazetteer.py
+# An offline gazetteer so the geocoding step can run without a Photon server.
+# Almost every place in the corpus is a Christchurch / Canterbury suburb, and most of them have
+# already been resolved once in geocoded_stories.json. This script turns those results (plus any
+# extra place lists) into a compact, sorted name index that answers exact, prefix and fuzzy
+# lookups in microseconds.
+#
+# Usage:
+#   python gazetteer.py build [places.csv ...]     # writes gazetteer_index.json
+#   python gazetteer.py lookup "Bexley Christchurch"
+#
+# Place list CSV files need the columns: name,latitude,longitude
+
+import bisect
+import csv
+import json
+import os
+import sys
+from collections import Counter, defaultdict
+from itertools import chain
+
+from dotenv import load_dotenv
+
+from geocode_cache import normalize_location
+from story_stream import iter_stories
+
+load_dotenv()
+
+# --- Configuration ---
+BASE_DIR = os.path.dirname(__file__)
+GEOCODED_DATA_FILE = os.path.join(BASE_DIR, "geocoded_stories.json")
+# A relative GAZETTEER_PATH is resolved against this directory, not the working directory.
+GAZETTEER_FILE = os.path.join(BASE_DIR, os.getenv("GAZETTEER_PATH", "gazetteer_index.json"))
+
+# When set, geocoding scripts answer from the cache and gazetteer only and never call Photon.
+OFFLINE_MODE = os.getenv("GEOCODE_OFFLINE", "0").lower() in ("1", "true", "yes")
+
+# Minimum trigram similarity (Jaccard) for a fuzzy match to be accepted.
+FUZZY_THRESHOLD = 0.6
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Gazetteer:
+    """
+    Sorted array of normalized place names with parallel latitude/longitude arrays.
+
+    Lookups try, in order: an exact match, the shortest name starting with the query
+    (e.g. "bexley" -> "bexley christchurch canterbury new zealand"), and the most similar
+    name by character trigrams.
+    """
+
+    def __init__(self, places):
+        """
+        Args:
+            places (dict): {place name: (latitude, longitude)}. Names are normalized here.
+        """
+        merged = {}
+        for name, (latitude, longitude) in places.items():
+            key = normalize_location(name)
+            if key:
+                merged[key] = (float(latitude), float(longitude))
+
+        self.names = sorted(merged)
+        self.latitudes = [merged[name][0] for name in self.names]
+        self.longitudes = [merged[name][1] for name in self.names]
+
+        # Trigram -> positions in self.names, used to shortlist fuzzy candidates.
+        self._trigram_index = defaultdict(list)
+        self._trigram_counts = []
+        for position, name in enumerate(self.names):
+            trigrams = _trigrams(name)
+            self._trigram_counts.append(len(trigrams))
+            for trigram in trigrams:
+                self._trigram_index[trigram].append(position)
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, location_name):
+        """
+        Returns {"latitude", "longitude"} for the best match, or None if nothing matches.
+        """
+        key = normalize_location(location_name)
+        if not key:
+            return None
+        position = self.exact(key)
+        if position is None:
+            position = self.prefix(key)
+        if position is None:
+            position = self.fuzzy(key)
+        if position is None:
+            return None
+        return {"latitude": self.latitudes[position], "longitude": self.longitudes[position]}
+
+    def exact(self, key):
+        """Returns the position of `key` in the sorted names, or None."""
+        position = bisect.bisect_left(self.names, key)
+        if position < len(self.names) and self.names[position] == key:
+            return position
+        return None
+
+    def prefix(self, key):
+        """Returns the position of the shortest name that starts with `key` as whole words, or None."""
+        start = bisect.bisect_left(self.names, key)
+        end = bisect.bisect_left(self.names, key + " \uffff")
+        candidates = [p for p in range(start, end) if self.names[p] == key or self.names[p].startswith(key + " ")]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda p: len(self.names[p]))
+
+    def fuzzy(self, key, threshold=FUZZY_THRESHOLD):
+        """Returns the position of the most similar name by trigram Jaccard similarity, or None."""
+        query = _trigrams(key)
+        shared = Counter(chain.from_iterable(self._trigram_index.get(trigram, ()) for trigram in query))
+
+        best_position, best_score = None, threshold
+        for position, overlap in shared.items():
+            score = overlap / (len(query) + self._trigram_counts[position] - overlap)
+            if score >= best_score:
+                best_position, best_score = position, score
+        return best_position
+
+    def save(self, path=GAZETTEER_FILE):
+        """Writes the index as compact parallel arrays."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"names": self.names, "latitudes": self.latitudes, "longitudes": self.longitudes},
+                      f, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path=GAZETTEER_FILE):
+        """Loads an index written by save()."""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(dict(zip(data["names"], zip(data["latitudes"], data["longitudes"]))))
+
+
+def load_default_gazetteer():
+    """Returns the gazetteer at GAZETTEER_FILE, or None if it has not been built yet."""
+    if not os.path.exists(GAZETTEER_FILE):
+        return None
+    return Gazetteer.load(GAZETTEER_FILE)
+
+
+def build_gazetteer(geocoded_path=GEOCODED_DATA_FILE, place_list_paths=()):
+    """
+    Builds a gazetteer from already-resolved story locations plus optional CSV place lists.
+    Entries from the place lists take precedence over story locations with the same name.
+    """
+    places = {}
+    if os.path.exists(geocoded_path):
+        for story in iter_stories(geocoded_path):
+            location = story.get("location") or {}
+            coordinates = location.get("coordinates")
+            if location.get("name") and coordinates:
+                places[location["name"]] = (coordinates["latitude"], coordinates["longitude"])
+
+    for path in place_list_paths:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                places[row["name"]] = (row["latitude"], row["longitude"])
+
+    return Gazetteer(places)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "build":
+        gazetteer = build_gazetteer(place_list_paths=sys.argv[2:])
+        gazetteer.save(GAZETTEER_FILE)
+        print(f"Saved gazetteer with {len(gazetteer)} places to {GAZETTEER_FILE}")
+    elif len(sys.argv) == 3 and sys.argv[1] == "lookup":
+        gazetteer = load_default_gazetteer()
+        if gazetteer is None:
+            print(f"No gazetteer found at {GAZETTEER_FILE}. Run 'python gazetteer.py build' first.")
+            sys.exit(1)
+        print(gazetteer.lookup(sys.argv[2]))
+    else:
+        print('Usage: python gazetteer.py build [places.csv ...] | lookup "<location name>"')
+        sys.exit(1)
@@ -4,18 +4,28 @@ This script runs a Flask web server to generate empathetic responses for the cha
 
 It exposes a /generate_response endpoint that accepts a user message and a story sentiment,
 then uses a Large Language Model (LLM) to generate a supportive and context-aware response.
+/generate_response/stream returns the same response as server-sent events, token by token.
+/search runs a full-text search over the analyzed stories (see story_search.py).
+/metrics exposes request and upstream metrics in the Prometheus text format (see metrics.py).
 """
 
 import os
 import json
 import requests
+import threading
 import time
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 
-# Load environment variables from .env file
+# Load environment variables from .env file, before the modules below read their settings.
 load_dotenv()
 
+from http_client import get_session
+from llm_client import LLMClient
+from metrics import instrument_flask_app, record_failure, register_cache_stats
+from response_cache import ResponseCache, make_response_cache_key
+from story_search import get_default_index as get_search_index, source_stamp
+
 # --- Flask App Initialization ---
 app = Flask(__name__)
 
@@ -24,22 +34,97 @@ app = Flask(__name__)
 LM_STUDIO_API = os.getenv("LM_STUDIO_API")
 MODEL = os.getenv("MODEL")
 
-# We don't need to load all stories into memory for this service,
-# as the sentiment will be passed in the API request.
+# Port for this service (generate_response_async.py serves the same API on the same port).
+RESPONSE_SERVICE_PORT = int(os.getenv("RESPONSE_SERVICE_PORT", "5002"))
 
-def generate_empathetic_response(user_message, story_sentiment, max_retries=3):
+# Fallback messages returned to the user when the LLM cannot produce a response.
+CONNECTION_FALLBACK = "I'm sorry, I'm having a little trouble connecting right now. Please know that I'm here to listen."
+ERROR_FALLBACK = "I'm sorry, something went wrong on my end. Thank you for your patience."
+GENERIC_FALLBACK = "I'm sorry, I couldn't generate a response. Please try again later."
+FALLBACK_MESSAGES = {CONNECTION_FALLBACK, ERROR_FALLBACK, GENERIC_FALLBACK}
+
+RESPONSE_TEMPERATURE = 0.7
+
+# Maximum number of requests sent to the LLM at the same time. The client lowers it while the
+# LLM is overloaded and fails fast with the fallback message while it is down (see llm_client.py).
+UPSTREAM_CONCURRENCY = int(os.getenv("RESPONSE_UPSTREAM_CONCURRENCY", "8"))
+# Total seconds a single chat request may take, including waiting for a free upstream slot.
+REQUEST_TIMEOUT = float(os.getenv("RESPONSE_REQUEST_TIMEOUT", "30"))
+llm_client = LLMClient(LM_STUDIO_API, UPSTREAM_CONCURRENCY, session=get_session("lmstudio", UPSTREAM_CONCURRENCY),
+                       timeout=60)
+
+# Optional response cache: identical (normalized) requests within the TTL reuse the last answer,
+# and identical concurrent requests share a single LLM call. Fallback messages are never cached.
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL) if RESPONSE_CACHE_ENABLED else None
+
+# Request latency / in-flight metrics and GET /metrics (see metrics.py).
+instrument_flask_app(app, "generate_response")
+if response_cache is not None:
+    register_cache_stats("response_cache", response_cache.stats)
+
+# Optional grounding: when enabled, the summary of the most similar survivor story (see
+# story_embeddings.py) is added to the prompt. The sentiment is still passed in the API request.
+RESPONSE_GROUNDING_ENABLED = os.getenv("RESPONSE_GROUNDING", "0").lower() in ("1", "true", "yes")
+# Minimum cosine similarity for a story to be considered related to the user's message.
+GROUNDING_MIN_SIMILARITY = float(os.getenv("RESPONSE_GROUNDING_MIN_SIMILARITY", "0.1"))
+
+GROUNDING_DATA_FILE = os.path.join(os.path.dirname(__file__), "analyzed_stories.json")
+
+_grounding = None
+_grounding_lock = threading.Lock()
+
+
+def load_grounding():
     """
-    Generates an empathetic response using an LLM.
-    
+    Returns the (embedding index, {story_id: summary}) used for grounding, loading both on first
+    use and again whenever analyzed_stories.json has changed (same stamp check as story_search.py).
+    Loading reads the whole data file, so the async service calls this off the event loop.
+    """
+    global _grounding
+    stamp = source_stamp(GROUNDING_DATA_FILE)
+    if _grounding is None or _grounding[0] != stamp:
+        with _grounding_lock:
+            if _grounding is None or _grounding[0] != stamp:
+                from story_embeddings import load_or_build_index
+                from story_stream import PLACEHOLDER_SUMMARIES, iter_stories
+                index = load_or_build_index(GROUNDING_DATA_FILE)
+                summaries = {story["story_id"]: story.get("summary") for story in iter_stories(GROUNDING_DATA_FILE)
+                             if story.get("summary") and story["summary"] not in PLACEHOLDER_SUMMARIES}
+                _grounding = (stamp, index, summaries)
+    return _grounding[1:]
+
+
+def find_similar_story_summary(user_message):
+    """
+    Returns the summary of the story most similar to `user_message`, or None if grounding is
+    disabled or no story is similar enough.
+    """
+    if not RESPONSE_GROUNDING_ENABLED:
+        return None
+    index, summaries = load_grounding()
+    for story_id, score in index.search(user_message, k=5):
+        if score < GROUNDING_MIN_SIMILARITY:
+            break
+        if story_id in summaries:
+            return summaries[story_id]
+    return None
+
+
+def build_response_payload(user_message, story_sentiment):
+    """
+    Builds the chat completions payload for an empathetic response.
+    Shared by the Flask service and the async serving mode (generate_response_async.py).
+
     Args:
         user_message (str): The user's input message.
         story_sentiment (str): The sentiment ('positive', 'negative', 'neutral') of a related story.
-        max_retries (int): The maximum number of times to retry the API call.
-    
+
     Returns:
-        str: The generated empathetic response, or a fallback message on failure.
+        dict: The JSON payload for the OpenAI-compatible API.
     """
-    
     # 1. Define the persona and instructions
     system_prompt = "You are Hope, an empathetic AI assistant for earthquake survivors. Your role is to listen, show understanding, and offer gentle support. Do not give medical or structural advice. Keep your responses concise (1-2 sentences)."
     
@@ -51,6 +136,10 @@ def generate_empathetic_response(user_message, story_sentiment, max_retries=3):
     else: # neutral
         instruction = "The user is sharing a factual or neutral experience. Respond in a gentle, listening manner."
 
+    similar_summary = find_similar_story_summary(user_message)
+    if similar_summary:
+        instruction += f" Another survivor shared a similar experience: \"{similar_summary}\" You may gently let the user know they are not alone, without quoting it."
+
     user_prompt = f"{instruction}\n\nUser's message: \"{user_message}\"\n\nYour supportive response:"
 
     # 3. Combine for the final prompt (Mistral-style)
@@ -62,37 +151,113 @@ def generate_empathetic_response(user_message, story_sentiment, max_retries=3):
         "messages": [
             {"role": "user", "content": full_prompt}
         ],
-        "temperature": 0.7,
+        "temperature": RESPONSE_TEMPERATURE,
         "max_tokens": 100
     }
+    return payload
 
-    # 5. Call the API with retry logic
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(LM_STUDIO_API, json=payload, timeout=60)
-            response.raise_for_status()
-            
-            data = response.json()
-            content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-            
-            if content:
-                return content.strip()
-            else:
-                raise Exception("LLM returned an empty response.")
-
-        except requests.exceptions.RequestException as e:
-            if attempt < max_retries - 1:
-                wait_time = 2**(attempt + 1)
-                print(f"⚠️ Error contacting LM Studio API (Attempt {attempt + 1}/{max_retries}): {e}. Retrying in {wait_time}s...")
-                time.sleep(wait_time)
-            else:
-                print(f"❌ LM Studio API failed after {max_retries} attempts: {e}")
-                return "I'm sorry, I'm having a little trouble connecting right now. Please know that I'm here to listen."
-        except Exception as e:
-            print(f"❌ An unexpected error occurred: {e}")
-            return "I'm sorry, something went wrong on my end. Thank you for your patience."
+def generate_empathetic_response(user_message, story_sentiment, max_retries=3):
+    """
+    Generates an empathetic response using an LLM.
     
-    return "I'm sorry, I couldn't generate a response. Please try again later."
+    Args:
+        user_message (str): The user's input message.
+        story_sentiment (str): The sentiment ('positive', 'negative', 'neutral') of a related story.
+        max_retries (int): The maximum number of times to retry the API call.
+    
+    Returns:
+        str: The generated empathetic response, or a fallback message on failure.
+    """
+    payload = build_response_payload(user_message, story_sentiment)
+
+    # 5. Call the API; llm_client retries transient failures with jittered backoff and fails
+    #    fast while the circuit breaker is open.
+    try:
+        response = llm_client.post(payload, "chat", queue_timeout=REQUEST_TIMEOUT, max_retries=max_retries)
+        data = response.json()
+        content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+
+        if content:
+            return content.strip()
+        record_failure("lmstudio", "empty", "LLM returned an empty response.")
+        print("❌ LLM returned an empty response.")
+        return ERROR_FALLBACK
+
+    except requests.exceptions.RequestException as e:
+        print(f"❌ LM Studio API failed: {e}")
+        return CONNECTION_FALLBACK
+    except Exception as e:
+        record_failure("lmstudio", "parse", e)
+        print(f"❌ An unexpected error occurred: {e}")
+        return ERROR_FALLBACK
+
+def format_sse(data, event=None):
+    """Formats one server-sent event carrying a JSON payload."""
+    message = f"data: {json.dumps(data)}\n\n"
+    if event:
+        message = f"event: {event}\n" + message
+    return message
+
+def parse_stream_line(line):
+    """
+    Parses one line of an OpenAI-compatible `stream: true` response.
+
+    Returns:
+        tuple: (done, text) where `done` marks the final "[DONE]" line and `text` is the
+        token delta ("" for keep-alives and chunks without content, such as the final usage
+        chunk with an empty `choices` list).
+    """
+    line = line.strip()
+    if not line.startswith("data:"):
+        return False, ""
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return True, ""
+    chunk = json.loads(data)
+    choices = chunk.get("choices") if isinstance(chunk, dict) else None
+    if not isinstance(choices, list) or not choices or not isinstance(choices[0], dict):
+        return False, ""
+    delta = choices[0].get("delta") or {}
+    return False, (delta.get("content") if isinstance(delta, dict) else None) or ""
+
+def stream_empathetic_response(user_message, story_sentiment):
+    """
+    Streams an empathetic response from the LLM as it is generated.
+    Uses the same sentiment-based prompt as generate_empathetic_response. If the upstream fails,
+    before or during the stream, the fallback message is sent as the last token instead of an error.
+
+    Yields:
+        str: Server-sent events: {"token": ...} for each chunk, then a final "done" event.
+    """
+    payload = build_response_payload(user_message, story_sentiment)
+    payload["stream"] = True
+    produced = False
+
+    try:
+        with llm_client.post(payload, "stream", stream=True, queue_timeout=REQUEST_TIMEOUT) as response:
+            # chunk_size=None hands over data as soon as it arrives instead of buffering 512 bytes.
+            for line in response.iter_lines(chunk_size=None):
+                done, text = parse_stream_line(line.decode("utf-8"))
+                if done:
+                    break
+                if text:
+                    produced = True
+                    yield format_sse({"token": text})
+        if not produced:
+            raise ValueError("LLM returned an empty response.")
+
+    except requests.exceptions.RequestException as e:
+        if produced:
+            # Failures before the first token were recorded by llm_client.
+            record_failure("lmstudio", "network", e)
+        print(f"❌ Streaming from LM Studio API failed: {e}")
+        yield format_sse({"token": (" " if produced else "") + CONNECTION_FALLBACK, "fallback": True})
+    except ValueError as e:
+        record_failure("lmstudio", "parse" if produced else "empty", e)
+        print(f"❌ An unexpected error occurred while streaming: {e}")
+        yield format_sse({"token": (" " if produced else "") + ERROR_FALLBACK, "fallback": True})
+
+    yield format_sse({}, event="done")
 
 @app.route("/generate_response", methods=["POST"])
 def handle_generate_response():
@@ -112,13 +277,83 @@ def handle_generate_response():
 
     print(f"--- Received request to generate response for sentiment: {story_sentiment} ---")
     
-    response_text = generate_empathetic_response(user_message, story_sentiment)
+    if response_cache is not None:
+        cache_key = make_response_cache_key(user_message, story_sentiment, MODEL, RESPONSE_TEMPERATURE)
+        response_text = response_cache.get_or_compute(
+            cache_key,
+            lambda: generate_empathetic_response(user_message, story_sentiment),
+            should_cache=lambda text: text not in FALLBACK_MESSAGES,
+        )
+    else:
+        response_text = generate_empathetic_response(user_message, story_sentiment)
     
     print(f"--- Generated response: {response_text} ---")
 
     return jsonify({"response": response_text})
 
+@app.route("/generate_response/stream", methods=["POST"])
+def handle_generate_response_stream():
+    """
+    Streaming variant of /generate_response.
+    Expects the same JSON body and answers with a text/event-stream of {"token": ...} events,
+    ending with an "event: done" message.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Invalid JSON"}), 400
+
+    user_message = data.get("user_message")
+    story_sentiment = data.get("story_sentiment")
+
+    if not user_message or not story_sentiment:
+        return jsonify({"error": "Missing 'user_message' or 'story_sentiment' in request body"}), 400
+
+    print(f"--- Received request to stream response for sentiment: {story_sentiment} ---")
+
+    return Response(
+        stream_with_context(stream_empathetic_response(user_message, story_sentiment)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route("/generate_response/stats", methods=["GET"])
+def handle_response_cache_stats():
+    """Returns response cache hit/miss/coalesced counters, or {"enabled": false} when the cache is off."""
+    if response_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(response_cache.stats(), enabled=True))
+
+def search_stories(args):
+    """
+    Runs a story search from request query parameters (q, k, sentiment, method, location,
+    from, to). Shared by the Flask service and the async serving mode.
+
+    Returns:
+        tuple: (JSON-serializable body, HTTP status)
+    """
+    try:
+        k = max(1, min(int(args.get("k", 10)), 100))
+        start = time.perf_counter()
+        results = get_search_index().search(
+            args.get("q", ""), k,
+            sentiment=args.get("sentiment"), method=args.get("method"), location=args.get("location"),
+            date_from=args.get("from"), date_to=args.get("to"),
+        )
+    except ValueError as e:
+        return {"error": f"Invalid search parameter: {e}"}, 400
+    took_ms = (time.perf_counter() - start) * 1000
+    return {"results": results, "count": len(results), "took_ms": round(took_ms, 3)}, 200
+
+@app.route("/search", methods=["GET"])
+def handle_search():
+    """
+    Full-text search over the analyzed stories, e.g.
+    GET /search?q=silt+driveway&sentiment=positive&location=bexley&from=2011-01-01&to=2012-12-31&k=10
+    """
+    body, status = search_stories(request.args)
+    return jsonify(body), status
+
 if __name__ == '__main__':
     # Run the Flask app on port 5002, which is different from the geocoding API (5001)
-    print("Starting empathetic response generation server on http://127.0.0.1:5002")
-    app.run(port=5002, debug=True)
+    print(f"Starting empathetic response generation server on http://127.0.0.1:{RESPONSE_SERVICE_PORT}")
+    app.run(port=RESPONSE_SERVICE_PORT, debug=True)
@@ -0,0 +1,351 @@
+# generate_response_async.py
+"""
+Production serving mode for the empathetic response service.
+
+Serves the same POST /generate_response API as generate_response.py, but on an asyncio (aiohttp)
+server: while a request waits for the LLM or sits in retry backoff it does not hold a worker thread,
+so a single process can keep many chat users in flight. Upstream calls share one pooled
+keep-alive client session and are capped by a concurrency limit; requests beyond the limit wait
+in a bounded queue and are rejected with 503 once the queue is full.
+
+/generate_response/stream relays tokens as server-sent events, GET /search queries the story
+index and GET /metrics exposes request and upstream metrics, like the Flask service.
+
+Run with:
+    python generate_response_async.py
+"""
+
+import asyncio
+import os
+import time
+
+from aiohttp import ClientConnectionError, ClientError, ClientResponseError, ClientSession, ClientTimeout, TCPConnector, web
+
+from generate_response import (
+    CONNECTION_FALLBACK,
+    ERROR_FALLBACK,
+    FALLBACK_MESSAGES,
+    GENERIC_FALLBACK,
+    MODEL,
+    RESPONSE_GROUNDING_ENABLED,
+    RESPONSE_SERVICE_PORT,
+    RESPONSE_TEMPERATURE,
+    REQUEST_TIMEOUT,
+    UPSTREAM_CONCURRENCY,
+    build_response_payload,
+    format_sse,
+    llm_client,
+    load_grounding,
+    parse_stream_line,
+    response_cache,
+    search_stories,
+)
+from llm_client import RETRYABLE_STATUSES, UpstreamUnavailable, backoff_delay, request_size
+from metrics import (
+    aiohttp_middleware,
+    handle_metrics,
+    record_failure,
+    record_retry,
+    upstream_in_flight,
+    upstream_queue_wait,
+    upstream_request_duration,
+)
+from response_cache import make_response_cache_key
+
+# --- Configuration ---
+# UPSTREAM_CONCURRENCY (max concurrent LLM requests) and REQUEST_TIMEOUT (total seconds per chat
+# request, including retries and backoff) are shared with generate_response.py.
+# Maximum number of requests allowed to wait for an upstream slot before new ones get a 503.
+MAX_QUEUE_DEPTH = int(os.getenv("RESPONSE_MAX_QUEUE_DEPTH", "64"))
+
+def is_retryable(error):
+    """True for connection errors, timeouts, 429 and 5xx responses (see llm_client.is_retryable)."""
+    if isinstance(error, ClientResponseError):
+        return error.status in RETRYABLE_STATUSES
+    return isinstance(error, (ClientConnectionError, asyncio.TimeoutError))
+
+
+async def build_payload_async(user_message, story_sentiment):
+    """
+    build_response_payload, run on a worker thread when grounding is on: the first request after
+    analyzed_stories.json changes reloads the story index, which must not block the event loop.
+    """
+    if not RESPONSE_GROUNDING_ENABLED:
+        return build_response_payload(user_message, story_sentiment)
+    return await asyncio.get_running_loop().run_in_executor(None, build_response_payload, user_message, story_sentiment)
+
+
+async def generate_empathetic_response_async(app, user_message, story_sentiment, max_retries=3):
+    """
+    Async counterpart of generate_response.generate_empathetic_response.
+
+    An upstream slot is held only while the HTTP call is in progress; retry backoff uses
+    asyncio.sleep, so waiting requests cost no threads and do not block other users. Backends
+    are chosen, and their health tracked, by the shared LLM client (llm_client.py): only
+    transient failures are retried (on another backend, or after a jittered backoff), and
+    nothing is sent while every backend's circuit breaker is open.
+
+    Returns:
+        str: The generated empathetic response, or a fallback message on failure.
+    """
+    payload = await build_payload_async(user_message, story_sentiment)
+    deadline = time.monotonic() + REQUEST_TIMEOUT
+    failed_backends = set()
+
+    for attempt in range(max_retries):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        outcome = "error"
+        queued = time.perf_counter()
+        try:
+            # Waiting for a slot counts against the same deadline as the call itself.
+            await asyncio.wait_for(app["upstream_slots"].acquire(), remaining)
+        except asyncio.TimeoutError:
+            error = UpstreamUnavailable(f"No lmstudio slot free within {REQUEST_TIMEOUT}s")
+            record_failure("lmstudio", "queue_timeout", error)
+            print(f"❌ LM Studio API unavailable: {error}")
+            return CONNECTION_FALLBACK
+        try:
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                backend, ticket = llm_client.acquire_nowait(avoid=failed_backends)
+                started = time.perf_counter()
+                upstream_queue_wait.observe(started - queued, upstream="lmstudio")
+                latency, error = None, None
+                try:
+                    with upstream_in_flight.track_inprogress(upstream="lmstudio"):
+                        async with app["client_session"].post(
+                            backend.url, json=payload, timeout=ClientTimeout(total=remaining)
+                        ) as response:
+                            latency = time.perf_counter() - started
+                            response.raise_for_status()
+                            data = await response.json()
+                    outcome = "ok"
+                except BaseException as e:
+                    # Any failure, including a bad body or a cancelled task, must free the slot.
+                    error = e
+                    raise
+                finally:
+                    llm_client.complete(backend, ticket, started, latency, error=error,
+                                        retryable=error is not None and is_retryable(error),
+                                        size=request_size(payload))
+                    upstream_request_duration.observe(time.perf_counter() - started,
+                                                      upstream="lmstudio", operation="chat", outcome=outcome)
+            finally:
+                app["upstream_slots"].release()
+
+            content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+            if content:
+                return content.strip()
+            raise ValueError("LLM returned an empty response.")
+
+        except UpstreamUnavailable as e:
+            # Recorded by the client; every backend's circuit breaker is open.
+            print(f"❌ LM Studio API unavailable: {e}")
+            return CONNECTION_FALLBACK
+        except (ClientError, asyncio.TimeoutError) as e:
+            retryable = is_retryable(e)
+            cause = f"http_{e.status}" if isinstance(e, ClientResponseError) else "network"
+            failed_backends.add(backend)
+            wait_time = 0.0 if llm_client.has_other_healthy_backend(failed_backends) else backoff_delay(attempt + 1)
+            if (retryable and attempt < max_retries - 1 and llm_client.available()
+                    and time.monotonic() + wait_time < deadline):
+                record_retry("lmstudio", cause, attempt + 1, repr(e))
+                print(f"⚠️ Error contacting {backend.name} (Attempt {attempt + 1}/{max_retries}): {e!r}. Retrying in {wait_time:.1f}s...")
+                await asyncio.sleep(wait_time)
+            else:
+                record_failure("lmstudio", cause, repr(e))
+                print(f"❌ LM Studio API failed after {attempt + 1} attempts: {e!r}")
+                return CONNECTION_FALLBACK
+        except Exception as e:
+            record_failure("lmstudio", "parse", e)
+            print(f"❌ An unexpected error occurred: {e}")
+            return ERROR_FALLBACK
+
+    return GENERIC_FALLBACK
+
+
+async def handle_generate_response(request):
+    """
+    aiohttp route for POST /generate_response.
+    Expects a JSON body with 'user_message' and 'story_sentiment'.
+    """
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not data:
+        return web.json_response({"error": "Invalid JSON"}, status=400)
+
+    user_message = data.get("user_message")
+    story_sentiment = data.get("story_sentiment")
+
+    if not user_message or not story_sentiment:
+        return web.json_response({"error": "Missing 'user_message' or 'story_sentiment' in request body"}, status=400)
+
+    app = request.app
+    if app["in_flight"] >= UPSTREAM_CONCURRENCY + MAX_QUEUE_DEPTH:
+        return web.json_response({"error": "Server is busy, please retry shortly."}, status=503,
+                                 headers={"Retry-After": "1"})
+
+    app["in_flight"] += 1
+    try:
+        if response_cache is not None:
+            cache_key = make_response_cache_key(user_message, story_sentiment, MODEL, RESPONSE_TEMPERATURE)
+            response_text = await response_cache.get_or_compute_async(
+                cache_key,
+                lambda: generate_empathetic_response_async(app, user_message, story_sentiment),
+                should_cache=lambda text: text not in FALLBACK_MESSAGES,
+            )
+        else:
+            response_text = await generate_empathetic_response_async(app, user_message, story_sentiment)
+    finally:
+        app["in_flight"] -= 1
+
+    return web.json_response({"response": response_text})
+
+
+async def handle_generate_response_stream(request):
+    """
+    aiohttp route for POST /generate_response/stream (server-sent events).
+    The upstream slot is held for the whole stream; on upstream failure the fallback message is
+    sent as the last token, followed by the "done" event.
+    """
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not data:
+        return web.json_response({"error": "Invalid JSON"}, status=400)
+
+    user_message = data.get("user_message")
+    story_sentiment = data.get("story_sentiment")
+
+    if not user_message or not story_sentiment:
+        return web.json_response({"error": "Missing 'user_message' or 'story_sentiment' in request body"}, status=400)
+
+    app = request.app
+    if app["in_flight"] >= UPSTREAM_CONCURRENCY + MAX_QUEUE_DEPTH:
+        return web.json_response({"error": "Server is busy, please retry shortly."}, status=503,
+                                 headers={"Retry-After": "1"})
+
+    # Counted from here, so requests still preparing their stream or payload count towards the limit.
+    app["in_flight"] += 1
+    try:
+        stream = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        })
+        await stream.prepare(request)
+
+        payload = await build_payload_async(user_message, story_sentiment)
+        payload["stream"] = True
+        produced = False
+
+        queued = time.perf_counter()
+        try:
+            async with app["upstream_slots"]:
+                backend, ticket = llm_client.acquire_nowait()
+                started = time.perf_counter()
+                upstream_queue_wait.observe(started - queued, upstream="lmstudio")
+                latency, error = None, None
+                try:
+                    async with app["client_session"].post(
+                        backend.url, json=payload, timeout=ClientTimeout(total=REQUEST_TIMEOUT)
+                    ) as response:
+                        latency = time.perf_counter() - started
+                        response.raise_for_status()
+                        async for line in response.content:
+                            done, text = parse_stream_line(line.decode("utf-8"))
+                            if done:
+                                break
+                            if text:
+                                produced = True
+                                await stream.write(format_sse({"token": text}).encode("utf-8"))
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    # The backend counts as busy for the whole stream; its latency is time to first byte.
+                    llm_client.complete(backend, ticket, started, latency, error=error,
+                                        retryable=error is not None and not produced and is_retryable(error),
+                                        size=request_size(payload))
+            if not produced:
+                raise ValueError("LLM returned an empty response.")
+
+        except UpstreamUnavailable as e:
+            print(f"❌ LM Studio API unavailable: {e}")
+            await stream.write(format_sse({"token": CONNECTION_FALLBACK, "fallback": True}).encode("utf-8"))
+        except (ClientError, asyncio.TimeoutError) as e:
+            record_failure("lmstudio", "network", repr(e))
+            print(f"❌ Streaming from LM Studio API failed: {e!r}")
+            fallback = (" " if produced else "") + CONNECTION_FALLBACK
+            await stream.write(format_sse({"token": fallback, "fallback": True}).encode("utf-8"))
+        except ValueError as e:
+            record_failure("lmstudio", "parse" if produced else "empty", e)
+            print(f"❌ An unexpected error occurred while streaming: {e}")
+            fallback = (" " if produced else "") + ERROR_FALLBACK
+            await stream.write(format_sse({"token": fallback, "fallback": True}).encode("utf-8"))
+
+        await stream.write(format_sse({}, event="done").encode("utf-8"))
+        await stream.write_eof()
+        return stream
+    finally:
+        app["in_flight"] -= 1
+
+
+async def handle_response_cache_stats(request):
+    """Returns response cache hit/miss/coalesced counters."""
+    if response_cache is None:
+        return web.json_response({"enabled": False})
+    return web.json_response(dict(response_cache.stats(), enabled=True))
+
+
+async def handle_search(request):
+    """
+    aiohttp route for GET /search (same parameters as the Flask service). Runs on a worker thread:
+    the first search after analyzed_stories.json changes rebuilds the index.
+    """
+    body, status = await asyncio.get_running_loop().run_in_executor(None, search_stories, request.query)
+    return web.json_response(body, status=status)
+
+
+async def open_client_session(app):
+    """Creates the shared upstream session and concurrency limiter when the server starts."""
+    app["client_session"] = ClientSession(connector=TCPConnector(limit=UPSTREAM_CONCURRENCY))
+    app["upstream_slots"] = asyncio.Semaphore(UPSTREAM_CONCURRENCY)
+    app["in_flight"] = 0
+
+
+async def load_grounding_index(app):
+    """Loads the grounding index at startup (on a worker thread) instead of on the first request."""
+    if RESPONSE_GROUNDING_ENABLED:
+        await asyncio.get_running_loop().run_in_executor(None, load_grounding)
+
+
+async def close_client_session(app):
+    await app["client_session"].close()
+
+
+def create_app():
+    """Builds the aiohttp application."""
+    app = web.Application(middlewares=[aiohttp_middleware("generate_response_async")])
+    app.router.add_post("/generate_response", handle_generate_response)
+    app.router.add_post("/generate_response/stream", handle_generate_response_stream)
+    app.router.add_get("/generate_response/stats", handle_response_cache_stats)
+    app.router.add_get("/search", handle_search)
+    app.router.add_get("/metrics", handle_metrics)
+    app.on_startup.append(open_client_session)
+    app.on_startup.append(load_grounding_index)
+    app.on_cleanup.append(close_client_session)
+    return app
+
+
+if __name__ == '__main__':
+    print(f"Starting async empathetic response server on http://127.0.0.1:{RESPONSE_SERVICE_PORT} "
+          f"(upstream concurrency {UPSTREAM_CONCURRENCY}, queue depth {MAX_QUEUE_DEPTH})")
+    web.run_app(create_app(), host="127.0.0.1", port=RESPONSE_SERVICE_PORT, print=None)
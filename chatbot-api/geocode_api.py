@@ -3,9 +3,29 @@
 # It is designed to work with a local instance of the Photon geocoder: https://github.com/komoot/photon
 # By using a local geocoder, we avoid rate limits and costs associated with public APIs.
 
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
 from flask import Flask, request, jsonify
 import requests
 
+# Load environment variables from .env file, before the modules below read their settings.
+load_dotenv()
+
+from geocode_cache import GeocodeCache, normalize_location
+from http_client import get_session
+from metrics import (
+    instrument_flask_app,
+    record_failure,
+    register_cache_stats,
+    upstream_in_flight,
+    upstream_queue_wait,
+    upstream_request_duration,
+)
+from story_map_index import GEOCODED_DATA_FILE, load_story_map_index
+
 # --- Flask App Initialization ---
 app = Flask(__name__)
 
@@ -14,15 +34,83 @@ app = Flask(__name__)
 # The default port for Photon is 2322.
 PHOTON_URL = "http://127.0.0.1:2322/api"
 
-# In-memory cache to store geocoding results and avoid redundant requests.
-geocode_cache = {}
+# Seconds to wait for Photon before giving up on a single lookup.
+PHOTON_TIMEOUT = float(os.getenv("PHOTON_TIMEOUT", "10"))
+# Maximum number of Photon lookups in flight at once (shared by all batch requests).
+PHOTON_MAX_CONCURRENCY = int(os.getenv("PHOTON_MAX_CONCURRENCY", "8"))
+# Maximum number of location names accepted by one /geocode/batch request.
+MAX_BATCH_SIZE = 500
+
+# Pooled keep-alive connections to Photon and a bounded pool of workers for batch fan-out.
+photon_session = get_session("photon", PHOTON_MAX_CONCURRENCY)
+photon_executor = ThreadPoolExecutor(max_workers=PHOTON_MAX_CONCURRENCY)
+
+# Persistent cache (shared with the offline scripts) to avoid redundant requests.
+# Both found coordinates and "not found" answers are cached, each with its own TTL.
+geocode_cache = GeocodeCache()
+
+# Request latency / in-flight metrics and GET /metrics (see metrics.py).
+instrument_flask_app(app, "geocode_api")
+register_cache_stats("geocode_cache", geocode_cache.stats)
+
+def query_photon(location_name, queued_at=None):
+    """
+    Geocodes one location with the local Photon server and caches the answer.
+
+    Args:
+        location_name (str): The place to look up.
+        queued_at (float): time.perf_counter() when the lookup was queued for a batch worker,
+            used to record the queue wait.
+
+    Returns:
+        dict or None: {"latitude", "longitude"}, or None if Photon found no match.
+
+    Raises:
+        requests.exceptions.RequestException: If Photon is unreachable or times out.
+        ValueError: If Photon's answer is not a JSON object.
+    """
+    started = time.perf_counter()
+    if queued_at is not None:
+        upstream_queue_wait.observe(started - queued_at, upstream="photon")
+
+    # Send a GET request to the local Photon server.
+    params = {"q": normalize_location(location_name)}
+    outcome = "error"
+    try:
+        with upstream_in_flight.track_inprogress(upstream="photon"):
+            response = photon_session.get(PHOTON_URL, params=params, timeout=PHOTON_TIMEOUT)
+        response.raise_for_status()  # Raise an HTTPError for bad responses (4xx or 5xx)
+
+        data = response.json()
+        if not isinstance(data, dict):
+            raise ValueError(f"Expected a JSON object from Photon, got {type(data).__name__}")
+        outcome = "ok" if data.get('features') else "not_found"
+    finally:
+        upstream_request_duration.observe(time.perf_counter() - started,
+                                          upstream="photon", operation="search", outcome=outcome)
+
+    # Photon returns results in a 'features' array.
+    # We take the first result as the most likely match.
+    if data and data.get('features'):
+        # The coordinates are in [longitude, latitude] format.
+        coordinates = data['features'][0]['geometry']['coordinates']
+        result = {
+            "latitude": coordinates[1],
+            "longitude": coordinates[0]
+        }
+    else:
+        # Location was not found by Photon; remember that too.
+        result = None
+
+    geocode_cache.set(location_name, result)
+    return result
 
 @app.route('/geocode', methods=['POST'])
 def geocode_location():
     """
     Handles the /geocode endpoint.
     Receives a location name, geocodes it using the local Photon server, and returns the coordinates.
-    It uses an in-memory cache to speed up repeated requests for the same location.
+    It uses a persistent cache to speed up repeated requests for the same location.
 
     Request Body (JSON):
         {
@@ -38,46 +126,141 @@ def geocode_location():
         return jsonify({"error": "No location provided"}), 400
 
     # Return cached result if available.
-    if location_name in geocode_cache:
+    found, cached = geocode_cache.get(location_name)
+    if found:
         print(f"Returning cached result for: {location_name}")
-        return jsonify(geocode_cache[location_name])
+        if cached is None:
+            return jsonify({"error": "Location not found"}), 404
+        return jsonify(cached)
 
     print(f"Geocoding '{location_name}' using local Photon server...")
     
     try:
-        # Send a GET request to the local Photon server.
-        params = {"q": location_name}
-        response = requests.get(PHOTON_URL, params=params)
-        response.raise_for_status()  # Raise an HTTPError for bad responses (4xx or 5xx)
-
-        data = response.json()
-        
-        # Photon returns results in a 'features' array.
-        # We take the first result as the most likely match.
-        if data and data.get('features'):
-            # The coordinates are in [longitude, latitude] format.
-            coordinates = data['features'][0]['geometry']['coordinates']
-            result = {
-                "latitude": coordinates[1],
-                "longitude": coordinates[0]
-            }
-            
-            # Cache the successful result.
-            geocode_cache[location_name] = result
-            return jsonify(result)
-        else:
-            # Location was not found by Photon.
+        result = query_photon(location_name)
+        if result is None:
             return jsonify({"error": "Location not found"}), 404
+        return jsonify(result)
 
     except requests.exceptions.RequestException as e:
         # Handle network errors (e.g., connection refused if Photon server is not running).
+        record_failure("photon", "network", e)
         print(f"Error connecting to local Photon server: {e}")
         return jsonify({"error": "Failed to connect to local geocoding server. Is Photon running?"}), 503
     except Exception as e:
         # Handle other potential errors (e.g., JSON decoding).
+        record_failure("photon", "parse", e)
         print(f"An unexpected error occurred: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/geocode/batch', methods=['POST'])
+def geocode_batch():
+    """
+    Handles the /geocode/batch endpoint.
+    Geocodes many location names in one request. Duplicate names (after normalization) are looked
+    up once, cached names are answered immediately, and the remaining names are sent to Photon
+    concurrently (at most PHOTON_MAX_CONCURRENCY at a time).
+
+    Request Body (JSON):
+        {
+            "locations": ["Sumner", "Lyttelton", ...]
+        }
+
+    Returns:
+        JSON response with one result per input name, in input order:
+        {"results": [{"location": ..., "status": "ok" | "not_found" | "error" | "invalid",
+                      "latitude": ..., "longitude": ..., "cached": bool}, ...]}
+    """
+    data = request.get_json(silent=True) or {}
+    locations = data.get('locations')
+    if not isinstance(locations, list) or not locations:
+        return jsonify({"error": "'locations' must be a non-empty list"}), 400
+    if len(locations) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} locations per batch"}), 400
+
+    # Resolve each distinct normalized name once.
+    resolved = {}
+    pending = {}
+    for location_name in locations:
+        if not isinstance(location_name, str) or not location_name.strip():
+            continue
+        key = normalize_location(location_name)
+        if key in resolved or key in pending:
+            continue
+        found, cached = geocode_cache.get(location_name)
+        if found:
+            resolved[key] = ("ok" if cached else "not_found", cached, True)
+        else:
+            pending[key] = photon_executor.submit(query_photon, location_name, time.perf_counter())
+
+    if pending:
+        print(f"Geocoding {len(pending)} uncached locations using local Photon server...")
+    for key, future in pending.items():
+        try:
+            result = future.result()
+            resolved[key] = ("ok" if result else "not_found", result, False)
+        except requests.exceptions.RequestException as e:
+            record_failure("photon", "network", e)
+            print(f"Error connecting to local Photon server: {e}")
+            resolved[key] = ("error", None, False)
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            # A malformed Photon body only fails this location, not the whole batch.
+            record_failure("photon", "parse", e)
+            print(f"Unexpected response from local Photon server for '{key}': {e!r}")
+            resolved[key] = ("error", None, False)
+
+    results = []
+    for location_name in locations:
+        if not isinstance(location_name, str) or not location_name.strip():
+            results.append({"location": location_name, "status": "invalid"})
+            continue
+        status, coordinates, cached = resolved[normalize_location(location_name)]
+        item = {"location": location_name, "status": status, "cached": cached}
+        if coordinates:
+            item.update(coordinates)
+        results.append(item)
+
+    return jsonify({"results": results})
+
+@app.route('/geocode/stats', methods=['GET'])
+def geocode_cache_stats():
+    """Returns hit/miss counters and the hit rate of the geocode cache."""
+    return jsonify(geocode_cache.stats())
+
+# Spatial index over geocoded_stories.json, rebuilt when geocode_stories.py rewrites the file.
+_story_map = {"index": None, "mtime": None}
+_story_map_lock = threading.Lock()
+
+def get_story_map_index():
+    """Returns the cluster index for the current geocoded_stories.json."""
+    mtime = os.stat(GEOCODED_DATA_FILE).st_mtime_ns
+    with _story_map_lock:
+        if _story_map["mtime"] != mtime:
+            _story_map["index"] = load_story_map_index(GEOCODED_DATA_FILE)
+            _story_map["mtime"] = mtime
+        return _story_map["index"]
+
+@app.route('/map/clusters', methods=['GET'])
+def story_map_clusters():
+    """
+    Returns pre-aggregated story clusters for a map viewport instead of the raw stories.
+    Query parameters: bbox=west,south,east,north (degrees) and zoom (map zoom level), e.g.
+    GET /map/clusters?bbox=172.4,-43.7,172.9,-43.4&zoom=12
+    """
+    try:
+        west, south, east, north = (float(value) for value in request.args["bbox"].split(","))
+        zoom = int(request.args.get("zoom", 12))
+    except (KeyError, ValueError):
+        return jsonify({"error": "Expected bbox=west,south,east,north and an integer zoom"}), 400
+    if south > north:
+        return jsonify({"error": "bbox south must not be greater than north"}), 400
+
+    try:
+        story_map_index = get_story_map_index()
+    except FileNotFoundError:
+        return jsonify({"error": "No geocoded stories yet. Run geocode_stories.py first."}), 404
+    clusters = story_map_index.clusters(west, south, east, north, zoom)
+    return jsonify({"zoom": zoom, "clusters": clusters, "stories": sum(c["count"] for c in clusters)})
+
 if __name__ == '__main__':
     # Run the Flask app on port 5001.
     # This port should be different from the main Node.js server port.
@@ -0,0 +1,142 @@
+# geocode_cache.py
+# A persistent geocoding cache shared by geocode_api.py, geocode_stories.py and visualize_map.py.
+# Results survive restarts in a small SQLite database, so the ~190 distinct location strings in the
+# corpus are only sent to Photon once. Both found coordinates and "not found" answers are stored,
+# each with its own time-to-live, and a bounded in-memory LRU layer keeps hot entries off the disk.
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# --- Configuration ---
+# A relative GEOCODE_CACHE_PATH is resolved against this directory, not the working directory.
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(__file__), os.getenv("GEOCODE_CACHE_PATH", "geocode_cache.sqlite3")
+)
+# Found coordinates rarely change; "not found" answers are retried sooner in case Photon's data improves.
+POSITIVE_TTL_SECONDS = int(os.getenv("GEOCODE_CACHE_TTL", str(30 * 24 * 3600)))
+NEGATIVE_TTL_SECONDS = int(os.getenv("GEOCODE_CACHE_NEGATIVE_TTL", str(24 * 3600)))
+MEMORY_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_MEMORY_SIZE", "1024"))
+
+# Misspellings and abbreviations that occur in the story file names.
+KNOWN_MISSPELLINGS = {
+    "christhchurch": "christchurch",
+    "chritchurch": "christchurch",
+    "christchruch": "christchurch",
+    "chch": "christchurch",
+    "lyttleton": "lyttelton",
+}
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_location(location_name):
+    """
+    Returns the cache key for a location name: lower-cased, whitespace collapsed and
+    known misspellings corrected (e.g. "Christhchurch  Hospital" -> "christchurch hospital").
+    """
+    words = _WHITESPACE_RE.split(location_name.strip().lower())
+    return " ".join(KNOWN_MISSPELLINGS.get(word, word) for word in words if word)
+
+
+class GeocodeCache:
+    """
+    Two-level (memory LRU + SQLite) cache mapping normalized location names to coordinates.
+
+    Coordinates are stored as {"latitude": float, "longitude": float}; None marks a location
+    that the geocoder could not find (negative cache entry).
+    """
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH, positive_ttl=POSITIVE_TTL_SECONDS,
+                 negative_ttl=NEGATIVE_TTL_SECONDS, memory_size=MEMORY_CACHE_SIZE):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "negative_hits": 0, "misses": 0, "expired": 0}
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocode ("
+            " key TEXT PRIMARY KEY,"
+            " latitude REAL,"
+            " longitude REAL,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, location_name):
+        """
+        Looks up a location.
+
+        Returns:
+            tuple: (found, coordinates). `found` is False on a miss; otherwise `coordinates`
+            is the cached dict, or None for a cached "not found" answer.
+        """
+        key = normalize_location(location_name)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[1] > now:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return self._found(entry[0])
+
+            row = self._conn.execute(
+                "SELECT latitude, longitude, expires_at FROM geocode WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._stats["misses"] += 1
+                return False, None
+            if row[2] <= now:
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                self._conn.execute("DELETE FROM geocode WHERE key = ?", (key,))
+                self._conn.commit()
+                self._memory.pop(key, None)
+                return False, None
+
+            coordinates = None if row[0] is None else {"latitude": row[0], "longitude": row[1]}
+            self._remember(key, coordinates, row[2])
+            self._stats["disk_hits"] += 1
+            return self._found(coordinates)
+
+    def set(self, location_name, coordinates):
+        """Stores coordinates (or None for "not found") with the matching TTL."""
+        key = normalize_location(location_name)
+        ttl = self.positive_ttl if coordinates else self.negative_ttl
+        expires_at = time.time() + ttl
+        latitude = coordinates["latitude"] if coordinates else None
+        longitude = coordinates["longitude"] if coordinates else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode (key, latitude, longitude, expires_at) VALUES (?, ?, ?, ?)",
+                (key, latitude, longitude, expires_at),
+            )
+            self._conn.commit()
+            self._remember(key, coordinates, expires_at)
+
+    def stats(self):
+        """Returns hit/miss counters and the overall hit rate."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
+
+    def _found(self, coordinates):
+        if coordinates is None:
+            self._stats["negative_hits"] += 1
+        return True, coordinates
+
+    def _remember(self, key, coordinates, expires_at):
+        self._memory[key] = (coordinates, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
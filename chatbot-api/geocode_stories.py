@@ -1,11 +1,27 @@
 # geocode_stories.py
 # This script reads the analyzed stories, geocodes their locations using a local Photon server,
 # and saves the enriched data to a new JSON file for the API to serve.
+#
+# Stories are streamed one record at a time, so it can also run as a pipe stage (JSONL on stdin/stdout):
+#   python geocode_stories.py analyzed_stories.jsonl - | python visualize_map.py -
+#
+# Alongside a file output it also writes a compact columnar store for servers (see story_store.py),
+# e.g. geocoded_stories.json -> geocoded_stories.store/.
 
-import json
 import os
-import re
+import sys
 import requests
+from dotenv import load_dotenv
+
+# Load environment variables from .env file, before the modules below read their settings.
+load_dotenv()
+
+from gazetteer import OFFLINE_MODE, load_default_gazetteer
+from geocode_cache import GeocodeCache, normalize_location
+from http_client import get_session
+from story_metadata import story_metadata
+from story_store import StoryStoreWriter
+from story_stream import iter_stories, write_stories
 
 # --- Configuration ---
 BASE_DIR = os.path.dirname(__file__)
@@ -13,59 +29,66 @@ ANALYZED_DATA_FILE = os.path.join(BASE_DIR, "analyzed_stories.json")
 OUTPUT_GEOCODED_FILE = os.path.join(BASE_DIR, "geocoded_stories.json")
 
 PHOTON_URL = "http://127.0.0.1:2322/api"
+# Seconds to wait for Photon before giving up on a single lookup (shared with geocode_api.py).
+PHOTON_TIMEOUT = float(os.getenv("PHOTON_TIMEOUT", "10"))
+# Keep-alive connection reused for every Photon lookup (see http_client.py).
+photon_session = get_session("photon")
+
+# Persistent cache shared with geocode_api.py; "not found" answers are cached too.
+geocode_cache = GeocodeCache()
 
-geocode_cache = {}
+# Offline gazetteer (gazetteer_index.json) consulted before Photon, if it has been built.
+gazetteer = load_default_gazetteer()
 
 # --- Geocoding Function ---
 def get_coordinates(location_name):
     """
-    Geocodes a location name using a local Photon server, with caching.
+    Geocodes a location name with caching: the persistent cache first, then the offline gazetteer,
+    then the local Photon server (skipped when GEOCODE_OFFLINE is set).
     """
-    if location_name in geocode_cache:
-        return geocode_cache[location_name]
+    found, cached = geocode_cache.get(location_name)
+    if cached:
+        return cached
 
-    print(f"  - Geocoding '{location_name}'...")
+    coordinates = gazetteer.lookup(location_name) if gazetteer else None
+    if coordinates or found or OFFLINE_MODE:
+        return coordinates
+
+    print(f"  - Geocoding '{location_name}'...", file=sys.stderr)
     try:
-        params = {"q": location_name, "lang": "en"}
-        response = requests.get(PHOTON_URL, params=params)
+        params = {"q": normalize_location(location_name), "lang": "en"}
+        response = photon_session.get(PHOTON_URL, params=params, timeout=PHOTON_TIMEOUT)
         response.raise_for_status()
         data = response.json()
         
         if data and data.get('features'):
             coords = data['features'][0]['geometry']['coordinates']
             coordinates = {"latitude": coords[1], "longitude": coords[0]}
-            geocode_cache[location_name] = coordinates
+            geocode_cache.set(location_name, coordinates)
             return coordinates
         else:
-            geocode_cache[location_name] = None
+            geocode_cache.set(location_name, None)
             return None
     except requests.exceptions.RequestException as e:
-        print(f"  - Error connecting to Photon: {e}")
-        geocode_cache[location_name] = None
+        # Connection failures are not cached so the next run tries again.
+        print(f"  - Error connecting to Photon: {e}", file=sys.stderr)
         return None
 
 # --- Main Processing Function ---
-def enrich_stories_with_coords():
+def geocode_story_stream(stories):
     """
-    Reads analyzed stories, adds coordinates, and saves to a new file.
+    Adds a 'location' field (name + coordinates) to each story as it streams through, using the
+    location_name parsed from the story_id by preprocess_data.py. Stories without a story_id are skipped.
     """
-    if not os.path.exists(ANALYZED_DATA_FILE):
-        print(f"Error: Analyzed data file not found at {ANALYZED_DATA_FILE}")
-        return
-
-    with open(ANALYZED_DATA_FILE, 'r', encoding='utf-8') as f:
-        stories = json.load(f)
-
-    geocoded_stories = []
-
-    print("\nStarting to enrich stories with geocoded data...")
     for story in stories:
         story_id = story.get('story_id')
         if not story_id:
             continue
 
-        match = re.findall(r'\[(.*?)\]', story_id)
-        location_str = match[1].strip() if len(match) >= 2 else None
+        # Records from before the metadata fields were stored get them here.
+        metadata = story_metadata(story)
+        story.update(metadata)
+        location_str = metadata["location_name"]
 
         if location_str:
             coordinates = get_coordinates(location_str)
@@ -75,15 +98,38 @@ def enrich_stories_with_coords():
             }
         else:
             story['location'] = {"name": None, "coordinates": None}
-        
-        geocoded_stories.append(story)
 
-    # Save the enriched data to the output file
-    with open(OUTPUT_GEOCODED_FILE, 'w', encoding='utf-8') as f:
-        json.dump(geocoded_stories, f, indent=4, ensure_ascii=False)
-    
-    print(f"\nProcessing complete! Saved geocoded data to {OUTPUT_GEOCODED_FILE}")
+        yield story
+
+def enrich_stories_with_coords(input_path=ANALYZED_DATA_FILE, output_path=OUTPUT_GEOCODED_FILE, store_path=None):
+    """
+    Reads analyzed stories, adds coordinates, and saves to a new file.
+    Paths ending in .jsonl (or "-" for stdin/stdout) use the line-delimited streaming format;
+    .json paths read/write a JSON array.
+
+    The same stories are written to a columnar store at `store_path`, which defaults to the output
+    path with a .store extension (no store is written when streaming to stdout without one).
+    """
+    if input_path != "-" and not os.path.exists(input_path):
+        print(f"Error: Analyzed data file not found at {input_path}", file=sys.stderr)
+        return
+
+    print("\nStarting to enrich stories with geocoded data...", file=sys.stderr)
+    if store_path is None and output_path != "-":
+        store_path = os.path.splitext(output_path)[0] + ".store"
+
+    stories = geocode_story_stream(iter_stories(input_path))
+    store = StoryStoreWriter(store_path) if store_path else None
+    count = write_stories(output_path, store.tee(stories) if store else stories)
+
+    print(f"\nProcessing complete! Saved {count} geocoded stories to {output_path}", file=sys.stderr)
+    if store:
+        store.close()
+        print(f"Columnar store written to {store_path}", file=sys.stderr)
+    stats = geocode_cache.stats()
+    print(f"Geocode cache: {stats['hit_rate']:.0%} hit rate ({stats['misses']} cache misses)", file=sys.stderr)
 
 # --- Main entry point ---
 if __name__ == "__main__":
-    enrich_stories_with_coords()
+    # Optional arguments: [input_path] [output_path] [store_path]
+    enrich_stories_with_coords(*sys.argv[1:4])
@@ -0,0 +1,63 @@
+# http_client.py
+# Shared keep-alive HTTP sessions for the Python scripts and services.
+# A bare requests.get / requests.post opens (and tears down) a new TCP connection for every call;
+# a Session keeps connections to the same host open and reuses them. Each upstream gets one
+# process-wide session (get_session("photon"), get_session("lmstudio")) whose connection pool is
+# sized for the number of threads that use it.
+
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- Configuration ---
+# HTTP_POOL_SIZE: default number of keep-alive connections kept per host. It is read when a session
+# is created, not at import, so a value from .env loaded by the importing script applies.
+
+_sessions = {}
+_pool_sizes = {}
+_lock = threading.Lock()
+
+
+def default_pool_size():
+    return int(os.getenv("HTTP_POOL_SIZE", "10"))
+
+
+def _mount_pool(session, pool_maxsize):
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+
+def make_session(pool_maxsize=None):
+    """Creates a new session with a keep-alive pool of `pool_maxsize` connections per host."""
+    if pool_maxsize is None:
+        pool_maxsize = default_pool_size()
+    session = requests.Session()
+    _mount_pool(session, pool_maxsize)
+    return session
+
+
+def get_session(name="default", pool_maxsize=None):
+    """
+    Returns the shared session for `name`, creating it on first use.
+
+    Args:
+        name (str): Upstream the session talks to, e.g. "photon" or "lmstudio".
+        pool_maxsize (int): Connections the caller may use at once. If it is larger than the
+            existing pool, the pool is replaced by a larger one (existing connections are dropped
+            once returned), so a bigger worker pool never has to open throwaway connections.
+            Defaults to HTTP_POOL_SIZE.
+    """
+    if pool_maxsize is None:
+        pool_maxsize = default_pool_size()
+    with _lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = _sessions[name] = make_session(pool_maxsize)
+            _pool_sizes[name] = pool_maxsize
+        elif pool_maxsize > _pool_sizes[name]:
+            _mount_pool(session, pool_maxsize)
+            _pool_sizes[name] = pool_maxsize
+        return session
@@ -0,0 +1,96 @@
+# llm_cache.py
+# A persistent, content-addressed cache for LLM analysis results.
+# Results are stored in a small SQLite database keyed by a hash of everything that determines
+# the model's answer (model, prompt template, temperature and the story text), so re-running
+# the preprocessing pipeline only pays for stories it has never seen before.
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def make_cache_key(model, prompt_template, temperature, text):
+    """
+    Builds a stable SHA-256 key for one LLM request.
+
+    Args:
+        model (str): Model name sent to the API.
+        prompt_template (str): The fixed part of the prompt (system prompt / few-shot examples).
+        temperature (float): Sampling temperature.
+        text (str): The (already trimmed) story text.
+
+    Returns:
+        str: Hex digest identifying the request.
+    """
+    material = json.dumps([model, prompt_template, float(temperature), text], ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class LLMResultCache:
+    """
+    SQLite-backed cache of JSON-serializable results with least-recently-used eviction.
+
+    Safe to share between the worker threads of analyze_stories_concurrently.
+    """
+
+    def __init__(self, db_path, max_entries=10000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_results ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_results_access ON llm_results(last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        """Returns the cached value for `key`, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM llm_results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE llm_results SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return json.loads(row[0])
+
+    def set(self, key, value):
+        """Stores `value` under `key`, evicting the least recently used entries if the cache is full."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_results (key, value, last_access) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time()),
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM llm_results").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM llm_results WHERE key IN ("
+                    " SELECT key FROM llm_results ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._conn.commit()
+
+    def stats(self):
+        """Returns hit/miss counters and the current number of stored entries."""
+        with self._lock:
+            (size,) = self._conn.execute("SELECT COUNT(*) FROM llm_results").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,663 @@
+# llm_client.py
+# Shared client for the LM Studio (OpenAI-compatible) chat completions API.
+# Used by preprocess_data.py (story analysis) and generate_response.py (chat responses) so both
+# back off the same way when the LLM server struggles. LM_STUDIO_API may list several servers
+# (comma-separated); requests are then balanced across them (see LLMClient). Per server:
+#   - Adaptive concurrency (AIMD): the number of requests in flight grows by one per window of
+#     fast successes and is halved when a request fails with an overload error or takes much
+#     longer than the best recent latency of requests of a similar size, so we stop piling
+#     requests onto a saturated server.
+#   - Retries only for failures that can succeed on a second try (connection errors, timeouts,
+#     429 and 5xx), after a jittered exponential backoff (Retry-After is honoured).
+#   - A circuit breaker: after LLM_BREAKER_FAILURES consecutive failed calls the upstream is
+#     considered down and calls fail immediately (callers return their fallback text) for
+#     LLM_BREAKER_RESET_SECONDS. Then one probe request is let through; success closes the
+#     breaker, failure opens it again for twice as long (up to LLM_BREAKER_MAX_RESET_SECONDS).
+
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import requests
+from dotenv import load_dotenv
+
+from http_client import make_session
+from metrics import (
+    Gauge,
+    log_event,
+    record_failure,
+    record_retry,
+    upstream_in_flight,
+    upstream_queue_wait,
+    upstream_request_duration,
+)
+
+# --- Configuration ---
+# Settings from .env apply whichever script imports this module first.
+load_dotenv()
+
+# Lower bound of the adaptive concurrency limit (the upper bound is given per client).
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+# A request slower than this many times the best recent latency counts as a sign of overload.
+LLM_LATENCY_TOLERANCE = float(os.getenv("LLM_LATENCY_TOLERANCE", "2.0"))
+# Fixed latency target in seconds instead of the relative one above (0 = relative).
+LLM_LATENCY_TARGET = float(os.getenv("LLM_LATENCY_TARGET", "0"))
+# Base and maximum seconds of the jittered exponential retry backoff.
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+# Consecutive failed calls that open the circuit breaker, and how long it stays open.
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "10"))
+LLM_BREAKER_MAX_RESET_SECONDS = float(os.getenv("LLM_BREAKER_MAX_RESET_SECONDS", "120"))
+
+# Per-client defaults, read when a client is created (so they follow the environment at that time):
+#   LLM_BACKEND_WEIGHTS  relative weights of the backends listed in LM_STUDIO_API
+#                        (comma-separated, default 1 each)
+#   LLM_STEAL_AFTER      with several backends, a request taking this many times the fastest
+#                        backend's usual latency is also sent to an idle backend, and the first
+#                        answer wins (0 = never; default 3)
+
+# HTTP statuses worth retrying (rate limited, or the server is temporarily unable to answer).
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+concurrency_limit = Gauge(
+    "upstream_concurrency_limit", "Current adaptive concurrency limit of an upstream client.", ["upstream"])
+circuit_open = Gauge(
+    "upstream_circuit_open", "1 while the upstream circuit breaker is open (calls fail fast).", ["upstream"])
+
+
+class UpstreamUnavailable(requests.exceptions.RequestException):
+    """Raised without contacting the upstream while its circuit breaker is open."""
+
+
+def backoff_delay(attempt, base=None, cap=None):
+    """
+    Seconds to wait before retry number `attempt` (1-based): "full jitter" exponential backoff,
+    uniform in [0, min(cap, base * 2**attempt)], so retrying clients do not return in lockstep.
+    """
+    base = LLM_BACKOFF_BASE if base is None else base
+    cap = LLM_BACKOFF_MAX if cap is None else cap
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def is_retryable(error):
+    """True for connection errors, timeouts and retryable HTTP statuses; False for e.g. HTTP 400."""
+    if isinstance(error, UpstreamUnavailable):
+        return False
+    if isinstance(error, requests.exceptions.HTTPError):
+        return error.response is not None and error.response.status_code in RETRYABLE_STATUSES
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+def failure_cause(error):
+    """Metric label for a failed call: network, rate_limited, http_<status> or circuit_open."""
+    if isinstance(error, UpstreamUnavailable):
+        return "circuit_open"
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return "rate_limited" if status == 429 else f"http_{status}"
+    return "network"
+
+
+def request_size(payload):
+    """Characters of prompt in a chat completions payload (None if it has no messages)."""
+    messages = payload.get("messages") if isinstance(payload, dict) else None
+    if not messages:
+        return None
+    return sum(len(message.get("content") or "") for message in messages)
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that adapts with AIMD (additive increase, multiplicative decrease).
+
+    Each success within the latency target adds 1/limit, i.e. about one slot per window of
+    requests; an overload signal halves the limit. Only requests started after the last decrease
+    can trigger another one, so a burst of failures from one window counts once.
+    The best recent latency is tracked per request size class (see size_class), since a long
+    prompt is slower than a short one even on an idle server.
+    """
+
+    def __init__(self, max_limit, min_limit=LLM_MIN_CONCURRENCY, latency_tolerance=LLM_LATENCY_TOLERANCE,
+                 latency_target=LLM_LATENCY_TARGET, name="lmstudio"):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.latency_target = latency_target
+        self.name = name
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.baselines = {}
+        self._issued = 0
+        self._last_decrease_ticket = 0
+        self._condition = threading.Condition()
+        concurrency_limit.set(self.max_limit, upstream=name)
+
+    def set_max_limit(self, max_limit):
+        """Changes the upper bound (e.g. to the size of a worker pool), keeping the current limit below it."""
+        with self._condition:
+            self.max_limit = max(1, max_limit)
+            self.min_limit = min(self.min_limit, self.max_limit)
+            self.limit = min(max(self.limit, self.min_limit), self.max_limit)
+            concurrency_limit.set(int(self.limit), upstream=self.name)
+            self._condition.notify_all()
+
+    def acquire(self, timeout=None):
+        """
+        Waits for a free slot. Returns a ticket to pass to release(), or None on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+            self.in_flight += 1
+            self._issued += 1
+            return self._issued
+
+    def try_acquire(self, force=False):
+        """
+        Takes a slot without waiting. Returns a ticket, or None when the limit is reached
+        (with force=True the slot is taken anyway and only counted, e.g. by the asyncio service).
+        """
+        with self._condition:
+            if not force and self.in_flight >= int(self.limit):
+                return None
+            self.in_flight += 1
+            self._issued += 1
+            return self._issued
+
+    def has_capacity(self):
+        return self.in_flight < int(self.limit)
+
+    @staticmethod
+    def size_class(size):
+        """Groups request sizes (e.g. prompt characters) into classes a factor of about 1.4 apart."""
+        return None if size is None else round(math.log2(max(size, 1)) * 2)
+
+    def baseline(self, size=None):
+        """Best recent latency for requests of this size (None = not known yet)."""
+        return self.baselines.get(self.size_class(size))
+
+    @property
+    def baseline_latency(self):
+        """Best recent latency over all request sizes."""
+        return min(self.baselines.values(), default=None)
+
+    def release(self, ticket, latency=None, overloaded=False, size=None):
+        """
+        Frees a slot and adapts the limit.
+
+        Args:
+            ticket (int): Value returned by acquire().
+            latency (float): Seconds the call took, or None if it did not complete (no signal).
+            overloaded (bool): The upstream reported overload (429/5xx/timeout).
+            size (int): Size of the request (e.g. prompt characters), or None if unknown.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if latency is not None and not overloaded:
+                # Best recent latency: follows improvements at once and drifts up slowly, so a
+                # permanently slower model moves the baseline after a while.
+                size_class = self.size_class(size)
+                baseline = self.baselines.get(size_class)
+                if baseline is None or latency < baseline:
+                    baseline = latency
+                else:
+                    baseline += (latency - baseline) * 0.002
+                self.baselines[size_class] = baseline
+                target = self.latency_target or baseline * self.latency_tolerance
+                overloaded = latency > target
+
+            if overloaded:
+                if ticket > self._last_decrease_ticket:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_decrease_ticket = self._issued
+                    log_event("upstream_limit_decreased", upstream=self.name, limit=int(self.limit))
+            elif latency is not None:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            concurrency_limit.set(int(self.limit), upstream=self.name)
+            self._condition.notify_all()
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures; open -> half-open after
+    `reset_seconds`, letting a single probe call through; the probe's result closes the breaker
+    or re-opens it with the reset time doubled (up to `max_reset_seconds`).
+    Methods do not block, so one breaker can be shared by threads and asyncio code.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=LLM_BREAKER_FAILURES, reset_seconds=LLM_BREAKER_RESET_SECONDS,
+                 max_reset_seconds=LLM_BREAKER_MAX_RESET_SECONDS, name="lmstudio"):
+        self.failure_threshold = max(1, failure_threshold)
+        self.base_reset_seconds = reset_seconds
+        self.max_reset_seconds = max(reset_seconds, max_reset_seconds)
+        self.name = name
+        self.state = self.CLOSED
+        self.failures = 0
+        self.reset_seconds = reset_seconds
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        circuit_open.set(0, upstream=name)
+
+    def allow(self):
+        """True if a call may be made now (in half-open state, only for the single probe)."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                log_event("circuit_probe", upstream=self.name)
+                return True
+            return False
+
+    def is_available(self):
+        """False while calls would fail fast (open, or half-open with the probe still out)."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                return time.monotonic() - self.opened_at >= self.reset_seconds
+            return not self._probe_in_flight
+
+    def retry_after(self):
+        """Seconds until the next probe is allowed (0 when closed)."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_seconds - time.monotonic())
+
+    def release_probe(self):
+        """Gives back the half-open probe slot when the probe was never sent."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print(f"✅ {self.name} is reachable again; circuit breaker closed.")
+                log_event("circuit_closed", upstream=self.name)
+            self.state = self.CLOSED
+            self.failures = 0
+            self.reset_seconds = self.base_reset_seconds
+            self._probe_in_flight = False
+            circuit_open.set(0, upstream=self.name)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN:
+                self.reset_seconds = min(self.reset_seconds * 2, self.max_reset_seconds)
+            elif self.state == self.CLOSED and self.failures < self.failure_threshold:
+                return
+            elif self.state == self.OPEN:
+                return
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+            circuit_open.set(1, upstream=self.name)
+            print(f"🔌 {self.name} looks unavailable after {self.failures} failed calls; "
+                  f"failing fast for {self.reset_seconds:.0f}s.")
+            log_event("circuit_opened", upstream=self.name, failures=self.failures, reset_seconds=self.reset_seconds)
+
+
+class Backend:
+    """One OpenAI-compatible endpoint of the client's pool, with its own limiter, breaker and counters."""
+
+    def __init__(self, url, weight, max_concurrency, name):
+        self.url = url
+        self.weight = weight
+        self.name = name
+        self.limiter = AdaptiveLimiter(max_concurrency, name=name)
+        self.breaker = CircuitBreaker(name=name)
+        self.requests = 0
+        self.failures = 0
+        self.stolen = 0
+        self.busy_seconds = 0.0
+        self.first_started = None
+        self.last_finished = None
+
+    def score(self):
+        """Selection order: fewest outstanding requests per unit of weight, then lowest latency."""
+        return (self.limiter.in_flight + 1) / self.weight, self.limiter.baseline_latency or 0.0
+
+    def stats(self):
+        window = (self.last_finished - self.first_started) if self.first_started is not None else 0
+        completed = self.requests - self.failures
+        return {
+            "backend": self.name,
+            "url": self.url,
+            "weight": self.weight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "stolen": self.stolen,
+            "mean_latency_ms": round(self.busy_seconds / self.requests * 1000, 1) if self.requests else None,
+            "requests_per_sec": round(completed / window, 2) if window > 0 else None,
+            "concurrency_limit": int(self.limiter.limit),
+            "circuit": self.breaker.state,
+        }
+
+
+def parse_backend_urls(api_urls):
+    """Accepts one URL, a comma-separated list (as in LM_STUDIO_API) or a list of URLs."""
+    if isinstance(api_urls, str):
+        api_urls = api_urls.split(",")
+    urls = [url.strip() for url in api_urls or [] if url and url.strip()]
+    if not urls:
+        raise ValueError("At least one LLM API URL is required")
+    return urls
+
+
+def parse_backend_weights(weights, count):
+    """Weights from a comma-separated string or list; missing or invalid entries default to 1."""
+    if isinstance(weights, str):
+        weights = weights.split(",") if weights.strip() else []
+    parsed = []
+    for i in range(count):
+        try:
+            parsed.append(max(float(weights[i]), 0.01))
+        except (IndexError, TypeError, ValueError):
+            parsed.append(1.0)
+    return parsed
+
+
+class LLMClient:
+    """
+    Posts chat completions requests to one or more OpenAI-compatible backends with adaptive
+    concurrency, jittered retries and a circuit breaker per backend.
+
+    With several backends (LM_STUDIO_API=url1,url2,..., optionally LLM_BACKEND_WEIGHTS=2,1,...)
+    each request goes to the healthy backend with the fewest outstanding requests per unit of
+    weight; a failed attempt is retried on another backend without waiting. Work stealing: when
+    a request has taken LLM_STEAL_AFTER times the best backend's usual latency and another backend
+    is idle, the idle one is sent the same request and whichever answers first wins, so one slow
+    server cannot hold up the end of a run.
+
+    post() returns the successful requests.Response, or raises a requests RequestException
+    (UpstreamUnavailable when every backend's breaker is open) once retrying is pointless, so
+    callers keep their existing `except requests.exceptions.RequestException` fallback handling.
+    """
+
+    def __init__(self, api_urls, max_concurrency, session=None, name="lmstudio", timeout=180, max_retries=3,
+                 weights=None, steal_after=None):
+        urls = parse_backend_urls(api_urls)
+        weights = parse_backend_weights(os.getenv("LLM_BACKEND_WEIGHTS", "") if weights is None else weights, len(urls))
+        self.name = name
+        self.session = session or make_session(max_concurrency * len(urls))
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.steal_after = float(os.getenv("LLM_STEAL_AFTER", "3")) if steal_after is None else steal_after
+        self.backends = [Backend(url, weight, max_concurrency,
+                                 name if len(urls) == 1 else f"{name}@{urlsplit(url).netloc or url}")
+                         for url, weight in zip(urls, weights)]
+        self._condition = threading.Condition()
+        self._executor = None
+
+    def set_max_concurrency(self, max_concurrency):
+        """Changes each backend's upper concurrency bound (e.g. to the size of a worker pool)."""
+        for backend in self.backends:
+            backend.limiter.set_max_limit(max_concurrency)
+        with self._condition:
+            self._condition.notify_all()
+
+    # --- Backend selection ---
+    def has_other_healthy_backend(self, excluded):
+        """True if a backend outside `excluded` is healthy (a retry there needs no backoff)."""
+        return any(backend not in excluded and backend.breaker.state == CircuitBreaker.CLOSED
+                   for backend in self.backends)
+
+    def _pick(self, candidates, force):
+        # Recovery probes first, so a backend that was down is tried again even while the others keep up.
+        for backend in candidates:
+            if (backend.breaker.state != CircuitBreaker.CLOSED
+                    and (force or backend.limiter.has_capacity()) and backend.breaker.allow()):
+                return backend
+        healthy = [backend for backend in candidates if backend.breaker.state == CircuitBreaker.CLOSED
+                   and (force or backend.limiter.has_capacity())]
+        return min(healthy, key=Backend.score) if healthy else None
+
+    def _select(self, avoid=(), force=False):
+        """Returns (backend, ticket) or None. Backends in `avoid` are used only if no other one can take the request."""
+        preferred = [backend for backend in self.backends if backend not in avoid]
+        for candidates in (preferred, self.backends):
+            backend = self._pick(candidates, force) if candidates else None
+            if backend is not None:
+                return backend, backend.limiter.try_acquire(force=True)
+        return None
+
+    def available(self):
+        """False while every backend's circuit breaker is open (calls would fail fast)."""
+        return any(backend.breaker.is_available() for backend in self.backends)
+
+    def _unavailable(self):
+        error = UpstreamUnavailable(
+            f"{self.name} circuit breaker is open (next probe in "
+            f"{min(backend.breaker.retry_after() for backend in self.backends):.0f}s)")
+        record_failure(self.name, "circuit_open", error)
+        return error
+
+    def acquire(self, queue_timeout=None, avoid=()):
+        """
+        Waits until a healthy backend has a free slot and returns (backend, ticket); pass both to
+        complete() after the call. Raises UpstreamUnavailable when all backends are down or no
+        slot frees up within `queue_timeout` seconds.
+        """
+        deadline = None if queue_timeout is None else time.monotonic() + queue_timeout
+        with self._condition:
+            while True:
+                if not self.available():
+                    raise self._unavailable()
+                selection = self._select(avoid)
+                if selection is not None:
+                    return selection
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    error = UpstreamUnavailable(f"No {self.name} slot free within {queue_timeout}s")
+                    record_failure(self.name, "queue_timeout", error)
+                    raise error
+                # Wake up for the next recovery probe even if no slot is released meanwhile.
+                probe_wait = min((backend.breaker.retry_after() for backend in self.backends
+                                  if backend.breaker.state != CircuitBreaker.CLOSED), default=None)
+                waits = [w for w in (remaining, probe_wait) if w is not None]
+                self._condition.wait(max(min(waits), 0.01) if waits else None)
+
+    def acquire_nowait(self, avoid=()):
+        """
+        Like acquire(), but never waits: picks the least loaded healthy backend even when all
+        are at their limit. For callers that bound concurrency themselves (the asyncio service).
+        """
+        with self._condition:
+            selection = self._select(avoid, force=True) if self.available() else None
+        if selection is None:
+            raise self._unavailable()
+        return selection
+
+    def complete(self, backend, ticket, started, latency=None, error=None, retryable=None, size=None):
+        """
+        Records the end of a call started at `started` (perf_counter): frees the slot, adapts the
+        backend's limit and updates its breaker and counters.
+
+        Args:
+            latency (float): Seconds until the response arrived (None if none did).
+            error (Exception): The failure, if the call failed. Retryable failures (network, 429,
+                5xx) count against the backend's health; others (e.g. 400) show it is up, unless
+                the call ended before any response (e.g. a cancelled task), which says nothing
+                about the backend and only gives back a half-open probe slot.
+            retryable (bool): Overrides is_retryable(error), for errors of other HTTP libraries.
+            size (int): Request size for the latency baseline (see request_size).
+        """
+        if retryable is None:
+            retryable = error is not None and is_retryable(error)
+        backend.limiter.release(ticket, latency, overloaded=retryable, size=size)
+        if retryable:
+            backend.breaker.record_failure()
+        elif error is not None and latency is None:
+            backend.breaker.release_probe()
+        else:
+            backend.breaker.record_success()
+        finished = time.perf_counter()
+        with self._condition:
+            backend.requests += 1
+            backend.failures += error is not None
+            backend.busy_seconds += finished - started
+            if backend.first_started is None or started < backend.first_started:
+                backend.first_started = started
+            backend.last_finished = finished
+            self._condition.notify_all()
+
+    # --- Requests ---
+    def _call(self, backend, ticket, payload, operation, timeout, stream):
+        started = time.perf_counter()
+        size = request_size(payload)
+        latency = None
+        try:
+            with upstream_in_flight.track_inprogress(upstream=self.name):
+                response = self.session.post(backend.url, json=payload, timeout=timeout, stream=stream)
+            latency = time.perf_counter() - started
+            response.raise_for_status()
+        except BaseException as e:
+            if isinstance(e, requests.exceptions.HTTPError):
+                e.response.close()
+            self.complete(backend, ticket, started, latency, error=e, size=size)
+            upstream_request_duration.observe(time.perf_counter() - started, upstream=self.name,
+                                              operation=operation, outcome="error")
+            raise
+        upstream_request_duration.observe(latency, upstream=self.name, operation=operation, outcome="ok")
+        if not stream:
+            self.complete(backend, ticket, started, latency, size=size)
+            return response
+
+        # The body of a streamed response is still being generated: the backend counts as busy
+        # (its slot stays taken) until the caller closes the response. Latency is time to first byte.
+        close = response.close
+        first_close = threading.Lock()
+
+        def close_and_complete():
+            close()
+            if first_close.acquire(blocking=False):
+                self.complete(backend, ticket, started, latency, size=size)
+
+        response.close = close_and_complete
+        return response
+
+    def _steal_delay(self, size=None):
+        """Seconds after which a request may be duplicated onto an idle backend (None = not yet known)."""
+        baselines = [baseline for baseline in (backend.limiter.baseline(size) for backend in self.backends)
+                     if baseline is not None]
+        return self.steal_after * min(baselines) if baselines else None
+
+    def _steal(self, slow_backend):
+        """Takes a slot on an idle healthy backend other than `slow_backend`, or returns None."""
+        with self._condition:
+            idle = [backend for backend in self.backends if backend is not slow_backend
+                    and backend.breaker.state == CircuitBreaker.CLOSED and backend.limiter.in_flight == 0]
+            if not idle:
+                return None
+            backend = min(idle, key=Backend.score)
+            return backend, backend.limiter.try_acquire(force=True)
+
+    def _call_with_stealing(self, backend, ticket, payload, operation, timeout, stream):
+        delay = self._steal_delay(request_size(payload))
+        if len(self.backends) == 1 or stream or self.steal_after <= 0 or delay is None:
+            return self._call(backend, ticket, payload, operation, timeout, stream)
+
+        if self._executor is None:
+            with self._condition:
+                if self._executor is None:
+                    # Threads are only started when needed; the bound is just a safety net.
+                    self._executor = ThreadPoolExecutor(max_workers=256, thread_name_prefix="llm-steal")
+        primary = self._executor.submit(self._call, backend, ticket, payload, operation, timeout, stream)
+        pending, helper, error = {primary}, None, None
+        while pending:
+            done, pending = wait(pending, timeout=None if helper else delay, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is helper:
+                        with self._condition:
+                            helper_backend.stolen += 1
+                        log_event("upstream_work_stolen", upstream=self.name, slow=backend.name,
+                                  helper=helper_backend.name)
+                    # The other copy (if any) finishes in the background and is discarded.
+                    return future.result()
+                error = future.exception()
+            if helper is None and not done:
+                selection = self._steal(backend)
+                if selection is not None:
+                    helper_backend = selection[0]
+                    helper = self._executor.submit(self._call, *selection, payload, operation, timeout, stream)
+                    pending.add(helper)
+        raise error
+
+    def post(self, payload, operation="chat", timeout=None, stream=False, queue_timeout=None, max_retries=None):
+        """
+        Sends one request, retrying connection errors, timeouts, 429 and 5xx responses
+        (on another backend straight away when one is healthy, else after a jittered backoff).
+
+        Args:
+            payload (dict): Chat completions request body.
+            operation (str): Label for the latency metrics (e.g. "analyze", "chat").
+            timeout (float): Per-attempt HTTP timeout; defaults to the client's.
+            stream (bool): Passed to requests; the caller must close the response, which also
+                frees the concurrency slot held while the body streams.
+            queue_timeout (float): Maximum seconds to wait for a concurrency slot (None = no limit).
+            max_retries (int): Attempts for this call; defaults to the client's.
+        """
+        timeout = timeout or self.timeout
+        max_retries = max_retries or self.max_retries
+        failed_backends = set()
+        for attempt in range(1, max_retries + 1):
+            queued = time.perf_counter()
+            backend, ticket = self.acquire(queue_timeout, avoid=failed_backends)
+            upstream_queue_wait.observe(time.perf_counter() - queued, upstream=self.name)
+            try:
+                return self._call_with_stealing(backend, ticket, payload, operation, timeout, stream)
+            except requests.exceptions.RequestException as e:
+                cause = failure_cause(e)
+                if not is_retryable(e) or attempt == max_retries or not self.available():
+                    record_failure(self.name, cause, e)
+                    raise
+                failed_backends.add(backend)
+                wait_time = 0.0 if self.has_other_healthy_backend(failed_backends) else self._retry_wait(e, attempt)
+                record_retry(self.name, cause, attempt, e)
+                print(f"⚠️ Error contacting {backend.name} (Attempt {attempt}/{max_retries}): {e}. "
+                      + (f"Retrying in {wait_time:.1f}s..." if wait_time else "Retrying on another backend..."))
+                time.sleep(wait_time)
+
+    def _retry_wait(self, error, attempt):
+        """Jittered backoff, or the server's Retry-After (capped at LLM_BACKOFF_MAX) when given."""
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), LLM_BACKOFF_MAX)
+            except ValueError:
+                pass  # HTTP-date form; fall back to the computed backoff
+        return backoff_delay(attempt)
+
+    def backend_stats(self):
+        """Per-backend counters: requests, failures, stolen requests, mean latency, throughput, health."""
+        with self._condition:
+            return [backend.stats() for backend in self.backends]
+
+    def print_backend_report(self):
+        """Prints per-backend throughput, e.g. at the end of a preprocessing run."""
+        print(f"📡 LLM backends ({len(self.backends)}):")
+        for stats in self.backend_stats():
+            rate = f"{stats['requests_per_sec']:.2f} req/s" if stats["requests_per_sec"] is not None else "- req/s"
+            latency = f"{stats['mean_latency_ms']:.0f} ms" if stats["mean_latency_ms"] is not None else "-"
+            print(f"   {stats['url']:<45} weight {stats['weight']:<4g} {stats['requests']:>6} requests "
+                  f"({stats['failures']} failed, {stats['stolen']} stolen)  {rate:>12}  mean {latency:>7}  "
+                  f"limit {stats['concurrency_limit']}  circuit {stats['circuit']}")
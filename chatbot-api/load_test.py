@@ -0,0 +1,152 @@
+# load_test.py
+"""
+Load-test script for the empathetic response service (POST /generate_response).
+
+By default it starts a stub LLM (see stub_llm_server.py) with a configurable latency, launches the
+chosen server implementation against it on a free port, sends a fixed number of chat requests at a
+fixed concurrency and reports p50/p90/p99 latency and throughput.
+
+Examples:
+    python load_test.py --server async --requests 500 --concurrency 50 --stub-latency 0.5
+    python load_test.py --server flask --requests 200 --concurrency 50
+    python load_test.py --url http://127.0.0.1:5002/generate_response   # an already running service
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+
+from stub_llm_server import start_stub_server_in_background
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Commands that start each server implementation; the port comes from RESPONSE_SERVICE_PORT.
+SERVER_COMMANDS = {
+    "async": [sys.executable, "generate_response_async.py"],
+    # Threaded Flask without the debug reloader, so the process can be stopped cleanly.
+    "flask": [sys.executable, "-c",
+              "import generate_response as g; g.app.run(port=g.RESPONSE_SERVICE_PORT, threaded=True)"],
+}
+
+SAMPLE_MESSAGES = [
+    ("I lost my house in the February quake.", "negative"),
+    ("I was in the CBD when it hit.", "neutral"),
+    ("My neighbours dug out my driveway for me.", "positive"),
+]
+
+
+def find_free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=20.0):
+    """Blocks until something accepts connections on 127.0.0.1:port."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} did not start within {timeout}s")
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+async def run_load(url, total_requests, concurrency, timeout):
+    """
+    Sends `total_requests` POSTs with at most `concurrency` in flight.
+
+    Returns:
+        tuple: (latencies of successful requests in seconds, status counts, wall-clock seconds)
+    """
+    latencies = []
+    statuses = {}
+    next_request = 0
+
+    async def worker(session):
+        nonlocal next_request
+        while next_request < total_requests:
+            message, sentiment = SAMPLE_MESSAGES[next_request % len(SAMPLE_MESSAGES)]
+            next_request += 1
+            start = time.perf_counter()
+            try:
+                async with session.post(url, json={"user_message": message, "story_sentiment": sentiment}) as response:
+                    await response.read()
+                    status = response.status
+            except (ClientError, asyncio.TimeoutError) as e:
+                status = type(e).__name__
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    async with ClientSession(connector=TCPConnector(limit=concurrency),
+                             timeout=ClientTimeout(total=timeout)) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    return sorted(latencies), statuses, time.perf_counter() - started
+
+
+def print_report(label, latencies, statuses, elapsed, total_requests):
+    print(f"\n📈 Load test results ({label})")
+    print(f"   Requests:    {total_requests} in {elapsed:.2f}s")
+    print(f"   Status:      {statuses}")
+    print(f"   Throughput:  {len(latencies) / elapsed:.1f} successful req/s")
+    print(f"   Latency p50: {percentile(latencies, 50) * 1000:.0f} ms")
+    print(f"   Latency p90: {percentile(latencies, 90) * 1000:.0f} ms")
+    print(f"   Latency p99: {percentile(latencies, 99) * 1000:.0f} ms")
+    if latencies:
+        print(f"   Latency max: {latencies[-1] * 1000:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the /generate_response service.")
+    parser.add_argument("--server", choices=sorted(SERVER_COMMANDS), default="async",
+                        help="Server implementation to start against a stub LLM.")
+    parser.add_argument("--url", help="Test an already running service instead of starting one.")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--stub-latency", type=float, default=0.5, help="Seconds per stub LLM completion.")
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=120.0, help="Client-side timeout per request.")
+    args = parser.parse_args()
+
+    if args.url:
+        latencies, statuses, elapsed = asyncio.run(run_load(args.url, args.requests, args.concurrency, args.timeout))
+        print_report(args.url, latencies, statuses, elapsed, args.requests)
+        return
+
+    stub, stub_url = start_stub_server_in_background(latency=args.stub_latency, error_rate=args.stub_error_rate)
+    port = find_free_port()
+    env = dict(os.environ, LM_STUDIO_API=stub_url, MODEL="stub-model", RESPONSE_SERVICE_PORT=str(port))
+    server = subprocess.Popen(SERVER_COMMANDS[args.server], cwd=BASE_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        url = f"http://127.0.0.1:{port}/generate_response"
+        latencies, statuses, elapsed = asyncio.run(run_load(url, args.requests, args.concurrency, args.timeout))
+        print_report(f"{args.server} server, stub latency {args.stub_latency}s, concurrency {args.concurrency}",
+                     latencies, statuses, elapsed, args.requests)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
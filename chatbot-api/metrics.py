@@ -0,0 +1,355 @@
+# metrics.py
+# Shared instrumentation for the Python services and scripts.
+# Counters, gauges and latency histograms are kept in process memory and rendered in the
+# Prometheus text format on a /metrics endpoint (see instrument_flask_app / aiohttp_middleware).
+# Recording a value is a dictionary lookup and a few additions under a lock, so it is cheap enough
+# for the request path. With STRUCTURED_LOGS=1, request and upstream events are also written to
+# stderr as one JSON object per line.
+
+import bisect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# --- Configuration ---
+
+# Latency buckets in seconds, from cache hits to slow LLM completions.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_logger = logging.getLogger("chatbot.events")
+_structured_logs = None
+_structured_logs_lock = threading.Lock()
+
+
+def structured_logs_enabled():
+    """
+    True when STRUCTURED_LOGS is on. The setting is read (and the stderr handler set up) on first
+    use rather than at import, so a value from .env loaded by the importing script applies.
+    """
+    global _structured_logs
+    if _structured_logs is None:
+        with _structured_logs_lock:
+            if _structured_logs is None:
+                enabled = os.getenv("STRUCTURED_LOGS", "0").lower() in ("1", "true", "yes")
+                if enabled and not _logger.handlers:
+                    handler = logging.StreamHandler(sys.stderr)
+                    handler.setFormatter(logging.Formatter("%(message)s"))
+                    _logger.addHandler(handler)
+                    _logger.setLevel(logging.INFO)
+                    _logger.propagate = False
+                _structured_logs = enabled
+    return _structured_logs
+
+
+def log_event(event, **fields):
+    """Writes one structured log line ({"ts", "event", ...fields}) when STRUCTURED_LOGS is on."""
+    if structured_logs_enabled():
+        _logger.info(json.dumps({"ts": round(time.time(), 3), "event": event, **fields}, default=str))
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Registry:
+    """Holds all metrics and callbacks and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def register_callback(self, callback):
+        """
+        Adds a function called at render time that returns (name, help, type, samples) tuples,
+        where samples is a list of ({label: value}, number). Used to expose existing stats
+        (e.g. cache counters) without touching their hot paths.
+        """
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+            callbacks = list(self._callbacks)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for callback in callbacks:
+            for name, documentation, metric_type, samples in callback():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    metric_type = ""
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """A monotonically increasing count, e.g. retries by cause."""
+
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def values(self):
+        """Returns {label values tuple: count}."""
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge(Counter):
+    """A value that goes up and down, e.g. requests in flight."""
+
+    metric_type = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def track_inprogress(self, **labels):
+        """Context manager that counts the enclosed block as in flight."""
+        return _InProgress(self, labels)
+
+
+class _InProgress:
+    def __init__(self, gauge, labels):
+        self.gauge = gauge
+        self.labels = labels
+
+    def __enter__(self):
+        self.gauge.inc(**self.labels)
+
+    def __exit__(self, *exc_info):
+        self.gauge.dec(**self.labels)
+
+
+class Histogram(_Metric):
+    """Latency distribution with fixed buckets (plus sum and count)."""
+
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (last slot is +Inf), then sum.
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[bucket] += 1
+            state[-1] += value
+
+    def time(self, **labels):
+        """Context manager that observes the duration of the enclosed block."""
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-1]!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.start
+        self.histogram.observe(self.seconds, **self.labels)
+
+
+# --- Metrics shared by the services and scripts ---
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Time spent handling HTTP requests.", ["service", "endpoint", "method", "status"])
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled.", ["service"])
+upstream_request_duration = Histogram(
+    "upstream_request_duration_seconds", "Latency of calls to upstream services (LLM, Photon).",
+    ["upstream", "operation", "outcome"])
+upstream_retries = Counter(
+    "upstream_retries_total", "Upstream calls retried, by cause.", ["upstream", "cause"])
+upstream_errors = Counter(
+    "upstream_errors_total", "Upstream calls that failed after all attempts, by cause.", ["upstream", "cause"])
+upstream_queue_wait = Histogram(
+    "upstream_queue_wait_seconds", "Time requests waited for an upstream concurrency slot.", ["upstream"])
+upstream_in_flight = Gauge(
+    "upstream_requests_in_flight", "Upstream calls currently in progress.", ["upstream"])
+
+
+def record_retry(upstream, cause, attempt, error):
+    upstream_retries.inc(upstream=upstream, cause=cause)
+    log_event("upstream_retry", upstream=upstream, cause=cause, attempt=attempt, error=str(error)[:200])
+
+
+def record_failure(upstream, cause, error):
+    upstream_errors.inc(upstream=upstream, cause=cause)
+    log_event("upstream_error", upstream=upstream, cause=cause, error=str(error)[:200])
+
+
+def register_cache_stats(name, stats_function):
+    """
+    Exposes a cache's stats() dict (hits / misses / hit_rate / entries ...) as gauges named
+    <name>_<key>, read only when /metrics is scraped.
+    """
+    def collect():
+        stats = stats_function()
+        return [(f"{name}_{key}", f"{name} {key.replace('_', ' ')}.", "gauge", [({}, value)])
+                for key, value in stats.items() if isinstance(value, (int, float)) and not isinstance(value, bool)]
+    REGISTRY.register_callback(collect)
+
+
+def metrics_text():
+    """Returns all metrics in the Prometheus text exposition format."""
+    return REGISTRY.render()
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def instrument_flask_app(app, service):
+    """
+    Records latency, status and in-flight count of every request to `app` and adds GET /metrics.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+        http_requests_in_flight.inc(service=service)
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            # The URL rule (not the raw path) keeps the number of label values bounded.
+            endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+            method, status = request.method, response.status_code
+
+            def record():
+                http_requests_in_flight.dec(service=service)
+                seconds = time.perf_counter() - start
+                http_request_duration.observe(seconds, service=service, endpoint=endpoint, method=method, status=status)
+                log_event("http_request", service=service, endpoint=endpoint, method=method,
+                          status=status, duration_ms=round(seconds * 1000, 3))
+
+            # A streamed body is generated after this hook returns; the request ends when the
+            # server closes the response.
+            response.call_on_close(record)
+        return response
+
+    @app.teardown_request
+    def _release_in_flight(error):
+        # after_request does not run when a view raises; balance the gauge here instead.
+        if g.pop("metrics_start", None) is not None:
+            http_requests_in_flight.dec(service=service)
+
+    @app.route("/metrics", methods=["GET"])
+    def _metrics():
+        return Response(metrics_text(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def aiohttp_middleware(service):
+    """Returns an aiohttp middleware recording the same request metrics as instrument_flask_app."""
+    from aiohttp import web
+
+    @web.middleware
+    async def middleware(request, handler):
+        start = time.perf_counter()
+        status = 500
+        http_requests_in_flight.inc(service=service)
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            http_requests_in_flight.dec(service=service)
+            seconds = time.perf_counter() - start
+            resource = request.match_info.route.resource
+            endpoint = resource.canonical if resource is not None else "unmatched"
+            http_request_duration.observe(seconds, service=service, endpoint=endpoint,
+                                          method=request.method, status=status)
+            log_event("http_request", service=service, endpoint=endpoint, method=request.method,
+                      status=status, duration_ms=round(seconds * 1000, 3))
+
+    return middleware
+
+
+async def handle_metrics(request):
+    """aiohttp route for GET /metrics."""
+    from aiohttp import web
+    return web.Response(body=metrics_text().encode("utf-8"), headers={"Content-Type": PROMETHEUS_CONTENT_TYPE})
@@ -1,16 +1,26 @@
+import math
 import os
 import time
 from dotenv import load_dotenv
 import random
 import json
+import sys
+import threading
 import requests
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.metrics import confusion_matrix, classification_report
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 
-# Load environment variables from .env file
+# Load environment variables from .env file, before the modules below read their settings.
 load_dotenv()
 
+from http_client import get_session
+from llm_cache import LLMResultCache, make_cache_key
+from llm_client import LLMClient, backoff_delay
+from metrics import record_failure, record_retry, upstream_errors, upstream_retries
+from story_chunks import select_within_budget, split_into_chunks, weighted_sentiment
+from story_metadata import parse_story_id
+from story_stream import FAILED_SUMMARIES, LOCAL_SUMMARY, MANUAL_SUMMARY, iter_stories, write_stories
+from evaluate_sentiment import load_labels, save_labels
+
 # -----------------------
 # LM Studio API Settings
 # -----------------------
@@ -18,20 +28,70 @@ load_dotenv()
 LM_STUDIO_API = os.getenv("LM_STUDIO_API")
 MODEL = os.getenv("MODEL")
 
+BASE_DIR = os.path.dirname(__file__)
+
+# Maximum number of stories analyzed at the same time per LM Studio server (requests in flight).
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+
+# Number of stories packed into one LM Studio request (1 = one story per request).
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "1"))
+
+# Characters of each story sent to the LLM in the default (truncating) mode.
+STORY_TRUNCATE_CHARS = 1500
+
+# Chunked mode (LLM_CHUNKED=1): long stories are split on paragraph boundaries into chunks of up to
+# LLM_CHUNK_CHARS characters that are analyzed concurrently and reduced to one sentiment
+# (length-weighted vote) and one summary. At most LLM_CHUNK_TOKEN_BUDGET tokens of each story are
+# sent (0 = no limit), and at most LLM_CHUNK_MAX_IN_FLIGHT chunk requests run at once
+# (default: the number of analysis workers).
+LLM_CHUNKED = os.getenv("LLM_CHUNKED", "0").lower() in ("1", "true", "yes")
+LLM_CHUNK_CHARS = int(os.getenv("LLM_CHUNK_CHARS", "1500"))
+LLM_CHUNK_TOKEN_BUDGET = int(os.getenv("LLM_CHUNK_TOKEN_BUDGET", "2000"))
+LLM_CHUNK_MAX_IN_FLIGHT = int(os.getenv("LLM_CHUNK_MAX_IN_FLIGHT", "0"))
+
+# Local pre-classification (LOCAL_SENTIMENT=1): a scikit-learn model trained on the previous
+# analyzed_stories.json labels the stories it is confident about (see sentiment_classifier.py,
+# LOCAL_SENTIMENT_THRESHOLD) and only the others are sent to the LLM.
+LOCAL_SENTIMENT = os.getenv("LOCAL_SENTIMENT", "0").lower() in ("1", "true", "yes")
+
 # Ensure the variables were loaded (Optional check, but good practice)
 if not LM_STUDIO_API or not MODEL:
     print("FATAL ERROR: LM_STUDIO_API or MODEL not found in .env file.")
     exit(1)
 
+# Persistent cache of analysis results so re-runs only send new stories to the LLM.
+# Set LLM_CACHE_PATH to an empty value to disable it; a relative path is resolved against BASE_DIR.
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+if LLM_CACHE_PATH:
+    LLM_CACHE_PATH = os.path.join(BASE_DIR, LLM_CACHE_PATH)
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+llm_cache = LLMResultCache(LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES) if LLM_CACHE_PATH else None
+
+# Shared keep-alive session so concurrent workers reuse TCP connections to LM Studio
+# instead of opening a new one per story.
+http_session = get_session("lmstudio", LLM_MAX_CONCURRENCY)
+
+# Adaptive concurrency, retries with jittered backoff and a circuit breaker (see llm_client.py).
+# LM_STUDIO_API may list several servers (comma-separated); requests are balanced across them.
+# analyze_stories_concurrently raises each server's concurrency ceiling to its worker count.
+llm_client = LLMClient(LM_STUDIO_API, LLM_MAX_CONCURRENCY, session=http_session, timeout=180)
+
+# Token usage reported by the API (OpenAI-compatible "usage" field), summed over all requests.
+token_usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+token_usage_lock = threading.Lock()
+
+def record_token_usage(data):
+    """Adds the token counts of one chat completions response to `token_usage`."""
+    usage = data.get("usage") or {}
+    with token_usage_lock:
+        token_usage["requests"] += 1
+        token_usage["prompt_tokens"] += usage.get("prompt_tokens", 0)
+        token_usage["completion_tokens"] += usage.get("completion_tokens", 0)
+
 # -----------------------
 # Local Story Analyzer (Sentiment + Summary)
 # -----------------------
-def analyze_sentiment_lmstudio(text, max_retries=3):
-    """
-    Sends text to LM Studio local API and returns sentiment, summary, and raw LLM output.
-    Returns: A tuple (sentiment: str, summary: str, raw_output: str)
-    """
-    system_prompt = """You are an expert sentiment classifier and summarizer. Your task is to analyze the user's input (a disaster story) and respond ONLY with a raw JSON object containing two keys:
+SENTIMENT_SYSTEM_PROMPT = """You are an expert sentiment classifier and summarizer. Your task is to analyze the user's input (a disaster story) and respond ONLY with a raw JSON object containing two keys:
 1. "sentiment": must be exactly one word: 'positive', 'negative', or 'neutral'.
 2. "summary": A concise, one-sentence summary of the story (max 50 words).
 
@@ -48,6 +108,29 @@ Response: {"sentiment": "negative", "summary": "A woman's attempt to reach the h
 Text: I was the manager of the restaurant... (story content) ...
 Response: {"sentiment": "neutral", "summary": "A restaurant manager experienced the earthquake while protecting oven dishes, noting the strange behavior of freezers before finding shelter in a doorway."}
 """
+SENTIMENT_TEMPERATURE = 0.0
+
+def sentiment_cache_key(text, model=None, system_prompt=None):
+    """Cache key of analyze_sentiment_lmstudio's result for `text` with this model and prompt."""
+    return make_cache_key(model or MODEL, system_prompt or SENTIMENT_SYSTEM_PROMPT, SENTIMENT_TEMPERATURE, text)
+
+def analyze_sentiment_lmstudio(text, max_retries=3, model=None, system_prompt=None, cache_checked=False):
+    """
+    Sends text to LM Studio local API and returns sentiment, summary, and raw LLM output.
+    Successful results are served from / stored in the persistent LLM cache when it is enabled.
+    `model` and `system_prompt` override MODEL and SENTIMENT_SYSTEM_PROMPT (e.g. to evaluate a
+    prompt variant, see evaluate_sentiment.py). Callers that already looked the text up in the
+    cache pass cache_checked=True, so the miss is not looked up (and counted) twice.
+    Returns: A tuple (sentiment: str, summary: str, raw_output: str)
+    """
+    model = model or MODEL
+    system_prompt = system_prompt or SENTIMENT_SYSTEM_PROMPT
+    cache_key = None
+    if llm_cache is not None:
+        cache_key = sentiment_cache_key(text, model, system_prompt)
+        cached = None if cache_checked else llm_cache.get(cache_key)
+        if cached is not None:
+            return tuple(cached)
     
     user_prompt = f"""
 Text: {text}
@@ -56,21 +139,21 @@ Response:""" # Prompt the model to output the JSON object after this line
     full_prompt = system_prompt + "\n\n" + user_prompt 
     
     payload = {
-        "model": MODEL,
+        "model": model,
         "messages": [
             {"role": "user", "content": full_prompt}
         ],
-        "temperature": 0.0, 
+        "temperature": SENTIMENT_TEMPERATURE, 
         "max_tokens": 150  # Increased max_tokens for JSON output
     }
 
     for attempt in range(max_retries):
         try:
             # 1. PRIMARY API CALL (Only one is needed per attempt)
-            response = requests.post(LM_STUDIO_API, json=payload, timeout=180)
-            response.raise_for_status() 
+            response = llm_client.post(payload, "analyze")
             
             data = response.json()
+            record_token_usage(data)
             json_raw = data.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
             
             # --- 🛠️ FIX: Robust JSON Extraction and Typos ---
@@ -90,7 +173,7 @@ Response:""" # Prompt the model to output the JSON object after this line
                 
             except ValueError as ve:
                 # This handles cases where '{' or '}' are missing entirely
-                raise Exception(f"Failed to find valid JSON structure markers. Error: {ve}")
+                raise ValueError(f"Failed to find valid JSON structure markers. Error: {ve}")
 
             # 2. Use json.loads to parse the extracted string
             parsed_data = json.loads(json_to_parse)
@@ -105,105 +188,623 @@ Response:""" # Prompt the model to output the JSON object after this line
             # Final validation
             if sentiment in ["positive", "negative", "neutral"] and summary:
                 # FIX: Return the required three values
+                if cache_key is not None:
+                    llm_cache.set(cache_key, [sentiment, summary, json_raw])
                 return sentiment, summary, json_raw
             else:
                 # Raise exception if final validation fails (e.g., sentiment is an unrecognized word)
                 raise Exception(f"Parsed JSON validation failed. Sentiment: {sentiment}, Summary: {summary}") 
         
         except requests.exceptions.RequestException as e:
-            if attempt < max_retries - 1:
-                wait_time = 2**(attempt + 1)
-                print(f"⚠️ Error contacting LM Studio API (Attempt {attempt + 1}/{max_retries}): {e}. Retrying in {wait_time}s...")
-                time.sleep(wait_time)
-                continue
-            else:
-                print(f"❌ LM Studio API failed after {max_retries} attempts: {e}")
-                # FIX: Return a tuple for API error
-                return "neutral", "API Error", "API_ERROR"
+            # llm_client has already retried what was worth retrying (or the circuit is open).
+            print(f"❌ LM Studio API request failed: {e}")
+            # FIX: Return a tuple for API error
+            return "neutral", "API Error", "API_ERROR"
 
         except Exception as e:
             # This handles json.JSONDecodeError, ValueError from index(), and custom validation exceptions
             # Note: json_raw must be defined before reaching this point, which it is if the API call succeeded.
+            # ValueError (incl. JSONDecodeError) means unparseable output; anything else failed validation.
+            cause = "parse" if isinstance(e, ValueError) else "validation"
             if attempt < max_retries - 1:
-                wait_time = 2**(attempt + 1)
+                wait_time = backoff_delay(attempt + 1)
+                record_retry("lmstudio", cause, attempt + 1, e)
                 # Print the raw output that failed to help with debugging
-                print(f"⚠️ Internal processing error (Attempt {attempt + 1}/{max_retries}): Failed to parse LLM JSON output: {json_raw[:100]}... Error: {e}. Retrying in {wait_time}s...")
+                print(f"⚠️ Internal processing error (Attempt {attempt + 1}/{max_retries}): Failed to parse LLM JSON output: {json_raw[:100]}... Error: {e}. Retrying in {wait_time:.1f}s...")
                 time.sleep(wait_time)
                 continue
             else:
+                record_failure("lmstudio", cause, e)
                 print(f"❌ Internal processing failed after {max_retries} attempts: Failed to parse LLM JSON output: {json_raw[:100]}... Error: {e}")
                 # FIX: Return a tuple for internal error
                 return "neutral", "Parse Error", json_raw
     
     return "neutral", "Unknown Error", "UNKNOWN_ERROR"
+
+# -----------------------
+# Batched Story Analyzer (several stories per request)
+# -----------------------
+BATCH_SYSTEM_PROMPT = """You are an expert sentiment classifier and summarizer. You will receive several disaster stories, each starting on a new line with "Story <index>:". Analyze every story independently and respond ONLY with a raw JSON array containing one object per story, in the same order, each with three keys:
+1. "index": the story's index number.
+2. "sentiment": must be exactly one word: 'positive', 'negative', or 'neutral'.
+3. "summary": A concise, one-sentence summary of the story (max 50 words).
+
+DO NOT add any explanation, code fences (```json), quotation marks around the JSON, or any extra text outside the JSON array itself.
+
+Here is an example:
+
+Story 1: “He patched me in” ... (story content) ...
+Story 2: 41.5 weeks pregnant and on the way to the hospital... (story content) ...
+Story 3: I was the manager of the restaurant... (story content) ...
+Response: [{"index": 1, "sentiment": "positive", "summary": "Despite being separated by distance, a man happily reconnected with his 90-year-old mother via a clear three-way video conversation patched in by his son."}, {"index": 2, "sentiment": "negative", "summary": "A woman's attempt to reach the hospital for induction was thwarted by traffic and chaos following the earthquake, forcing her to return home."}, {"index": 3, "sentiment": "neutral", "summary": "A restaurant manager experienced the earthquake while protecting oven dishes, noting the strange behavior of freezers before finding shelter in a doorway."}]
+"""
+
+def analyze_sentiment_batch_lmstudio(texts):
+    """
+    Sends several stories to LM Studio in a single request, so the few-shot prompt is paid
+    for once per batch instead of once per story.
+    Stories that are missing from the model's JSON array or fail validation are re-analyzed
+    one at a time with analyze_sentiment_lmstudio.
+    Returns: A list of (sentiment, summary, raw_output) tuples, one per input text.
+    """
+    results = [None] * len(texts)
+    cache_keys = [None] * len(texts)
+    if llm_cache is not None:
+        for i, text in enumerate(texts):
+            cache_keys[i] = make_cache_key(MODEL, BATCH_SYSTEM_PROMPT, SENTIMENT_TEMPERATURE, text)
+            cached = llm_cache.get(cache_keys[i])
+            if cached is not None:
+                results[i] = tuple(cached)
+
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        stories_block = "\n\n".join(f"Story {n}: {texts[i]}" for n, i in enumerate(pending, start=1))
+        user_prompt = f"""
+Stories to analyze:
+
+{stories_block}
+Response:"""
+
+        payload = {
+            "model": MODEL,
+            "messages": [
+                {"role": "user", "content": BATCH_SYSTEM_PROMPT + "\n\n" + user_prompt}
+            ],
+            "temperature": SENTIMENT_TEMPERATURE,
+            "max_tokens": 150 * len(pending)
+        }
+
+        try:
+            response = llm_client.post(payload, "analyze_batch")
+
+            data = response.json()
+            record_token_usage(data)
+            json_raw = data.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
+
+            # Same robust extraction as the single-story path, but for a JSON array.
+            items = json.loads(json_raw[json_raw.index('['):json_raw.rindex(']') + 1])
+
+            for item in items:
+                if not isinstance(item, dict):
+                    continue
+                try:
+                    n = int(item.get("index"))
+                except (TypeError, ValueError):
+                    continue
+                if not 1 <= n <= len(pending):
+                    continue
+
+                sentiment = str(item.get("sentiment", "")).lower().strip()
+                summary = str(item.get("summary", "")).strip()
+                if sentiment == "neutrral":
+                    sentiment = "neutral"
+
+                if sentiment in ["positive", "negative", "neutral"] and summary:
+                    i = pending[n - 1]
+                    results[i] = (sentiment, summary, json.dumps(item, ensure_ascii=False))
+                    if cache_keys[i] is not None:
+                        llm_cache.set(cache_keys[i], list(results[i]))
+
+        except requests.exceptions.RequestException as e:
+            print(f"⚠️ Error contacting LM Studio API for a batch of {len(pending)} stories: {e}")
+        except ValueError as e:
+            # Covers json.JSONDecodeError and missing '[' / ']' markers.
+            record_retry("lmstudio", "parse", 1, e)
+            print(f"⚠️ Failed to parse batched LLM JSON output for {len(pending)} stories: {e}")
+
+    failed = [i for i, result in enumerate(results) if result is None]
+    if failed:
+        print(f"⚠️ {len(failed)}/{len(texts)} stories in batch need a single-story retry.")
+        for i in failed:
+            results[i] = analyze_sentiment_lmstudio(texts[i])
+    return results
+
+# -----------------------
+# Concurrent batch analysis
+# -----------------------
+def size_llm_pool(max_workers=None):
+    """
+    Caps each LLM server at its share of a worker pool: LLM_MAX_CONCURRENCY by default, or
+    max_workers split evenly over the servers (rounded up) when the caller sizes the pool.
+
+    Returns:
+        int: The pool size, `max_workers` or LLM_MAX_CONCURRENCY per server.
+    """
+    backends = len(llm_client.backends)
+    if max_workers:
+        llm_client.set_max_concurrency(math.ceil(max_workers / backends))
+        return max_workers
+    llm_client.set_max_concurrency(LLM_MAX_CONCURRENCY)
+    return LLM_MAX_CONCURRENCY * backends
+
+def analyze_stories_concurrently(stories, max_workers=None, on_result=None, batch_size=None):
+    """
+    Analyzes many stories with a bounded pool of worker threads so the LM Studio server
+    always has up to `max_workers` requests in flight.
+
+    Args:
+        stories (list): (story_id, text) pairs to analyze.
+        max_workers (int): Maximum concurrent requests. Defaults to LLM_MAX_CONCURRENCY per LLM server.
+        on_result (callable): Optional callback invoked with each result tuple as soon as it
+            completes (always from the calling thread), e.g. to checkpoint progress.
+        batch_size (int): Stories packed into each request. Defaults to LLM_BATCH_SIZE;
+            values above 1 use analyze_sentiment_batch_lmstudio.
+
+    Returns:
+        list: (story_id, sentiment, summary, raw_output) tuples in the same order as `stories`.
+    """
+    batch_size = batch_size or LLM_BATCH_SIZE
+    results = [None] * len(stories)
+    if not stories:
+        return results
+    max_workers = size_llm_pool(max_workers)
+    get_session("lmstudio", max_workers)  # one pooled connection per worker
+
+    def analyze_batch(indexes):
+        texts = [stories[index][1] for index in indexes]
+        if batch_size == 1:
+            return [analyze_sentiment_lmstudio(texts[0])]
+        return analyze_sentiment_batch_lmstudio(texts)
+
+    batches = [list(range(start, min(start + batch_size, len(stories))))
+               for start in range(0, len(stories), batch_size)]
+
+    with token_usage_lock:
+        tokens_before = token_usage["prompt_tokens"] + token_usage["completion_tokens"]
+        requests_before = token_usage["requests"]
+
+    start_time = time.perf_counter()
+    completed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(analyze_batch, indexes): indexes for indexes in batches}
+        for future in as_completed(futures):
+            indexes = futures[future]
+            for index, (sentiment, summary, raw_output) in zip(indexes, future.result()):
+                results[index] = (stories[index][0], sentiment, summary, raw_output)
+                if on_result is not None:
+                    on_result(results[index])
+
+            previous = completed
+            completed += len(indexes)
+            if completed // 10 > previous // 10 or completed == len(stories):
+                elapsed = time.perf_counter() - start_time
+                print(f"   ... {completed}/{len(stories)} stories analyzed ({completed / elapsed:.2f} stories/sec)")
+
+    elapsed = time.perf_counter() - start_time
+    with token_usage_lock:
+        tokens_used = token_usage["prompt_tokens"] + token_usage["completion_tokens"] - tokens_before
+        requests_sent = token_usage["requests"] - requests_before
+    print(f"⏱️ Analyzed {len(stories)} stories in {elapsed:.1f}s "
+          f"({len(stories) / elapsed:.2f} stories/sec, {max_workers} workers, batch size {batch_size}, "
+          f"{requests_sent} LLM requests, {tokens_used / len(stories):.0f} tokens/story)")
+    retries = {cause: count for (upstream, cause), count in upstream_retries.values().items() if upstream == "lmstudio"}
+    errors = {cause: count for (upstream, cause), count in upstream_errors.values().items() if upstream == "lmstudio"}
+    if retries or errors:
+        print(f"⚠️ LLM retries by cause: {retries or 'none'}; failures by cause: {errors or 'none'}")
+    return results
+
+# -----------------------
+# Chunked (map-reduce) analysis of full stories
+# -----------------------
+REDUCE_SYSTEM_PROMPT = """You will receive short summaries of consecutive parts of ONE disaster story, in order. Combine them into a single concise, one-sentence summary of the whole story (max 50 words). Respond ONLY with a raw JSON object with one key, "summary".
+
+DO NOT add any explanation, code fences (```json), or any extra text outside the JSON object itself.
+"""
+
+def reduce_chunk_summaries(summaries):
+    """
+    Combines the summaries of a story's chunks into one summary with a single LLM request.
+    Falls back to the first chunk's summary if the request or its parsing fails.
+    """
+    if len(summaries) == 1:
+        return summaries[0]
+    parts = "\n".join(f"Part {n}: {summary}" for n, summary in enumerate(summaries, start=1))
+
+    cache_key = None
+    if llm_cache is not None:
+        cache_key = make_cache_key(MODEL, REDUCE_SYSTEM_PROMPT, SENTIMENT_TEMPERATURE, parts)
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached[0]
+
+    payload = {
+        "model": MODEL,
+        "messages": [
+            {"role": "user", "content": REDUCE_SYSTEM_PROMPT + "\n\n" + parts + "\nResponse:"}
+        ],
+        "temperature": SENTIMENT_TEMPERATURE,
+        "max_tokens": 150
+    }
+    try:
+        response = llm_client.post(payload, "reduce")
+        data = response.json()
+        record_token_usage(data)
+        json_raw = data.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
+        summary = str(json.loads(json_raw[json_raw.index('{'):json_raw.rindex('}') + 1]).get("summary", "")).strip()
+        if not summary:
+            raise ValueError("LLM returned an empty summary.")
+    except requests.exceptions.RequestException as e:
+        print(f"⚠️ Could not reduce {len(summaries)} chunk summaries, keeping the first: {e}")
+        return summaries[0]
+    except (ValueError, AttributeError, IndexError, KeyError, TypeError) as e:
+        # JSONDecodeError / missing braces, a JSON value that is not an object, or an empty
+        # `choices` list / malformed message in the response body.
+        record_failure("lmstudio", "parse", e)
+        print(f"⚠️ Failed to parse reduced summary, keeping the first chunk's: {e}")
+        return summaries[0]
+
+    if cache_key is not None:
+        llm_cache.set(cache_key, [summary])
+    return summary
+
+def analyze_stories_chunked(stories, max_in_flight=None, on_result=None, chunk_chars=None, token_budget=None):
+    """
+    Map-reduce counterpart of analyze_stories_concurrently for full-length stories.
+
+    Each story is split into paragraph-aligned chunks (keeping at most `token_budget` tokens of it,
+    see story_chunks.select_within_budget) that are analyzed like short stories. The chunks of all
+    stories share one pool of `max_in_flight` workers, and stories are fed to it in order, so the
+    number of chunk requests in flight stays bounded however long the stories are, and finished
+    stories (and on_result checkpoints) arrive progressively. When all chunks of a story are in,
+    its sentiment is the length-weighted vote of the chunk sentiments and its summary is reduced
+    from the chunk summaries (one extra request, only for stories with several chunks).
+
+    Args:
+        stories (list): (story_id, full text) pairs.
+        max_in_flight (int): Maximum concurrent chunk/reduce requests. Defaults to
+            LLM_CHUNK_MAX_IN_FLIGHT, or LLM_MAX_CONCURRENCY per LLM server.
+        on_result (callable): As in analyze_stories_concurrently.
+        chunk_chars (int): Maximum characters per chunk. Defaults to LLM_CHUNK_CHARS.
+        token_budget (int): Maximum tokens analyzed per story. Defaults to LLM_CHUNK_TOKEN_BUDGET.
+
+    Returns:
+        list: (story_id, sentiment, summary, raw_output) tuples in the same order as `stories`;
+        raw_output is a JSON record of the per-chunk sentiments.
+    """
+    chunk_chars = chunk_chars or LLM_CHUNK_CHARS
+    token_budget = LLM_CHUNK_TOKEN_BUDGET if token_budget is None else token_budget
+    results = [None] * len(stories)
+    if not stories:
+        return results
+    max_in_flight = size_llm_pool(max_in_flight or LLM_CHUNK_MAX_IN_FLIGHT)
+    get_session("lmstudio", max_in_flight)
+
+    story_chunks = {}
+    chunk_results = {}
+    counts = {"chunks": 0, "chunks_total": 0, "chars_analyzed": 0, "chars_total": 0}
+
+    def chunk_tasks():
+        for index, (_, text) in enumerate(stories):
+            all_chunks = split_into_chunks(text, chunk_chars) or [text]
+            chunks = select_within_budget(all_chunks, token_budget)
+            story_chunks[index] = chunks
+            chunk_results[index] = [None] * len(chunks)
+            counts["chunks"] += len(chunks)
+            counts["chunks_total"] += len(all_chunks)
+            counts["chars_analyzed"] += sum(len(chunk) for chunk in chunks)
+            counts["chars_total"] += len(text)
+            for position, chunk in enumerate(chunks):
+                yield index, position, chunk
+
+    with token_usage_lock:
+        tokens_before = token_usage["prompt_tokens"] + token_usage["completion_tokens"]
+        requests_before = token_usage["requests"]
+
+    start_time = time.perf_counter()
+    completed = 0
+    tasks = chunk_tasks()
+    pending = {}
+
+    def finish(index, sentiment, summary):
+        nonlocal completed
+        chunks = story_chunks.pop(index)
+        analyzed = chunk_results.pop(index)
+        raw_output = json.dumps({
+            "sentiment": sentiment,
+            "summary": summary,
+            "chunks": [{"chars": len(chunk), "sentiment": result[0], "summary": result[1]}
+                       for chunk, result in zip(chunks, analyzed)],
+        }, ensure_ascii=False)
+        results[index] = (stories[index][0], sentiment, summary, raw_output)
+        if on_result is not None:
+            on_result(results[index])
+        completed += 1
+        if completed % 10 == 0 or completed == len(stories):
+            elapsed = time.perf_counter() - start_time
+            print(f"   ... {completed}/{len(stories)} stories analyzed ({completed / elapsed:.2f} stories/sec)")
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        def fill():
+            while len(pending) < max_in_flight:
+                task = next(tasks, None)
+                if task is None:
+                    return
+                index, position, chunk = task
+                pending[executor.submit(analyze_sentiment_lmstudio, chunk)] = ("chunk", index, position)
+
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, index, detail = pending.pop(future)
+                if kind == "reduce":
+                    finish(index, detail, future.result())
+                    continue
+
+                chunk_results[index][detail] = future.result()
+                if any(result is None for result in chunk_results[index]):
+                    continue
+                valid = [(chunk, result) for chunk, result in zip(story_chunks[index], chunk_results[index])
+                         if result[1] not in FAILED_SUMMARIES]
+                if not valid:
+                    # Every chunk failed: report the first failure like the single-request path.
+                    finish(index, *chunk_results[index][0][:2])
+                    continue
+                sentiment = weighted_sentiment([(chunk, result[0]) for chunk, result in valid])
+                if len(valid) == 1:
+                    finish(index, sentiment, valid[0][1][1])
+                else:
+                    reduce = executor.submit(reduce_chunk_summaries, [result[1] for _, result in valid])
+                    pending[reduce] = ("reduce", index, sentiment)
+            fill()
+
+    elapsed = time.perf_counter() - start_time
+    with token_usage_lock:
+        tokens_used = token_usage["prompt_tokens"] + token_usage["completion_tokens"] - tokens_before
+        requests_sent = token_usage["requests"] - requests_before
+    coverage = counts["chars_analyzed"] / counts["chars_total"] if counts["chars_total"] else 1.0
+    print(f"⏱️ Analyzed {len(stories)} stories in {counts['chunks']} chunks in {elapsed:.1f}s "
+          f"({len(stories) / elapsed:.2f} stories/sec, {max_in_flight} chunk requests in flight, "
+          f"{requests_sent} LLM requests, {tokens_used / len(stories):.0f} tokens/story, "
+          f"{coverage:.0%} of the text analyzed, {counts['chunks_total'] - counts['chunks']} chunks over budget)")
+    return results
+
+def analyze_stories(stories, on_result=None, preclassifier=None):
+    """
+    Analyzes full story texts in the configured mode: truncated to STORY_TRUNCATE_CHARS
+    (analyze_stories_concurrently), or chunked map-reduce when LLM_CHUNKED is set.
+
+    With a `preclassifier` (sentiment_classifier.SentimentPreClassifier), the whole batch is
+    scored locally first; stories it is confident about get its label (and the LOCAL_SUMMARY
+    placeholder) and only the rest are sent to the LLM.
+    """
+    if preclassifier is None:
+        if LLM_CHUNKED:
+            return analyze_stories_chunked(stories, on_result=on_result)
+        return analyze_stories_concurrently([(story_id, text[:STORY_TRUNCATE_CHARS]) for story_id, text in stories],
+                                            on_result=on_result)
+
+    start_time = time.perf_counter()
+    confident, uncertain = preclassifier.route([text for _, text in stories])
+    results = [None] * len(stories)
+    for position, (label, confidence) in confident.items():
+        raw_output = json.dumps({"method": "local", "sentiment": label, "confidence": round(confidence, 3)})
+        results[position] = (stories[position][0], label, LOCAL_SUMMARY, raw_output)
+        if on_result is not None:
+            on_result(results[position])
+    local_seconds = time.perf_counter() - start_time
+    print(f"🧮 Classified {len(confident)}/{len(stories)} stories locally in {local_seconds * 1000:.1f} ms; "
+          f"{len(uncertain)} need the LLM")
+
+    llm_results = analyze_stories([stories[position] for position in uncertain], on_result) if uncertain else []
+    for position, result in zip(uncertain, llm_results):
+        results[position] = result
+    print(f"⏱️ Pre-classified analysis took {time.perf_counter() - start_time:.1f}s "
+          f"({len(confident)} LLM calls saved)")
+    return results
+
+def train_preclassifier(records, exclude=()):
+    """
+    Trains the local sentiment classifier on analyzed records, skipping the story ids in `exclude`
+    (failed LLM results are skipped by training_rows). Returns None (everything goes to the LLM)
+    if there is too little data.
+    """
+    # scikit-learn takes about a second to import; only runs that use the classifier pay for it.
+    from sentiment_classifier import SentimentPreClassifier
+
+    usable = [record for record in records if record["story_id"] not in exclude]
+    try:
+        classifier = SentimentPreClassifier.train(usable)
+    except ValueError as e:
+        print(f"⚠️ Local sentiment classifier not trained, every story goes to the LLM: {e}")
+        return None
+    print(f"🧮 Trained the local sentiment classifier on {len(usable)} analyzed stories.")
+    return classifier
+
+# -----------------------
+# Checkpointing helpers
+# -----------------------
+def load_previous_results(output_json, checkpoint_path):
+    """
+    Loads records from a previous run so unchanged stories don't need to be analyzed again.
+    Records from the checkpoint file (an interrupted run) take precedence over the last saved output.
+    Returns: A dict {story_id: record}
+    """
+    previous = {}
+    if os.path.exists(output_json):
+        for record in iter_stories(output_json):
+            previous[record["story_id"]] = record
+
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A partially written last line from a crash; that story is simply redone.
+                    continue
+                previous[record["story_id"]] = record
+    return previous
+
+def append_checkpoint(checkpoint_file, record):
+    """Appends one finished record to the JSONL checkpoint and flushes it to disk immediately."""
+    checkpoint_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    checkpoint_file.flush()
+
 # -----------------------
 # Main preprocessing function
 # -----------------------
-def preprocess_victim_stories(data_dir: str, output_json: str):
+def preprocess_victim_stories(data_dir: str, output_json: str, incremental: bool = False):
     """
     Loads .txt stories, manually labels 30 random samples, then auto-analyzes the rest with LM Studio.
     Saves output as analyzed_stories.json and generates confusion matrix + sentiment chart.
+
+    Manual labels are kept in MANUAL_LABELS_PATH: stories labelled in an earlier run are not asked
+    again, and the LLM analysis runs in the background while new labels are typed in. The
+    evaluation (Step 4) uses evaluate_sentiment.py, so cached predictions are reused.
+
+    Every finished story is appended to a JSONL checkpoint next to `output_json`. With
+    `incremental=True`, stories already present in the previous output or checkpoint are reused
+    when their text is unchanged, so only new or edited files (and any left over from an
+    interrupted run) are labelled or sent to the LLM.
     """
     all_files = [f for f in os.listdir(data_dir) if f.endswith(".txt")]
     random.shuffle(all_files)
 
-    manual_samples = all_files[:30]
-    auto_samples = all_files[30:]
-
-    analyzed_data = []
-    ground_truth = {}
-
-    print("🟢 Step 1: Manual labeling of 30 random samples (Sentiment only)\n")
-    for f in manual_samples:
+    contents = {}
+    for f in all_files:
         file_path = os.path.join(data_dir, f)
         with open(file_path, "r", encoding="utf-8") as infile:
-            content = infile.read().strip()
-
-        print(f"\n📄 File: {f}\n--- Preview ---\n{content[:400]}\n")
-        label = input("Enter sentiment (positive / negative / neutral): ").strip().lower()
-        # Accept short forms
-        if label in ["pos", "+"]:
-            label = "positive"
-        elif label in ["neg", "-"]:
-            label = "negative"
-        elif label not in ["positive", "negative", "neutral"]:
-            label = "neutral"
-
-        ground_truth[f] = label
-        analyzed_data.append({
+            contents[f] = infile.read().strip()
+
+    checkpoint_path = os.path.splitext(output_json)[0] + ".checkpoint.jsonl"
+    previous = {}
+    if incremental:
+        previous = load_previous_results(output_json, checkpoint_path)
+    elif os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    # Reuse records whose story text has not changed since they were analyzed.
+    reused = {
+        f: previous[f] for f in all_files
+        if f in previous and previous[f].get("text") == contents[f]
+    }
+    pending = [f for f in all_files if f not in reused]
+    if incremental:
+        print(f"♻️ Incremental mode: reusing {len(reused)} unchanged stories, {len(pending)} new or changed.\n")
+
+    # Stories labelled in an earlier run (labels file or reused records) need no new input.
+    stored_labels = load_labels()
+    known_labels = {f: stored_labels[f] for f in all_files if f in stored_labels}
+    known_labels.update({f: reused[f]["sentiment"] for f in all_files
+                         if f in reused and reused[f].get("method") == "manual"})
+    reused_manual = [f for f in all_files if f in known_labels]
+    new_manual = [f for f in pending if f not in known_labels][:max(0, 30 - len(reused_manual))]
+    manual_samples = reused_manual + new_manual
+    auto_samples = [f for f in all_files if f not in manual_samples]
+
+    records = {f: reused[f] for f in all_files if f in reused}
+    checkpoint_file = open(checkpoint_path, "a", encoding="utf-8")
+    checkpoint_lock = threading.Lock()
+
+    def record_manual_label(f, label):
+        records[f] = {
             "story_id": f,
-            "text": content,
+            "text": contents[f],
             "sentiment": label,
-            "summary": "Manual analysis does not generate a summary.", # Placeholder for manual entries
+            "summary": MANUAL_SUMMARY, # Placeholder for manual entries
             "method": "manual"
-        })
+        }
+        with checkpoint_lock:
+            append_checkpoint(checkpoint_file, records[f])
 
-    print("\n🟢 Step 2: LM Studio auto analysis for remaining files...\n")
-    for f in auto_samples:
-        file_path = os.path.join(data_dir, f)
-        with open(file_path, "r", encoding="utf-8") as infile:
-            content = infile.read().strip()
-            
-        trimmed_content = content[:1500]
-        
-        # FIX: The function now returns three values
-        sentiment, summary, raw_output = analyze_sentiment_lmstudio(trimmed_content) 
-        
-        analyzed_data.append({
+    for f in reused_manual:
+        if f not in records:
+            record_manual_label(f, known_labels[f])
+
+    print("\n🟢 Step 2: LM Studio auto analysis for remaining files (in the background)...\n")
+
+    preclassifier = None
+    if LOCAL_SENTIMENT:
+        # Labels from the previous output plus this run's manual labels; never earlier local labels.
+        training = {}
+        if os.path.exists(output_json):
+            training = {record["story_id"]: record for record in iter_stories(output_json)}
+        training.update(records)
+        preclassifier = train_preclassifier(training.values())
+
+    def record_auto_result(result):
+        f, sentiment, summary, raw_output = result
+        records[f] = {
             "story_id": f,
-            "text": content, 
+            "text": contents[f],
             "sentiment": sentiment,
             "summary": summary, # ADDED: Summary to the output JSON
-            "method": "lmstudio"
-        })
+            "method": "local" if summary == LOCAL_SUMMARY else "lmstudio"
+        }
+        with checkpoint_lock:
+            append_checkpoint(checkpoint_file, records[f])
+
+    # Stories are analyzed concurrently and checkpointed as each one finishes. The analysis runs
+    # on a background thread so it does not wait for the manual labelling below.
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="auto-analysis") as background:
+        auto_analysis = background.submit(
+            analyze_stories,
+            [(f, contents[f]) for f in auto_samples if f not in records],
+            on_result=record_auto_result,
+            preclassifier=preclassifier,
+        )
+
+        print(f"🟢 Step 1: Manual labeling of {len(new_manual)} random samples (Sentiment only)\n")
+        for f in new_manual:
+            content = contents[f]
+
+            print(f"\n📄 File: {f}\n--- Preview ---\n{content[:400]}\n")
+            label = input("Enter sentiment (positive / negative / neutral): ").strip().lower()
+            # Accept short forms
+            if label in ["pos", "+"]:
+                label = "positive"
+            elif label in ["neg", "-"]:
+                label = "negative"
+            elif label not in ["positive", "negative", "neutral"]:
+                label = "neutral"
+
+            record_manual_label(f, label)
+            stored_labels[f] = label
+            save_labels(stored_labels)
+
+        auto_analysis.result()
+    checkpoint_file.close()
+
+    # The file name is parsed once here; later stages read the date, story number, location and
+    # author from the record instead of matching the story_id again.
+    analyzed_data = [{**records[f], **parse_story_id(f)} for f in manual_samples + auto_samples]
+    ground_truth = {f: records[f]["sentiment"] for f in manual_samples}
 
     # -----------------------
     # Save JSON output
     # -----------------------
+    # The JSONL file is the streaming input for geocode_stories.py; the JSON array is kept as an export.
+    output_jsonl = os.path.splitext(output_json)[0] + ".jsonl"
     try:
-        with open(output_json, "w", encoding="utf-8") as f:
-            json.dump(analyzed_data, f, indent=4, ensure_ascii=False)
-        print(f"✅ Saved analysis results to {output_json}")
+        write_stories(output_jsonl, analyzed_data)
+        write_stories(output_json, analyzed_data)
+        print(f"✅ Saved analysis results to {output_jsonl} and {output_json}")
+        # Everything in the checkpoint is now part of the saved output.
+        os.remove(checkpoint_path)
     except Exception as e:
         print(f"❌ Error saving JSON: {e}")
 
@@ -211,6 +812,12 @@ def preprocess_victim_stories(data_dir: str, output_json: str):
     # Visualization
     # -----------------------
     print("\n🟢 Step 3: Generating charts...\n")
+    # The plotting and metrics libraries take about a second to import, so only runs that get
+    # this far pay for them.
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from evaluate_sentiment import Variant, evaluate_variants, save_confusion_matrix_plot
+
     sentiments = [entry["sentiment"] for entry in analyzed_data]
     plt.figure(figsize=(6, 4))
     sns.countplot(x=sentiments, order=["positive", "neutral", "negative"])
@@ -220,42 +827,40 @@ def preprocess_victim_stories(data_dir: str, output_json: str):
 
     # Confusion matrix comparison for manual subset
     print("🟢 Step 4: Evaluating LM Studio performance on manual subset...\n")
-    true_labels = list(ground_truth.values())
-    predicted_labels = []
-    
-    for f in manual_samples:
-        file_path = os.path.join(data_dir, f)
-        with open(file_path, "r", encoding="utf-8") as infile:
-            story = infile.read()
-            
-        trimmed_story = story[:1500] 
-        
-        # FIX: Only the first value (sentiment) is needed for the confusion matrix
-        sentiment, _, _ = analyze_sentiment_lmstudio(trimmed_story) 
-        predicted_labels.append(sentiment)
+    # The evaluation harness reuses the predictions cached during earlier runs and sends the
+    # remaining stories concurrently. With local pre-classification it evaluates the combined
+    # pipeline, with a classifier that has not seen the manual labels it is judged against.
+    if preclassifier is not None:
+        variant = Variant("hybrid", "hybrid")
+    elif LLM_CHUNKED:
+        variant = Variant("chunked", "chunked")
+    else:
+        variant = Variant("lmstudio")
+    evaluation = evaluate_variants([variant], ground_truth, contents,
+                                   training_data=list(training.values()) if preclassifier is not None else None,
+                                   pipeline=sys.modules[__name__])[variant.name]
 
-    cm = confusion_matrix(true_labels, predicted_labels, labels=["positive", "neutral", "negative"])
-    
-    # Visualization and Saving (No changes needed here)
-    plt.figure(figsize=(5, 4))
-    sns.heatmap(cm, annot=True, fmt="d", cmap="Blues",
-                xticklabels=["positive", "neutral", "negative"],
-                yticklabels=["positive", "neutral", "negative"])
-    plt.xlabel("Predicted (LM Studio)")
-    plt.ylabel("Actual (Manual)")
-    plt.title("Confusion Matrix - LM Studio vs Manual")
-    plt.tight_layout()
-    plt.savefig(os.path.join(os.path.dirname(output_json), "confusion_matrix.png"))
-    plt.close()
+    save_confusion_matrix_plot(evaluation["confusion_matrix"],
+                               os.path.join(os.path.dirname(output_json), "confusion_matrix.png"),
+                               "Confusion Matrix - LM Studio vs Manual", "Predicted (LM Studio)")
 
-    # Optional: detailed classification report
-    report = classification_report(true_labels, predicted_labels, target_names=["positive", "neutral", "negative"], output_dict=True)
+    # Detailed classification report (over all three labels, in a fixed order)
     report_path = os.path.join(os.path.dirname(output_json), "analyzed_stories_evaluation_metrics.json")
     with open(report_path, "w", encoding="utf-8") as f:
-        json.dump(report, f, indent=4)
-    print(f"📊 Evaluation report saved to {report_path}")
+        json.dump(evaluation["report"], f, indent=4)
+    print(f"📊 Evaluation report saved to {report_path} (accuracy {evaluation['accuracy']:.3f}, "
+          f"{evaluation['cached']} cached predictions, {evaluation['llm_requests']} LLM requests)")
+
+    if len(llm_client.backends) > 1:
+        llm_client.print_backend_report()
+
+    if llm_cache is not None:
+        stats = llm_cache.stats()
+        print(f"🗃️ LLM cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate']:.0%} hit rate, {stats['entries']} entries stored)")
 
     print("\n✅ All done! Outputs:")
+    print(" - analyzed_stories.jsonl")
     print(" - analyzed_stories.json")
     print(" - sentiment_distribution.png")
     print(" - confusion_matrix.png")
@@ -267,4 +872,6 @@ def preprocess_victim_stories(data_dir: str, output_json: str):
 if __name__ == "__main__":
     data_dir = r"C:\Level 5\Hackthon_AI_ChatBot\data"
     output_json = r"C:\Level 5\Hackthon_AI_ChatBot\chatbot-api\analyzed_stories.json"
-    preprocess_victim_stories(data_dir, output_json)
\ No newline at end of file
+    # Set PREPROCESS_INCREMENTAL=1 to resume an interrupted run or only analyze new/changed stories.
+    incremental = os.getenv("PREPROCESS_INCREMENTAL", "0").lower() in ("1", "true", "yes")
+    preprocess_victim_stories(data_dir, output_json, incremental=incremental)
\ No newline at end of file
@@ -0,0 +1,154 @@
+# response_cache.py
+# Optional response cache with request coalescing for the empathetic response services.
+# Chat traffic is highly repetitive ("I lost my house"), so identical requests within the TTL are
+# answered from memory, and identical requests that arrive while the first one is still waiting on
+# the LLM share that single upstream call ("single flight") instead of each hitting the model.
+
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# Result handed to coalesced async waiters when the request computing the value was cancelled
+# (e.g. its client disconnected): one of them computes the value instead.
+_LEADER_CANCELLED = object()
+
+
+def normalize_message(message):
+    """Lower-cases, collapses whitespace and drops trailing punctuation ("I lost my house!" -> "i lost my house")."""
+    return _WHITESPACE_RE.sub(" ", message.strip().lower()).rstrip(" .!?")
+
+
+def make_response_cache_key(user_message, story_sentiment, model, temperature):
+    """Builds the cache key for one /generate_response request."""
+    return json.dumps([normalize_message(user_message), story_sentiment, model, float(temperature)])
+
+
+class ResponseCache:
+    """
+    In-memory TTL + LRU cache with single-flight coalescing, usable from Flask worker threads
+    (get_or_compute) and from the asyncio server (get_or_compute_async).
+    """
+
+    def __init__(self, max_entries=1000, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._async_inflight = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+    def get_or_compute(self, key, compute, should_cache=None):
+        """
+        Returns the cached value for `key`, waits for an identical in-flight call, or runs `compute()`.
+
+        Args:
+            key (str): Cache key (see make_response_cache_key).
+            compute (callable): Produces the value on a miss.
+            should_cache (callable): Optional predicate; values for which it returns False
+                (e.g. fallback messages) are returned but not stored.
+        """
+        with self._lock:
+            cached = self._lookup(key)
+            if cached is not None:
+                return cached
+            future = self._inflight.get(key)
+            if future is not None:
+                self._stats["coalesced"] += 1
+            else:
+                self._stats["misses"] += 1
+                self._inflight[key] = Future()
+        if future is not None:
+            return future.result()
+
+        future = self._inflight[key]
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            if should_cache is None or should_cache(value):
+                self._store(key, value)
+        future.set_result(value)
+        return value
+
+    async def get_or_compute_async(self, key, compute, should_cache=None):
+        """
+        Async version of get_or_compute; `compute` is a zero-argument coroutine function.
+        If the request computing the value is cancelled, a waiting request takes over.
+        """
+        while True:
+            with self._lock:
+                cached = self._lookup(key)
+                if cached is not None:
+                    return cached
+                future = self._async_inflight.get(key)
+                if future is not None:
+                    self._stats["coalesced"] += 1
+                else:
+                    self._stats["misses"] += 1
+                    self._async_inflight[key] = asyncio.get_running_loop().create_future()
+            if future is None:
+                break
+            # shield() so one waiter being cancelled does not cancel the shared result.
+            value = await asyncio.shield(future)
+            if value is not _LEADER_CANCELLED:
+                return value
+
+        future = self._async_inflight[key]
+        try:
+            value = await compute()
+        except BaseException as e:
+            with self._lock:
+                del self._async_inflight[key]
+            if isinstance(e, asyncio.CancelledError):
+                future.set_result(_LEADER_CANCELLED)
+            else:
+                future.set_exception(e)
+                # Mark the exception as retrieved in case no other request was waiting.
+                future.exception()
+            raise
+        with self._lock:
+            del self._async_inflight[key]
+            if should_cache is None or should_cache(value):
+                self._store(key, value)
+        future.set_result(value)
+        return value
+
+    def stats(self):
+        """Returns hit/miss/coalesced counters, the hit rate and the current size."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _lookup(self, key):
+        # Caller holds self._lock.
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        self._stats["hits"] += 1
+        return value
+
+    def _store(self, key, value):
+        # Caller holds self._lock.
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,173 @@
+# sentiment_classifier.py
+# A fast local sentiment classifier that lets preprocess_data.py skip the LLM for easy stories.
+# TF-IDF word features + logistic regression, trained on analyzed_stories.json (the manual labels
+# and the earlier LLM labels; manual labels weigh more). A whole batch is scored with one sparse
+# matrix product; tokenizing the text is most of the cost (well under a millisecond per story,
+# against seconds for an LLM call). Only stories whose top class probability is below
+# LOCAL_SENTIMENT_THRESHOLD are sent to the LLM.
+# Stories labelled by this classifier (method "local") are never used to train it again.
+#
+# Usage:
+#   python sentiment_classifier.py                 # cross-validated report on analyzed_stories.json
+#   python sentiment_classifier.py "some text"     # classify one text
+
+import os
+import sys
+import time
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import StratifiedKFold
+
+from story_stream import FAILED_SUMMARIES, iter_stories
+
+# --- Configuration ---
+BASE_DIR = os.path.dirname(__file__)
+ANALYZED_DATA_FILE = os.path.join(BASE_DIR, "analyzed_stories.json")
+
+# Stories whose predicted probability reaches this value are not sent to the LLM.
+LOCAL_SENTIMENT_THRESHOLD = float(os.getenv("LOCAL_SENTIMENT_THRESHOLD", "0.7"))
+# Training weight of a manually labelled story relative to an LLM-labelled one.
+MANUAL_LABEL_WEIGHT = float(os.getenv("MANUAL_LABEL_WEIGHT", "3"))
+
+SENTIMENT_LABELS = ["positive", "negative", "neutral"]
+# Methods whose labels are used for training.
+TRAINING_METHODS = ("manual", "lmstudio")
+
+
+def training_rows(stories):
+    """
+    Returns the (text, label, is_manual) triples usable for training. Failed LLM results are
+    skipped: their "neutral" is a default, not a label.
+    """
+    return [(story["text"], story["sentiment"], story.get("method") == "manual") for story in stories
+            if story.get("method") in TRAINING_METHODS and story.get("sentiment") in SENTIMENT_LABELS
+            and story.get("text") and story.get("summary") not in FAILED_SUMMARIES]
+
+
+class SentimentPreClassifier:
+    """TF-IDF + logistic regression sentiment model with confidence-based routing."""
+
+    def __init__(self, vectorizer, model):
+        self.vectorizer = vectorizer
+        self.model = model
+
+    @classmethod
+    def train(cls, stories, manual_weight=MANUAL_LABEL_WEIGHT):
+        """
+        Fits the model on analyzed story records (dicts with text, sentiment and method).
+        Raises ValueError if the records do not contain at least two labelled classes.
+        """
+        rows = training_rows(stories)
+        if len({label for _, label, _ in rows}) < 2:
+            raise ValueError(f"Need labelled stories of at least two sentiments to train, got {len(rows)} stories.")
+        texts, labels, manual = zip(*rows)
+        vectorizer = TfidfVectorizer(min_df=2, sublinear_tf=True, max_features=20000)
+        features = vectorizer.fit_transform(texts)
+        model = LogisticRegression(C=10, class_weight="balanced", max_iter=2000)
+        model.fit(features, labels, sample_weight=np.where(manual, manual_weight, 1.0))
+        return cls(vectorizer, model)
+
+    def predict(self, texts):
+        """
+        Scores a batch of texts at once.
+
+        Returns:
+            tuple: (labels, confidences) - a list of predicted sentiments and a NumPy array with
+            the probability of each prediction.
+        """
+        if not texts:
+            return [], np.zeros(0)
+        probabilities = self.model.predict_proba(self.vectorizer.transform(texts))
+        best = probabilities.argmax(axis=1)
+        return list(self.model.classes_[best]), probabilities[np.arange(len(texts)), best]
+
+    def route(self, texts, threshold=LOCAL_SENTIMENT_THRESHOLD):
+        """
+        Splits a batch into confidently classified texts and texts that need the LLM.
+
+        Returns:
+            tuple: ({position: (label, confidence)} for confident texts, [positions of the others]).
+        """
+        labels, confidences = self.predict(texts)
+        confident, uncertain = {}, []
+        for position, (label, confidence) in enumerate(zip(labels, confidences)):
+            if confidence >= threshold:
+                confident[position] = (label, float(confidence))
+            else:
+                uncertain.append(position)
+        return confident, uncertain
+
+
+def cross_validate(stories, folds=5, thresholds=(0.5, 0.6, 0.7, 0.8), manual_weight=MANUAL_LABEL_WEIGHT):
+    """
+    Scores every story with a model trained on the other folds, so no story is judged by a
+    model that has seen its label.
+
+    Returns:
+        dict: Overall agreement with the LLM labels and accuracy on the manual labels, plus per
+        threshold the share of stories classified locally (LLM calls saved) and the agreement /
+        accuracy on those stories alone.
+    """
+    stories = [story for story in stories if training_rows([story])]
+    labels = np.array([story["sentiment"] for story in stories])
+    manual = np.array([story.get("method") == "manual" for story in stories])
+    predicted = np.empty(len(stories), dtype=object)
+    confidence = np.zeros(len(stories))
+    splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=0)
+    for train_index, test_index in splitter.split(np.zeros(len(stories)), labels):
+        classifier = SentimentPreClassifier.train([stories[i] for i in train_index], manual_weight)
+        fold_labels, fold_confidence = classifier.predict([stories[i]["text"] for i in test_index])
+        predicted[test_index] = fold_labels
+        confidence[test_index] = fold_confidence
+
+    def rate(mask):
+        return round(float(np.mean(predicted[mask] == labels[mask])), 3) if mask.any() else None
+
+    report = {
+        "stories": len(stories),
+        "manual_stories": int(manual.sum()),
+        "agreement_with_llm": rate(~manual),
+        "accuracy_on_manual": rate(manual),
+        "thresholds": [],
+    }
+    for threshold in thresholds:
+        local = confidence >= threshold
+        report["thresholds"].append({
+            "threshold": threshold,
+            "llm_calls_saved": round(float(local.mean()), 3),
+            "agreement_with_llm": rate(local & ~manual),
+            "accuracy_on_manual": rate(local & manual),
+            "manual_stories_local": int((local & manual).sum()),
+        })
+    return report
+
+
+def print_report(report):
+    print(f"📊 Local sentiment classifier, {report['stories']} stories "
+          f"({report['manual_stories']} labelled manually), {MANUAL_LABEL_WEIGHT:g}x manual weight:")
+    print(f"   All stories: {report['agreement_with_llm']} agreement with the LLM labels, "
+          f"{report['accuracy_on_manual']} accuracy on the manual labels")
+    for row in report["thresholds"]:
+        print(f"   threshold {row['threshold']:.2f}: {row['llm_calls_saved']:.0%} of LLM calls saved, "
+              f"{row['agreement_with_llm']} agreement with the LLM, {row['accuracy_on_manual']} accuracy on "
+              f"the {row['manual_stories_local']} manual stories classified locally")
+
+
+if __name__ == "__main__":
+    stories = list(iter_stories(ANALYZED_DATA_FILE))
+    if len(sys.argv) > 1:
+        classifier = SentimentPreClassifier.train(stories)
+        (label,), (confidence,) = classifier.predict([" ".join(sys.argv[1:])])
+        route = "local" if confidence >= LOCAL_SENTIMENT_THRESHOLD else "LLM"
+        print(f"{label} ({confidence:.2f}, {route})")
+        sys.exit(0)
+
+    print_report(cross_validate(stories))
+    classifier = SentimentPreClassifier.train(stories)
+    texts = [story["text"] for story in stories]
+    start = time.perf_counter()
+    classifier.predict(texts)
+    elapsed = time.perf_counter() - start
+    print(f"⏱️ Scored {len(texts)} stories in {elapsed * 1000:.1f} ms ({elapsed / len(texts) * 1e6:.0f} µs/story)")
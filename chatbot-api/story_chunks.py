@@ -0,0 +1,109 @@
+# story_chunks.py
+# Splitting long stories into chunks for map-reduce analysis (see
+# preprocess_data.analyze_stories_chunked), and combining the per-chunk answers.
+# Chunks follow paragraph boundaries; a paragraph longer than a chunk is split between sentences.
+# A per-story token budget caps how much of a very long story is sent to the LLM: chunks are
+# then picked evenly across the story (always including the first and the last) rather than
+# only from the start, which is what plain truncation does.
+
+import re
+
+SENTIMENT_LABELS = ["positive", "negative", "neutral"]
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n|\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text):
+    """Rough token count for English text (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+def _split_long_paragraph(paragraph, max_chars):
+    """Splits one paragraph between sentences (or, for a single huge sentence, hard) into pieces of at most max_chars."""
+    pieces, current = [], ""
+    for sentence in _SENTENCE_END.split(paragraph):
+        while len(sentence) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_into_chunks(text, max_chars=1500):
+    """
+    Splits a story into chunks of at most `max_chars` characters on paragraph boundaries,
+    packing consecutive paragraphs together while they fit.
+
+    Returns:
+        list: Chunk strings in story order (one chunk for a short story, none for an empty one).
+    """
+    paragraphs = []
+    for paragraph in _PARAGRAPH_BREAK.split(text.strip()):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) > max_chars:
+            paragraphs.extend(_split_long_paragraph(paragraph, max_chars))
+        else:
+            paragraphs.append(paragraph)
+
+    chunks, current = [], ""
+    for paragraph in paragraphs:
+        if current and len(current) + 1 + len(paragraph) > max_chars:
+            chunks.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def select_within_budget(chunks, token_budget):
+    """
+    Returns the chunks to analyze when the story is larger than `token_budget` tokens: the
+    first and last chunk plus chunks evenly spaced in between, in story order.
+    A budget of 0 (or less) means no limit. At least one chunk is always kept.
+    """
+    if token_budget <= 0 or sum(estimate_tokens(chunk) for chunk in chunks) <= token_budget:
+        return list(chunks)
+    per_chunk = max(estimate_tokens(chunk) for chunk in chunks)
+    keep = max(1, min(len(chunks), token_budget // per_chunk))
+    if keep == 1:
+        return [chunks[0]]
+    step = (len(chunks) - 1) / (keep - 1)
+    return [chunks[round(i * step)] for i in range(keep)]
+
+
+def weighted_sentiment(chunk_results):
+    """
+    Reduces per-chunk sentiments to one label, each chunk voting with its length in characters.
+    Ties go to the label of the longest chunk among the tied ones.
+
+    Args:
+        chunk_results (list): (chunk_text, sentiment) pairs; sentiments outside
+            SENTIMENT_LABELS (failed chunks) do not vote.
+
+    Returns:
+        str: The winning label, or None if no chunk has a valid sentiment.
+    """
+    weights = {}
+    longest = {}
+    for chunk, sentiment in chunk_results:
+        if sentiment not in SENTIMENT_LABELS:
+            continue
+        weights[sentiment] = weights.get(sentiment, 0) + len(chunk)
+        longest[sentiment] = max(longest.get(sentiment, 0), len(chunk))
+    if not weights:
+        return None
+    return max(weights, key=lambda label: (weights[label], longest[label]))
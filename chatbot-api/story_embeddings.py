@@ -0,0 +1,187 @@
+# story_embeddings.py
+# Vector index for finding survivor stories similar to a chat message or another story.
+# Every story in analyzed_stories.json is embedded once with a local, offline hashed TF-IDF model
+# (no network, no model download) into a NumPy matrix of L2-normalized rows. The matrix is saved as
+# a .npy file and memory-mapped on load, so a top-k cosine-similarity query is a single
+# matrix-vector product. New stories can be appended without re-embedding the existing ones.
+# load_or_build_index() rebuilds the saved index when analyzed_stories.json has changed.
+#
+# Usage:
+#   python story_embeddings.py build                 # embed analyzed_stories.json
+#   python story_embeddings.py add new_stories.jsonl # append stories that are not indexed yet
+#   python story_embeddings.py query "I was trapped in the CBD"
+
+import json
+import os
+import re
+import sys
+import zlib
+
+import numpy as np
+
+from story_search import source_stamp
+from story_stream import PLACEHOLDER_SUMMARIES, iter_stories
+
+# --- Configuration ---
+BASE_DIR = os.path.dirname(__file__)
+ANALYZED_DATA_FILE = os.path.join(BASE_DIR, "analyzed_stories.json")
+EMBEDDINGS_FILE = os.path.join(BASE_DIR, "story_embeddings.npy")
+EMBEDDINGS_META_FILE = os.path.join(BASE_DIR, "story_embeddings.json")
+
+# Number of hashed feature dimensions per embedding.
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "2048"))
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+
+def tokenize(text):
+    """Returns lower-cased word unigrams and bigrams."""
+    words = _TOKEN_RE.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def story_text(story):
+    """Text embedded for a story: its body plus the LLM summary when there is one."""
+    summary = story.get("summary") or ""
+    if summary in PLACEHOLDER_SUMMARIES:
+        summary = ""
+    return f"{story.get('text', '')}\n{summary}"
+
+
+class StoryEmbeddingIndex:
+    """
+    Hashed TF-IDF embeddings of stories with cosine-similarity search.
+
+    The IDF weights are computed when the index is built and then kept fixed, so rows added
+    later are comparable with existing ones; run `build` again to refresh them for a corpus
+    that has changed a lot.
+    """
+
+    def __init__(self, matrix, story_ids, idf, source_stamp=""):
+        self.matrix = matrix
+        self.story_ids = list(story_ids)
+        self.idf = idf
+        self.source_stamp = source_stamp
+        self._positions = {story_id: i for i, story_id in enumerate(self.story_ids)}
+
+    def __len__(self):
+        return len(self.story_ids)
+
+    @staticmethod
+    def hash_counts(text, dim=EMBEDDING_DIM):
+        """Returns the signed hashed term-frequency vector (log-scaled) of a text."""
+        vector = np.zeros(dim, dtype=np.float32)
+        tokens = tokenize(text)
+        if not tokens:
+            return vector
+        hashes = np.fromiter((zlib.crc32(token.encode("utf-8")) for token in tokens),
+                             dtype=np.uint32, count=len(tokens))
+        # The top hash bit picks a sign so colliding features tend to cancel instead of pile up.
+        signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, hashes % dim, signs)
+        return np.sign(vector) * np.log1p(np.abs(vector))
+
+    @classmethod
+    def build(cls, stories, dim=EMBEDDING_DIM, source_stamp=""):
+        """Embeds all stories and derives IDF weights from them."""
+        story_ids, counts = [], []
+        for story in stories:
+            story_ids.append(story["story_id"])
+            counts.append(cls.hash_counts(story_text(story), dim))
+        counts = np.vstack(counts) if counts else np.zeros((0, dim), dtype=np.float32)
+
+        document_frequency = np.count_nonzero(counts, axis=0)
+        idf = np.log((1 + len(story_ids)) / (1 + document_frequency)).astype(np.float32) + 1.0
+        return cls(cls._normalize(counts * idf), story_ids, idf, source_stamp)
+
+    def embed(self, texts):
+        """Returns the normalized embeddings (one row per text) using this index's IDF weights."""
+        counts = np.vstack([self.hash_counts(text, len(self.idf)) for text in texts])
+        return self._normalize(counts * self.idf)
+
+    def search(self, query, k=5):
+        """
+        Returns the k most similar stories to `query` as (story_id, cosine similarity) pairs.
+        """
+        if not len(self):
+            return []
+        scores = self.matrix @ self.embed([query])[0]
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.story_ids[i], float(scores[i])) for i in top]
+
+    def add(self, stories):
+        """
+        Appends stories whose story_id is not indexed yet, without touching existing rows.
+        Returns the number of stories added.
+        """
+        new = [story for story in stories if story["story_id"] not in self._positions]
+        if not new:
+            return 0
+        rows = self.embed([story_text(story) for story in new])
+        self.matrix = np.vstack([np.asarray(self.matrix), rows])
+        for story in new:
+            self._positions[story["story_id"]] = len(self.story_ids)
+            self.story_ids.append(story["story_id"])
+        return len(new)
+
+    def save(self, matrix_path=EMBEDDINGS_FILE, meta_path=EMBEDDINGS_META_FILE):
+        """Writes the matrix (.npy) and the story ids + IDF weights (.json) atomically."""
+        tmp_matrix = matrix_path + ".tmp.npy"
+        np.save(tmp_matrix, np.asarray(self.matrix, dtype=np.float32))
+        tmp_meta = meta_path + ".tmp"
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({"story_ids": self.story_ids, "idf": self.idf.tolist(), "source_stamp": self.source_stamp},
+                      f, ensure_ascii=False)
+        # Release the memory map before replacing the file it points to (required on Windows).
+        self.matrix = np.asarray(self.matrix).copy()
+        os.replace(tmp_matrix, matrix_path)
+        os.replace(tmp_meta, meta_path)
+
+    @classmethod
+    def load(cls, matrix_path=EMBEDDINGS_FILE, meta_path=EMBEDDINGS_META_FILE):
+        """Loads a saved index; the matrix is memory-mapped rather than read into memory."""
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        matrix = np.load(matrix_path, mmap_mode="r")
+        return cls(matrix, meta["story_ids"], np.asarray(meta["idf"], dtype=np.float32), meta.get("source_stamp", ""))
+
+    @staticmethod
+    def _normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (matrix / norms).astype(np.float32)
+
+
+def load_or_build_index(data_file=ANALYZED_DATA_FILE):
+    """Loads the saved index, rebuilding and saving it if it is missing or `data_file` has changed."""
+    stamp = source_stamp(data_file)
+    if os.path.exists(EMBEDDINGS_FILE) and os.path.exists(EMBEDDINGS_META_FILE):
+        index = StoryEmbeddingIndex.load()
+        if index.source_stamp == stamp:
+            return index
+    index = StoryEmbeddingIndex.build(iter_stories(data_file), source_stamp=stamp)
+    index.save()
+    return index
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "build":
+        data_file = sys.argv[2] if len(sys.argv) > 2 else ANALYZED_DATA_FILE
+        index = StoryEmbeddingIndex.build(iter_stories(data_file), source_stamp=source_stamp(data_file))
+        index.save()
+        print(f"Embedded {len(index)} stories ({EMBEDDING_DIM} dims) into {EMBEDDINGS_FILE}")
+    elif command == "add" and len(sys.argv) == 3:
+        index = load_or_build_index()
+        added = index.add(iter_stories(sys.argv[2]))
+        index.save()
+        print(f"Added {added} new stories; index now holds {len(index)}")
+    elif command == "query" and len(sys.argv) >= 3:
+        index = load_or_build_index()
+        for story_id, score in index.search(" ".join(sys.argv[2:])):
+            print(f"{score:.3f}  {story_id}")
+    else:
+        print('Usage: python story_embeddings.py build [stories.json] | add <stories.jsonl> | query "<text>"')
+        sys.exit(1)
@@ -0,0 +1,183 @@
+# story_map_index.py
+# Spatial index for the story map.
+# Instead of shipping every story (with its full text) to the browser, the map asks for the stories
+# inside its current viewport at its current zoom level and gets back pre-aggregated clusters:
+# a centroid, a story count and per-sentiment counts. Clusters are precomputed for every zoom level
+# on a Web-Mercator grid (a few cells per map tile), so a query is two binary searches and a mask
+# over the clusters of one level, and the payload grows with the viewport, not the corpus.
+#
+# Usage:
+#   python story_map_index.py 172.4,-43.7,172.9,-43.4 12    # west,south,east,north zoom
+
+import math
+import os
+import sys
+
+import numpy as np
+
+from story_store import StoryStore
+from story_stream import iter_stories
+
+# --- Configuration ---
+BASE_DIR = os.path.dirname(__file__)
+GEOCODED_DATA_FILE = os.path.join(BASE_DIR, "geocoded_stories.json")
+
+# Highest zoom level with its own clusters; deeper zooms reuse it.
+MAX_CLUSTER_ZOOM = 18
+# Grid cells per map tile side (4 -> clusters roughly 64 px apart on 256 px tiles).
+CELLS_PER_TILE = 4
+
+SENTIMENTS = ("positive", "negative", "neutral")
+
+# Web-Mercator cannot represent the poles.
+_MAX_LATITUDE = 85.05112878
+
+
+def mercator_xy(latitudes, longitudes):
+    """Projects coordinates (degrees) onto the unit Web-Mercator square (x east, y south)."""
+    latitudes = np.radians(np.clip(latitudes, -_MAX_LATITUDE, _MAX_LATITUDE))
+    x = (np.asarray(longitudes, dtype=np.float64) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(latitudes) + 1.0 / np.cos(latitudes)) / math.pi) / 2.0
+    return np.clip(x, 0.0, 1.0 - 1e-12), np.clip(y, 0.0, 1.0 - 1e-12)
+
+
+class ClusterLevel:
+    """Clusters of one zoom level, sorted by (cell x, cell y)."""
+
+    def __init__(self, cells_per_side, cell_x, cell_y, counts, latitudes, longitudes, sentiment_counts, story_ids):
+        self.cells_per_side = cells_per_side
+        self.cell_x = cell_x
+        self.cell_y = cell_y
+        self.counts = counts
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.sentiment_counts = sentiment_counts
+        # story_id of single-story clusters (None for larger clusters).
+        self.story_ids = story_ids
+
+
+class StoryMapIndex:
+    """
+    Precomputed cluster pyramid over the geocoded stories.
+    """
+
+    def __init__(self, story_ids, latitudes, longitudes, sentiments):
+        """
+        Args:
+            story_ids (list): One id per geocoded story.
+            latitudes, longitudes (array-like): Story coordinates in degrees.
+            sentiments (list): Sentiment label of each story.
+        """
+        self.size = len(story_ids)
+        story_ids = np.array(story_ids, dtype=object)
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        sentiment_codes = np.array([SENTIMENTS.index(s) if s in SENTIMENTS else len(SENTIMENTS) for s in sentiments],
+                                   dtype=np.int64)
+        x, y = mercator_xy(latitudes, longitudes)
+
+        self.levels = []
+        for zoom in range(MAX_CLUSTER_ZOOM + 1):
+            side = (1 << zoom) * CELLS_PER_TILE
+            keys = np.floor(x * side).astype(np.int64) * side + np.floor(y * side).astype(np.int64)
+            cells, cluster_of, counts = np.unique(keys, return_inverse=True, return_counts=True)
+            n = len(cells)
+
+            sentiment_counts = np.zeros((n, len(SENTIMENTS) + 1), dtype=np.int64)
+            np.add.at(sentiment_counts, (cluster_of, sentiment_codes), 1)
+            cluster_ids = np.full(n, None, dtype=object)
+            singles = counts[cluster_of] == 1
+            cluster_ids[cluster_of[singles]] = story_ids[singles]
+
+            self.levels.append(ClusterLevel(
+                side, cells // side, cells % side, counts,
+                np.bincount(cluster_of, latitudes, n) / counts,
+                np.bincount(cluster_of, longitudes, n) / counts,
+                sentiment_counts[:, :len(SENTIMENTS)], cluster_ids,
+            ))
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def from_stories(cls, stories):
+        """Builds the index from story records; stories without coordinates are skipped."""
+        story_ids, latitudes, longitudes, sentiments = [], [], [], []
+        for story in stories:
+            coordinates = (story.get("location") or {}).get("coordinates")
+            if not coordinates:
+                continue
+            story_ids.append(story["story_id"])
+            latitudes.append(coordinates["latitude"])
+            longitudes.append(coordinates["longitude"])
+            sentiments.append(story.get("sentiment"))
+        return cls(story_ids, latitudes, longitudes, sentiments)
+
+    @classmethod
+    def from_store(cls, store):
+        """Builds the index from the coordinate and sentiment columns of a StoryStore."""
+        located = np.flatnonzero(~np.isnan(store.latitude))
+        return cls([store.story_id(i) for i in located], store.latitude[located], store.longitude[located],
+                   [store.sentiment(i) for i in located])
+
+    def clusters(self, west, south, east, north, zoom):
+        """
+        Returns the clusters whose cell intersects the bounding box at the given zoom.
+
+        Args:
+            west, south, east, north (float): Viewport bounds in degrees.
+            zoom (int): Map zoom level; levels above MAX_CLUSTER_ZOOM use the deepest clusters.
+
+        Returns:
+            list: Dicts with latitude/longitude (cluster centroid), count and sentiments
+            ({label: count}); single-story clusters also carry their story_id.
+        """
+        if west > east:
+            # The viewport crosses the antimeridian: query both sides.
+            return self.clusters(west, south, 180.0, north, zoom) + self.clusters(-180.0, south, east, north, zoom)
+
+        level = self.levels[max(0, min(int(zoom), MAX_CLUSTER_ZOOM))]
+        side = level.cells_per_side
+        (x_min, x_max), (y_max, y_min) = (np.floor(v * side).astype(np.int64)
+                                          for v in mercator_xy([south, north], [west, east]))
+
+        # Clusters are sorted by cell x, so the x range is a contiguous slice.
+        start = np.searchsorted(level.cell_x, x_min, side="left")
+        end = np.searchsorted(level.cell_x, x_max, side="right")
+        cell_y = level.cell_y[start:end]
+        positions = start + np.flatnonzero((cell_y >= y_min) & (cell_y <= y_max))
+
+        results = []
+        for p in positions:
+            cluster = {
+                "latitude": float(level.latitudes[p]),
+                "longitude": float(level.longitudes[p]),
+                "count": int(level.counts[p]),
+                "sentiments": dict(zip(SENTIMENTS, level.sentiment_counts[p].tolist())),
+            }
+            if level.story_ids[p] is not None:
+                cluster["story_id"] = level.story_ids[p]
+            results.append(cluster)
+        return results
+
+
+def load_story_map_index(path=GEOCODED_DATA_FILE):
+    """
+    Builds the index from a geocoded stories file (.json or .jsonl), reading only the columns it
+    needs from the columnar store next to it (see story_store.py) when that store is up to date.
+    """
+    store_path = os.path.splitext(path)[0] + ".store"
+    meta_path = os.path.join(store_path, "meta.json")
+    if os.path.exists(meta_path) and os.path.getmtime(meta_path) >= os.path.getmtime(path):
+        return StoryMapIndex.from_store(StoryStore(store_path))
+    return StoryMapIndex.from_stories(iter_stories(path))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python story_map_index.py <west,south,east,north> <zoom>")
+        sys.exit(1)
+    index = load_story_map_index()
+    west, south, east, north = (float(v) for v in sys.argv[1].split(","))
+    for cluster in index.clusters(west, south, east, north, int(sys.argv[2])):
+        print(cluster)
@@ -0,0 +1,124 @@
+# story_metadata.py
+# Story file names carry the story's metadata:
+#   "[2014-06-10] 695 [Bexley Christchurch Canterbury New Zealand] Sarah.txt"
+#    date         id   location                                    author
+# preprocess_data.py parses every name once with parse_story_id() and stores the result in the
+# record as `date` ("YYYY-MM-DD"), `story_number` (int), `location_name` and `author`, so later
+# stages read the fields instead of matching the file name again. story_metadata() does the same
+# for records written before these fields existed.
+# StoryDateIndex keeps the story positions sorted by date, so a date range is two binary searches
+# instead of a scan over every story.
+#
+# Usage:
+#   python story_metadata.py 2011-02-22 [2011-03-01] [analyzed_stories.json]   # stories in a date range
+
+import datetime
+import os
+import re
+import sys
+
+import numpy as np
+
+from story_stream import iter_stories
+
+# --- Configuration ---
+BASE_DIR = os.path.dirname(__file__)
+ANALYZED_DATA_FILE = os.path.join(BASE_DIR, "analyzed_stories.json")
+
+METADATA_FIELDS = ("date", "story_number", "location_name", "author")
+
+# Every part is optional, so a name with only a date or only a location still yields those.
+_STORY_ID_RE = re.compile(
+    r"^\s*(?:\[(?P<date>\d{4}-\d{2}-\d{2})\])?\s*(?P<number>\d+)?\s*"
+    r"(?:\[(?P<location>[^\]]*)\])?\s*(?P<author>.*?)\s*(?:\.txt)?\s*$",
+    re.IGNORECASE,
+)
+
+
+def parse_story_id(story_id):
+    """
+    Splits a story file name into its metadata fields.
+
+    Returns:
+        dict: date ("YYYY-MM-DD", None unless it is a valid calendar date), story_number (int or
+        None), location_name and author (stripped strings, None when empty).
+    """
+    match = _STORY_ID_RE.match(story_id or "")
+    if not match:
+        return dict.fromkeys(METADATA_FIELDS)
+    date = match.group("date")
+    try:
+        date = datetime.date.fromisoformat(date).isoformat() if date else None
+    except ValueError:
+        date = None
+    number = match.group("number")
+    return {
+        "date": date,
+        "story_number": int(number) if number else None,
+        "location_name": (match.group("location") or "").strip() or None,
+        "author": match.group("author") or None,
+    }
+
+
+def story_metadata(story):
+    """Returns the metadata fields of a record, parsing the story_id only if they were not stored."""
+    if all(field in story for field in METADATA_FIELDS):
+        return {field: story[field] for field in METADATA_FIELDS}
+    return parse_story_id(story.get("story_id"))
+
+
+def date_array(dates):
+    """Converts "YYYY-MM-DD" strings (or None) to a datetime64[D] array with NaT for missing dates."""
+    return np.array([date or "NaT" for date in dates], dtype="datetime64[D]")
+
+
+class StoryDateIndex:
+    """
+    Story positions sorted by date. NaT (undated stories) sorts last and never matches a range.
+    """
+
+    def __init__(self, dates, order=None):
+        """
+        Args:
+            dates (np.ndarray): datetime64[D] date of each story, in story order.
+            order (np.ndarray): Optional precomputed stable argsort of `dates` (see StoryStore).
+        """
+        self.dates = dates
+        self.order = np.argsort(dates, kind="stable") if order is None else order
+        self.sorted_dates = dates[self.order]
+
+    @classmethod
+    def from_stories(cls, stories):
+        return cls(date_array(story_metadata(story)["date"] for story in stories))
+
+    def __len__(self):
+        return len(self.order)
+
+    def between(self, date_from=None, date_to=None):
+        """
+        Returns the positions of the stories dated within the inclusive bounds, oldest first.
+        A missing bound is open; undated stories are only excluded, never returned.
+        """
+        start = 0
+        end = int(np.searchsorted(self.sorted_dates, np.datetime64("NaT"), side="left"))
+        if date_from:
+            start = int(np.searchsorted(self.sorted_dates[:end], np.datetime64(date_from, "D"), side="left"))
+        if date_to:
+            end = int(np.searchsorted(self.sorted_dates[:end], np.datetime64(date_to, "D"), side="right"))
+        return self.order[start:max(start, end)]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python story_metadata.py <date_from> [date_to] [analyzed_stories.json]")
+        sys.exit(1)
+    date_from = sys.argv[1]
+    # Without an end date, the week starting at date_from.
+    date_to = sys.argv[2] if len(sys.argv) > 2 else str(np.datetime64(date_from, "D") + 6)
+    stories = list(iter_stories(sys.argv[3] if len(sys.argv) > 3 else ANALYZED_DATA_FILE))
+    index = StoryDateIndex.from_stories(stories)
+    positions = index.between(date_from, date_to)
+    for position in positions:
+        metadata = story_metadata(stories[position])
+        print(f"{metadata['date']}  #{metadata['story_number']}  {metadata['location_name']}  ({metadata['author']})")
+    print(f"{len(positions)} of {len(index)} stories between {date_from} and {date_to}")
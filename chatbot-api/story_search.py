@@ -0,0 +1,248 @@
+# story_search.py
+# Full-text search over the analyzed stories.
+# An inverted index is built once from the `text` and `summary` of every story in
+# analyzed_stories.json: each term points at a slice of two compact NumPy postings arrays
+# (story positions and term frequencies), and queries are ranked with BM25. Filters on sentiment,
+# method, location name and story date are applied before scoring, so only matching stories are
+# ever scored; date ranges are looked up in a date-sorted index (see story_metadata.py). The index
+# is saved next to the data and rebuilt only when the data file changes.
+#
+# Usage:
+#   python story_search.py build
+#   python story_search.py "silt driveway" [--sentiment positive] [--location bexley] [--from 2012-01-01]
+
+import argparse
+import os
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+
+from geocode_cache import normalize_location
+from story_metadata import StoryDateIndex, story_metadata
+from story_stream import PLACEHOLDER_SUMMARIES, iter_stories
+
+# --- Configuration ---
+BASE_DIR = os.path.dirname(__file__)
+ANALYZED_DATA_FILE = os.path.join(BASE_DIR, "analyzed_stories.json")
+SEARCH_INDEX_FILE = os.path.join(BASE_DIR, "story_search_index.npz")
+
+# BM25 parameters.
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from had has have he her his i in is it its me my of on or our "
+    "she so that the their them there they this to was we were what when which who with you".split()
+)
+
+
+def tokenize(text):
+    """Returns the lower-cased word tokens of `text`, without stopwords."""
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+class StorySearchIndex:
+    """
+    BM25 inverted index with per-story filter columns.
+
+    Postings for term t are doc_ids[offsets[t]:offsets[t + 1]] (story positions) with the
+    matching term frequencies in term_freqs.
+    """
+
+    def __init__(self, terms, offsets, doc_ids, term_freqs, doc_lengths, story_ids,
+                 sentiments, methods, locations, dates, source_stamp=""):
+        self.terms = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.story_ids = story_ids
+        self.sentiments = sentiments
+        self.methods = methods
+        self.locations = locations
+        self.dates = dates
+        self.date_index = StoryDateIndex(dates)
+        self.source_stamp = source_stamp
+
+        self.average_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        document_frequency = np.diff(offsets)
+        self.idf = np.log1p((len(story_ids) - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def __len__(self):
+        return len(self.story_ids)
+
+    @classmethod
+    def build(cls, stories, source_stamp=""):
+        """Tokenizes every story and lays the postings out as contiguous arrays."""
+        postings = {}
+        doc_lengths, story_ids, sentiments, methods, locations, dates = [], [], [], [], [], []
+        for position, story in enumerate(stories):
+            summary = story.get("summary") or ""
+            if summary in PLACEHOLDER_SUMMARIES:
+                summary = ""
+            tokens = tokenize(f"{story.get('text', '')} {summary}")
+            for term, count in Counter(tokens).items():
+                postings.setdefault(term, []).append((position, count))
+            doc_lengths.append(len(tokens))
+
+            metadata = story_metadata(story)
+            story_ids.append(story["story_id"])
+            sentiments.append(story.get("sentiment", ""))
+            methods.append(story.get("method", ""))
+            locations.append(normalize_location(metadata["location_name"] or ""))
+            dates.append(metadata["date"] or "NaT")
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+        doc_ids = np.empty(offsets[-1], dtype=np.int32)
+        term_freqs = np.empty(offsets[-1], dtype=np.float32)
+        for i, term in enumerate(terms):
+            entries = np.array(postings[term])
+            doc_ids[offsets[i]:offsets[i + 1]] = entries[:, 0]
+            term_freqs[offsets[i]:offsets[i + 1]] = entries[:, 1]
+
+        return cls(terms, offsets, doc_ids, term_freqs, np.array(doc_lengths, dtype=np.float32),
+                   np.array(story_ids, dtype=str), np.array(sentiments, dtype=str),
+                   np.array(methods, dtype=str), np.array(locations, dtype=str),
+                   np.array(dates, dtype="datetime64[D]"), source_stamp)
+
+    def search(self, query="", k=10, sentiment=None, method=None, location=None, date_from=None, date_to=None):
+        """
+        Returns up to k stories matching the query and filters, best first, as dicts with the
+        story_id, BM25 score, sentiment, method, location and date. With an empty query, the
+        stories passing the filters are returned oldest first with a score of 0.
+
+        Args:
+            query (str): Free-text query.
+            k (int): Maximum number of results.
+            sentiment, method (str): Exact filters on the story's labels.
+            location (str): Matches stories whose location name contains it (case-insensitive).
+            date_from, date_to (str): Inclusive "YYYY-MM-DD" bounds on the date in the story_id.
+        """
+        allowed = self.filter_mask(sentiment, method, location, date_from, date_to)
+        query_terms = [self.terms[term] for term in set(tokenize(query)) if term in self.terms]
+        if not query.strip():
+            by_date = self.date_index.order
+            positions = by_date[allowed[by_date]][:k]
+            return [self._result(p, 0.0) for p in positions]
+
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term in query_terms:
+            docs = self.doc_ids[self.offsets[term]:self.offsets[term + 1]]
+            freqs = self.term_freqs[self.offsets[term]:self.offsets[term + 1]]
+            keep = allowed[docs]
+            docs, freqs = docs[keep], freqs[keep]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[docs] / self.average_length)
+            scores[docs] += self.idf[term] * freqs * (BM25_K1 + 1) / (freqs + norm)
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [self._result(p, float(scores[p])) for p in matched]
+
+    def _result(self, position, score):
+        date = self.dates[position]
+        return {
+            "story_id": str(self.story_ids[position]),
+            "score": score,
+            "sentiment": str(self.sentiments[position]),
+            "method": str(self.methods[position]),
+            "location": str(self.locations[position]),
+            "date": None if np.isnat(date) else str(date),
+        }
+
+    def filter_mask(self, sentiment=None, method=None, location=None, date_from=None, date_to=None):
+        """Returns a boolean array marking the stories that pass all given filters."""
+        mask = np.ones(len(self), dtype=bool)
+        if sentiment:
+            mask &= self.sentiments == sentiment.lower()
+        if method:
+            mask &= self.methods == method.lower()
+        if location:
+            mask &= np.char.find(self.locations, normalize_location(location)) >= 0
+        if date_from or date_to:
+            in_range = np.zeros(len(self), dtype=bool)
+            in_range[self.date_index.between(date_from, date_to)] = True
+            mask &= in_range
+        return mask
+
+    def save(self, path=SEARCH_INDEX_FILE):
+        """Writes the index as a single uncompressed .npz file."""
+        terms = np.array(sorted(self.terms, key=self.terms.get))
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, terms=terms, offsets=self.offsets, doc_ids=self.doc_ids,
+                 term_freqs=self.term_freqs, doc_lengths=self.doc_lengths, story_ids=self.story_ids,
+                 sentiments=self.sentiments, methods=self.methods, locations=self.locations,
+                 dates=self.dates, source_stamp=np.array(self.source_stamp))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=SEARCH_INDEX_FILE):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["terms"].tolist(), data["offsets"], data["doc_ids"], data["term_freqs"],
+                       data["doc_lengths"], data["story_ids"], data["sentiments"], data["methods"],
+                       data["locations"], data["dates"], str(data["source_stamp"]))
+
+
+def source_stamp(data_file):
+    """Identifies a version of the data file (size + modification time)."""
+    stat = os.stat(data_file)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def load_or_build_index(data_file=ANALYZED_DATA_FILE, index_file=SEARCH_INDEX_FILE):
+    """Loads the saved index, rebuilding and saving it if it is missing or `data_file` has changed."""
+    stamp = source_stamp(data_file)
+    if os.path.exists(index_file):
+        index = StorySearchIndex.load(index_file)
+        if index.source_stamp == stamp:
+            return index
+    index = StorySearchIndex.build(iter_stories(data_file), stamp)
+    index.save(index_file)
+    return index
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_default_index():
+    """
+    Returns the process-wide index for analyzed_stories.json, loading it on first use and again
+    whenever the data file has changed.
+    """
+    global _default_index
+    stamp = source_stamp(ANALYZED_DATA_FILE)
+    if _default_index is None or _default_index.source_stamp != stamp:
+        with _default_index_lock:
+            if _default_index is None or _default_index.source_stamp != stamp:
+                _default_index = load_or_build_index()
+    return _default_index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the analyzed stories.")
+    parser.add_argument("query", help='Search text, or "build" to (re)build the index.')
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--sentiment")
+    parser.add_argument("--method")
+    parser.add_argument("--location")
+    parser.add_argument("--from", dest="date_from")
+    parser.add_argument("--to", dest="date_to")
+    args = parser.parse_args()
+
+    if args.query == "build":
+        index = StorySearchIndex.build(iter_stories(ANALYZED_DATA_FILE), source_stamp(ANALYZED_DATA_FILE))
+        index.save()
+        print(f"Indexed {len(index)} stories ({len(index.terms)} terms) into {SEARCH_INDEX_FILE}")
+    else:
+        index = load_or_build_index()
+        for result in index.search(args.query, args.k, args.sentiment, args.method,
+                                   args.location, args.date_from, args.date_to):
+            print(f"{result['score']:7.3f}  {result['sentiment']:<8}  {result['story_id']}")
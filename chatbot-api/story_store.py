@@ -0,0 +1,299 @@
+# story_store.py
+# Compact columnar store of the geocoded stories for serving.
+# geocoded_stories.json holds every story body, so anything that only needs ids, sentiments or
+# coordinates still has to parse ~1.4 MB of text on startup. The store keeps each field in its own
+# file inside a directory (geocoded_stories.store/ by default):
+#   latitude.npy, longitude.npy      float64 (NaN when the story has no coordinates)
+#   sentiment.npy, method.npy        uint8 codes into the label tables in meta.json
+#   date.npy, date_order.npy         datetime64[D] story date (NaT when unknown) and the story
+#                                    positions sorted by date, for range queries (between_dates)
+#   story_number.npy                 int32 number from the story_id (-1 when unknown)
+#   <field>.bin + <field>.offsets.npy UTF-8 blob of story_id / location / author / summary / text
+#                                    values, value i is blob[offsets[i]:offsets[i + 1]]
+# Columns are memory-mapped on first use, so opening the store costs one small JSON read and a
+# server only pages in the columns (and the individual story texts) it actually touches.
+# Stores written before the date / story_number / author columns existed still open: those values
+# are then parsed from the story ids on first use.
+#
+# Usage:
+#   python story_store.py geocoded_stories.json [geocoded_stories.store]   # convert an existing file
+#   python story_store.py info [geocoded_stories.store]
+#   python story_store.py between 2011-09-01 2011-09-30 [geocoded_stories.store]
+
+import json
+import mmap
+import os
+import shutil
+import sys
+
+import numpy as np
+
+from story_metadata import StoryDateIndex, date_array, parse_story_id, story_metadata
+from story_stream import iter_stories
+
+# --- Configuration ---
+BASE_DIR = os.path.dirname(__file__)
+DEFAULT_STORE_DIR = os.path.join(BASE_DIR, "geocoded_stories.store")
+
+SENTIMENT_LABELS = ["positive", "negative", "neutral"]
+METHOD_LABELS = ["manual", "lmstudio", "failed", "local"]
+TEXT_FIELDS = ["story_id", "location", "author", "summary", "text"]
+
+_MISSING_CODE = 255
+_MISSING_NUMBER = -1
+
+
+def _encode_label(labels, value):
+    """Returns the code of `value`, adding it to `labels` when it is new (None -> 255)."""
+    if value is None:
+        return _MISSING_CODE
+    if value not in labels:
+        labels.append(value)
+    return labels.index(value)
+
+
+class StoryStoreWriter:
+    """
+    Writes a store one story at a time, so it can sit in a streaming pipeline (see tee()).
+    Everything goes to a temporary directory that replaces `directory` on close().
+    """
+
+    def __init__(self, directory=DEFAULT_STORE_DIR):
+        self.directory = directory
+        self._tmp_dir = directory + ".tmp"
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        os.makedirs(self._tmp_dir)
+
+        self.sentiment_labels = list(SENTIMENT_LABELS)
+        self.method_labels = list(METHOD_LABELS)
+        self._columns = {"latitude": [], "longitude": [], "sentiment": [], "method": [], "date": [],
+                         "story_number": []}
+        self._blobs = {field: open(os.path.join(self._tmp_dir, f"{field}.bin"), "wb") for field in TEXT_FIELDS}
+        self._offsets = {field: [0] for field in TEXT_FIELDS}
+
+    def add(self, story):
+        location = story.get("location") or {}
+        coordinates = location.get("coordinates") or {}
+        self._columns["latitude"].append(coordinates.get("latitude", np.nan))
+        self._columns["longitude"].append(coordinates.get("longitude", np.nan))
+        self._columns["sentiment"].append(_encode_label(self.sentiment_labels, story.get("sentiment")))
+        self._columns["method"].append(_encode_label(self.method_labels, story.get("method")))
+        metadata = story_metadata(story)
+        self._columns["date"].append(metadata["date"])
+        number = metadata["story_number"]
+        self._columns["story_number"].append(_MISSING_NUMBER if number is None else number)
+
+        values = {"story_id": story.get("story_id"), "location": location.get("name"),
+                  "author": metadata["author"], "summary": story.get("summary"), "text": story.get("text")}
+        for field, value in values.items():
+            data = (value or "").encode("utf-8")
+            self._blobs[field].write(data)
+            self._offsets[field].append(self._offsets[field][-1] + len(data))
+
+    def tee(self, stories):
+        """Adds each story to the store while passing it on unchanged."""
+        for story in stories:
+            self.add(story)
+            yield story
+
+    def close(self):
+        """Writes the column arrays and metadata and moves the store into place."""
+        for blob in self._blobs.values():
+            blob.close()
+        for field, offsets in self._offsets.items():
+            np.save(os.path.join(self._tmp_dir, f"{field}.offsets.npy"), np.array(offsets, dtype=np.int64))
+        for name in ("latitude", "longitude"):
+            np.save(os.path.join(self._tmp_dir, f"{name}.npy"), np.array(self._columns[name], dtype=np.float64))
+        for name in ("sentiment", "method"):
+            np.save(os.path.join(self._tmp_dir, f"{name}.npy"), np.array(self._columns[name], dtype=np.uint8))
+        np.save(os.path.join(self._tmp_dir, "story_number.npy"), np.array(self._columns["story_number"], dtype=np.int32))
+        dates = date_array(self._columns["date"])
+        np.save(os.path.join(self._tmp_dir, "date.npy"), dates)
+        np.save(os.path.join(self._tmp_dir, "date_order.npy"), StoryDateIndex(dates).order)
+
+        meta = {"count": len(self._columns["sentiment"]), "sentiment_labels": self.sentiment_labels,
+                "method_labels": self.method_labels}
+        with open(os.path.join(self._tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.replace(self._tmp_dir, self.directory)
+        return meta["count"]
+
+
+def write_story_store(stories, directory=DEFAULT_STORE_DIR):
+    """Writes all stories to a store. Returns the number of stories written."""
+    writer = StoryStoreWriter(directory)
+    for story in stories:
+        writer.add(story)
+    return writer.close()
+
+
+class StoryStore:
+    """
+    Read-only access to a store written by StoryStoreWriter.
+
+    Numeric columns are memory-mapped NumPy arrays (store.latitude, store.sentiment_codes, ...);
+    string values are decoded one at a time (store.text(i), store.record(i)).
+    """
+
+    def __init__(self, directory=DEFAULT_STORE_DIR):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.count = meta["count"]
+        self.sentiment_labels = meta["sentiment_labels"]
+        self.method_labels = meta["method_labels"]
+        self._arrays = {}
+        self._blobs = {}
+        self._story_positions = None
+        self._date_index = None
+        self._parsed_metadata = None
+
+    def __len__(self):
+        return self.count
+
+    def _array(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode="r")
+        return self._arrays[name]
+
+    @property
+    def latitude(self):
+        return self._array("latitude")
+
+    @property
+    def longitude(self):
+        return self._array("longitude")
+
+    @property
+    def sentiment_codes(self):
+        return self._array("sentiment")
+
+    @property
+    def method_codes(self):
+        return self._array("method")
+
+    def _has_file(self, name):
+        return os.path.exists(os.path.join(self.directory, name))
+
+    def _metadata_from_ids(self):
+        """Metadata parsed from the story ids, for a store written without the metadata columns."""
+        if self._parsed_metadata is None:
+            self._parsed_metadata = [parse_story_id(self.story_id(i)) for i in range(self.count)]
+        return self._parsed_metadata
+
+    @property
+    def date(self):
+        if "date" not in self._arrays and not self._has_file("date.npy"):
+            self._arrays["date"] = date_array(metadata["date"] for metadata in self._metadata_from_ids())
+        return self._array("date")
+
+    @property
+    def story_numbers(self):
+        if "story_number" not in self._arrays and not self._has_file("story_number.npy"):
+            self._arrays["story_number"] = np.array(
+                [_MISSING_NUMBER if metadata["story_number"] is None else metadata["story_number"]
+                 for metadata in self._metadata_from_ids()], dtype=np.int32)
+        return self._array("story_number")
+
+    def sentiment(self, index):
+        code = int(self.sentiment_codes[index])
+        return None if code == _MISSING_CODE else self.sentiment_labels[code]
+
+    def method(self, index):
+        code = int(self.method_codes[index])
+        return None if code == _MISSING_CODE else self.method_labels[code]
+
+    def _string(self, field, index):
+        if field not in self._blobs:
+            path = os.path.join(self.directory, f"{field}.bin")
+            with open(path, "rb") as f:
+                # mmap cannot map an empty file.
+                self._blobs[field] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b""
+        offsets = self._array(f"{field}.offsets")
+        if not 0 <= index < self.count:
+            raise IndexError(f"story index {index} out of range")
+        return self._blobs[field][offsets[index]:offsets[index + 1]].decode("utf-8")
+
+    def story_id(self, index):
+        return self._string("story_id", index)
+
+    def location_name(self, index):
+        return self._string("location", index) or None
+
+    def author(self, index):
+        if not self._has_file("author.bin"):
+            return self._metadata_from_ids()[index]["author"]
+        return self._string("author", index) or None
+
+    def story_date(self, index):
+        date = self.date[index]
+        return None if np.isnat(date) else str(date)
+
+    def story_number(self, index):
+        number = int(self.story_numbers[index])
+        return None if number == _MISSING_NUMBER else number
+
+    def between_dates(self, date_from=None, date_to=None):
+        """
+        Returns the positions of the stories dated within the inclusive "YYYY-MM-DD" bounds,
+        oldest first, using the stored date order (no scan over the stories).
+        """
+        if self._date_index is None:
+            order = self._array("date_order") if self._has_file("date_order.npy") else None
+            self._date_index = StoryDateIndex(self.date, order)
+        return self._date_index.between(date_from, date_to)
+
+    def summary(self, index):
+        return self._string("summary", index)
+
+    def text(self, index):
+        """Returns the full story text, read from the blob only when asked for."""
+        return self._string("text", index)
+
+    def index_of(self, story_id):
+        """Returns the position of `story_id`, or None. Builds the id lookup table on first use."""
+        if self._story_positions is None:
+            self._story_positions = {self.story_id(i): i for i in range(self.count)}
+        return self._story_positions.get(story_id)
+
+    def record(self, index, include_text=True):
+        """Rebuilds the geocoded_stories.json record of one story."""
+        latitude, longitude = float(self.latitude[index]), float(self.longitude[index])
+        coordinates = None if np.isnan(latitude) else {"latitude": latitude, "longitude": longitude}
+        story = {"story_id": self.story_id(index)}
+        if include_text:
+            story["text"] = self.text(index)
+        story.update({
+            "sentiment": self.sentiment(index),
+            "summary": self.summary(index),
+            "method": self.method(index),
+            "location": {"name": self.location_name(index), "coordinates": coordinates},
+            "date": self.story_date(index),
+            "story_number": self.story_number(index),
+            "location_name": self.location_name(index),
+            "author": self.author(index),
+        })
+        return story
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "info":
+        store = StoryStore(sys.argv[2] if len(sys.argv) > 2 else DEFAULT_STORE_DIR)
+        located = int(np.count_nonzero(~np.isnan(store.latitude)))
+        print(f"{len(store)} stories ({located} with coordinates) in {store.directory}")
+    elif len(sys.argv) in (3, 4, 5) and sys.argv[1] == "between":
+        store = StoryStore(sys.argv[4] if len(sys.argv) > 4 else DEFAULT_STORE_DIR)
+        positions = store.between_dates(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+        for position in positions:
+            print(f"{store.story_date(position)}  {store.story_id(position)}")
+        print(f"{len(positions)} of {len(store)} stories")
+    elif len(sys.argv) in (2, 3):
+        directory = sys.argv[2] if len(sys.argv) == 3 else DEFAULT_STORE_DIR
+        count = write_story_store(iter_stories(sys.argv[1]), directory)
+        print(f"Wrote {count} stories to {directory}")
+    else:
+        print("Usage: python story_store.py <geocoded_stories.json> [store_dir] | info [store_dir] | "
+              "between <date_from> [date_to] [store_dir]")
+        sys.exit(1)
@@ -0,0 +1,138 @@
+# story_stream.py
+# Streaming readers and writers for story records, shared by the pipeline scripts.
+# Records are read and written one at a time so memory stays constant regardless of corpus size.
+#
+# Supported formats (picked from the path):
+#   *.jsonl / "-"  -> one JSON object per line (stdin/stdout for "-"), the streaming format
+#   *.json         -> a JSON array, kept as an export for server.js and the frontend
+#
+# Usage as a converter:
+#   python story_stream.py analyzed_stories.json analyzed_stories.jsonl
+#   python story_stream.py geocoded_stories.jsonl geocoded_stories.json
+
+import json
+import sys
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# Placeholder summaries of manually and locally (sentiment_classifier.py) labelled stories: those
+# get no LLM summary. Consumers that index or show summaries skip them.
+MANUAL_SUMMARY = "Manual analysis does not generate a summary."
+LOCAL_SUMMARY = "Local classification does not generate a summary."
+PLACEHOLDER_SUMMARIES = frozenset({MANUAL_SUMMARY, LOCAL_SUMMARY})
+# Summaries preprocess_data.py records when the LLM could not analyze a story; their sentiment is
+# a "neutral" default, not a label.
+FAILED_SUMMARIES = frozenset({"API Error", "Parse Error", "Unknown Error"})
+
+
+def _iter_json_array(f):
+    """Yields the elements of a top-level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    started = False
+    eof = False
+
+    while True:
+        # Skip whitespace and the array punctuation between elements.
+        while pos < len(buffer) and (buffer[pos] in " \t\r\n," or (not started and buffer[pos] == "[")):
+            if buffer[pos] == "[":
+                started = True
+            pos += 1
+        if started and pos < len(buffer) and buffer[pos] == "]":
+            return
+
+        if pos < len(buffer):
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # A value is only complete once the delimiter after it has been read
+                # (e.g. "2" could still become "2.5" with the next chunk).
+                if eof or (end < len(buffer) and buffer[end] in ",] \t\r\n"):
+                    yield record
+                    pos = end
+                    continue
+
+        if eof:
+            return
+        chunk = f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            eof = True
+        # Drop everything already consumed before appending the next chunk.
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+
+def iter_stories(path):
+    """
+    Yields story records one at a time from a JSON array file, a JSONL file, or stdin ("-").
+
+    Args:
+        path (str): Input path. "-" reads JSONL from standard input.
+    """
+    if path == "-":
+        for line in sys.stdin:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            yield from _iter_json_array(f)
+
+
+def write_stories(path, records):
+    """
+    Writes story records as they are produced.
+
+    JSON array output uses the same 4-space indented layout as the original json.dump calls,
+    so existing consumers of the .json files see no difference.
+
+    Args:
+        path (str): Output path. "-" writes JSONL to standard output.
+        records (iterable): Story dicts (a generator is consumed lazily).
+
+    Returns:
+        int: Number of records written.
+    """
+    if path == "-":
+        return _write_jsonl(sys.stdout, records)
+
+    with open(path, "w", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return _write_jsonl(f, records)
+
+        count = 0
+        f.write("[")
+        for record in records:
+            f.write(",\n    " if count else "\n    ")
+            f.write(json.dumps(record, indent=4, ensure_ascii=False).replace("\n", "\n    "))
+            count += 1
+        f.write("\n]" if count else "]")
+        return count
+
+
+def _write_jsonl(f, records):
+    count = 0
+    for record in records:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        count += 1
+    f.flush()
+    return count
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python story_stream.py <input .json|.jsonl|-> <output .json|.jsonl|->", file=sys.stderr)
+        sys.exit(1)
+    written = write_stories(sys.argv[2], iter_stories(sys.argv[1]))
+    print(f"Converted {written} stories: {sys.argv[1]} -> {sys.argv[2]}", file=sys.stderr)
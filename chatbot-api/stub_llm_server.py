@@ -0,0 +1,171 @@
+# stub_llm_server.py
+# This script runs a tiny OpenAI-compatible chat completions server that simulates LLM latency.
+# It lets the preprocessing pipeline be exercised (and timed) without LM Studio running:
+#
+#   python stub_llm_server.py --port 1235 --latency 0.5
+#   LM_STUDIO_API=http://127.0.0.1:1235/v1/chat/completions python preprocess_data.py
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Configuration ---
+DEFAULT_PORT = 1235
+STUB_RESPONSE = {"sentiment": "neutral", "summary": "A survivor describes their experience of the earthquake."}
+# Marker used by preprocess_data.analyze_sentiment_batch_lmstudio before the packed stories.
+BATCH_MARKER = "Stories to analyze:"
+# Marker before the story in preprocess_data.analyze_sentiment_lmstudio prompts.
+STORY_MARKER = "\nText:"
+
+# A tiny lexicon so the stub's sentiment follows the story (and accuracy comparisons between
+# analysis modes mean something); stories without any of these words are "neutral".
+NEGATIVE_WORDS = {"lost", "terrified", "shook", "damage", "destroyed", "collapsed", "trapped",
+                  "injured", "died", "fear", "scared", "liquefaction", "stickered", "aftershocks", "sleep"}
+POSITIVE_WORDS = {"relieved", "helped", "help", "grateful", "thankful", "volunteers", "laughter", "kindness",
+                  "closer", "safe", "generator", "shared", "strangers", "hope"}
+
+
+def classify(text):
+    """Keyword-vote sentiment of `text`."""
+    words = re.findall(r"[a-z]+", text.lower())
+    score = sum(word in POSITIVE_WORDS for word in words) - sum(word in NEGATIVE_WORDS for word in words)
+    return "positive" if score > 0 else "negative" if score < 0 else "neutral"
+
+
+def build_reply(prompt):
+    """Returns the stub completion text: one JSON object, or a JSON array for batched prompts."""
+    if BATCH_MARKER in prompt:
+        stories_part = prompt.split(BATCH_MARKER, 1)[1]
+        texts = re.split(r"^Story \d+:", stories_part, flags=re.MULTILINE)[1:]
+        return json.dumps([dict(STUB_RESPONSE, index=n, sentiment=classify(text))
+                           for n, text in enumerate(texts, start=1)])
+    if STORY_MARKER in prompt:
+        return json.dumps(dict(STUB_RESPONSE, sentiment=classify(prompt.rsplit(STORY_MARKER, 1)[1])))
+    return json.dumps(STUB_RESPONSE)
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """
+    Answers every POST with a fixed sentiment/summary JSON after a simulated delay.
+    Token usage is approximated by whitespace-separated word counts.
+    """
+
+    # HTTP/1.1 keeps connections alive (like LM Studio) and allows chunked streaming replies.
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without TCP_NODELAY a keep-alive client waits
+    # for the delayed ACK (~40 ms) on every response.
+    disable_nagle_algorithm = True
+
+    # Set by make_stub_server().
+    latency = 0.0
+    error_rate = 0.0
+    # Delay between streamed chunks when the request asks for "stream": true.
+    token_interval = 0.0
+    # Extra delay per prompt word, so longer prompts take longer (as prompt processing does).
+    prompt_token_latency = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request_body = json.loads(self.rfile.read(length) or b"{}")
+        prompt = "\n".join(m.get("content", "") for m in request_body.get("messages", []))
+
+        time.sleep(self.latency + self.prompt_token_latency * len(prompt.split()))
+
+        if random.random() < self.error_rate:
+            self.send_error(503, "Simulated upstream failure")
+            return
+
+        reply = build_reply(prompt)
+        if request_body.get("stream"):
+            self.stream_reply(reply)
+            return
+
+        body = json.dumps({
+            "choices": [{"message": {"role": "assistant", "content": reply}}],
+            "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": len(reply.split())}
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream_reply(self, reply):
+        """Sends the reply as OpenAI-style server-sent events, one word per HTTP chunk."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for word in reply.split(" "):
+            chunk = {"choices": [{"delta": {"content": word + " "}}]}
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            time.sleep(self.token_interval)
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.write_chunk(b"")
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        # Keep the console quiet; the client side already reports progress.
+        pass
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    # A deeper listen backlog than the default (5) so load tests don't measure dropped SYNs.
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def make_stub_server(port=DEFAULT_PORT, latency=0.0, error_rate=0.0, token_interval=0.0, prompt_token_latency=0.0):
+    """
+    Creates a threaded stub LLM server bound to 127.0.0.1.
+
+    Args:
+        port (int): Port to listen on (0 picks a free port).
+        latency (float): Seconds to wait before answering each request.
+        error_rate (float): Fraction of requests answered with HTTP 503.
+        token_interval (float): Seconds between chunks of a streamed reply.
+        prompt_token_latency (float): Extra seconds per word of the prompt.
+
+    Returns:
+        StubHTTPServer: The server (not yet serving).
+    """
+    handler = type("ConfiguredStubLLMHandler", (StubLLMHandler,), {
+        "latency": latency,
+        "error_rate": error_rate,
+        "token_interval": token_interval,
+        "prompt_token_latency": prompt_token_latency,
+    })
+    return StubHTTPServer(("127.0.0.1", port), handler)
+
+
+def start_stub_server_in_background(port=0, latency=0.0, error_rate=0.0, token_interval=0.0, prompt_token_latency=0.0):
+    """
+    Starts a stub server on a daemon thread and returns (server, api_url).
+    Call server.shutdown() when finished.
+    """
+    server = make_stub_server(port, latency, error_rate, token_interval, prompt_token_latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    return server, api_url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stub OpenAI-compatible LLM server.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds of simulated latency per request.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail with 503.")
+    parser.add_argument("--token-interval", type=float, default=0.05, help="Seconds between streamed chunks.")
+    parser.add_argument("--prompt-token-latency", type=float, default=0.0, help="Extra seconds per prompt word.")
+    args = parser.parse_args()
+
+    server = make_stub_server(args.port, args.latency, args.error_rate, args.token_interval, args.prompt_token_latency)
+    print(f"Starting stub LLM server on http://127.0.0.1:{args.port}/v1/chat/completions "
+          f"(latency={args.latency}s, error_rate={args.error_rate})")
+    server.serve_forever()
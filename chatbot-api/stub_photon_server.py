@@ -0,0 +1,125 @@
+# stub_photon_server.py
+# This script runs a tiny Photon-compatible geocoding server that simulates lookup latency.
+# It lets geocode_stories.py and geocode_api.py be exercised (and timed) without a Photon install:
+#
+#   python stub_photon_server.py --port 2322 --latency 0.02
+#
+# Names found in the offline gazetteer get their real coordinates; any other name gets stable
+# pseudo-random coordinates around Christchurch, except a configurable fraction that is "not found".
+
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+from gazetteer import load_default_gazetteer
+from stub_llm_server import StubHTTPServer
+
+# --- Configuration ---
+DEFAULT_PORT = 2322
+CHRISTCHURCH = (-43.532, 172.636)
+
+gazetteer = load_default_gazetteer()
+
+
+def feature_collection(latitude, longitude, name):
+    """Builds a one-feature GeoJSON reply in Photon's format ([longitude, latitude])."""
+    return {
+        "type": "FeatureCollection",
+        "features": [{
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [longitude, latitude]},
+            "properties": {"name": name},
+        }],
+    }
+
+
+class StubPhotonHandler(BaseHTTPRequestHandler):
+    """Answers GET /api?q=<name> like Photon after a simulated delay."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without TCP_NODELAY a keep-alive client waits
+    # for the delayed ACK (~40 ms) on every response.
+    disable_nagle_algorithm = True
+
+    # Set by make_stub_server().
+    latency = 0.0
+    error_rate = 0.0
+    not_found_rate = 0.0
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query).get("q", [""])[0]
+        time.sleep(self.latency)
+
+        if random.random() < self.error_rate:
+            self.send_error(503, "Simulated upstream failure")
+            return
+
+        # The same name always gets the same answer, so cached and uncached runs agree.
+        name_hash = zlib.crc32(query.encode("utf-8"))
+        coordinates = gazetteer.lookup(query) if gazetteer else None
+        if coordinates:
+            reply = feature_collection(coordinates["latitude"], coordinates["longitude"], query)
+        elif not query or (name_hash % 1000) / 1000 < self.not_found_rate:
+            reply = {"type": "FeatureCollection", "features": []}
+        else:
+            latitude = CHRISTCHURCH[0] + ((name_hash >> 10) % 1000 - 500) / 5000
+            longitude = CHRISTCHURCH[1] + ((name_hash >> 20) % 1000 - 500) / 5000
+            reply = feature_collection(latitude, longitude, query)
+
+        body = json.dumps(reply).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_stub_server(port=DEFAULT_PORT, latency=0.0, error_rate=0.0, not_found_rate=0.0):
+    """
+    Creates a threaded stub Photon server bound to 127.0.0.1.
+
+    Args:
+        port (int): Port to listen on (0 picks a free port).
+        latency (float): Seconds to wait before answering each request.
+        error_rate (float): Fraction of requests answered with HTTP 503.
+        not_found_rate (float): Fraction of names outside the gazetteer that return no features.
+    """
+    handler = type("ConfiguredStubPhotonHandler", (StubPhotonHandler,), {
+        "latency": latency,
+        "error_rate": error_rate,
+        "not_found_rate": not_found_rate,
+    })
+    return StubHTTPServer(("127.0.0.1", port), handler)
+
+
+def start_stub_server_in_background(port=0, latency=0.0, error_rate=0.0, not_found_rate=0.0):
+    """
+    Starts a stub server on a daemon thread and returns (server, api_url).
+    Call server.shutdown() when finished.
+    """
+    server = make_stub_server(port, latency, error_rate, not_found_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/api"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stub Photon geocoding server.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds of simulated latency per request.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail with 503.")
+    parser.add_argument("--not-found-rate", type=float, default=0.05,
+                        help="Fraction of unknown names that return no result.")
+    args = parser.parse_args()
+
+    server = make_stub_server(args.port, args.latency, args.error_rate, args.not_found_rate)
+    print(f"Starting stub Photon server on http://127.0.0.1:{args.port}/api "
+          f"(latency={args.latency}s, error_rate={args.error_rate})")
+    server.serve_forever()
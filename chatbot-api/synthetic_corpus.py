@@ -0,0 +1,121 @@
+# synthetic_corpus.py
+# Generates a synthetic story corpus for benchmarks and load tests.
+# Files use the same naming scheme as the real data directory,
+#   "[2011-09-14] 157 [Christchurch Hospital] Jen.txt",
+# with place names drawn from the offline gazetteer (plus some misspelt and unknown places, as in
+# the real corpus) and story bodies assembled from sentiment-flavoured sentences. A fixed seed
+# gives the same corpus every time, so benchmark runs are comparable.
+#
+# Usage:
+#   python synthetic_corpus.py /tmp/stories 100000 [--seed 1]
+
+import argparse
+import datetime
+import json
+import os
+import random
+
+# Place names come from the bundled gazetteer index (not GAZETTEER_PATH), so the corpus does not
+# change when a benchmark switches the gazetteer off.
+PLACES_FILE = os.path.join(os.path.dirname(__file__), "gazetteer_index.json")
+
+# Real corpus sentiment mix (analyzed_stories.json: 163 negative, 83 neutral, 37 positive).
+SENTIMENT_WEIGHTS = {"negative": 163, "neutral": 83, "positive": 37}
+
+SENTENCES = {
+    "negative": [
+        "The house shook so hard that the chimney came down through the roof.",
+        "We lost power and water for more than a week.",
+        "I could not reach my children for hours and was terrified.",
+        "Liquefaction filled our street with grey silt up to our knees.",
+        "Our home was red stickered and we had to leave everything behind.",
+        "The aftershocks kept coming and none of us could sleep.",
+    ],
+    "neutral": [
+        "I was at work in the city when the earthquake struck.",
+        "We walked home along the river because the roads were closed.",
+        "The radio gave updates every hour about the damaged areas.",
+        "My neighbour and I checked the street for gas leaks.",
+        "We moved to my sister's place in the north for a few weeks.",
+    ],
+    "positive": [
+        "Strangers turned up with shovels to help dig out our driveway.",
+        "The student volunteers brought food and laughter to the whole street.",
+        "We were so relieved when everyone in the family was found safe.",
+        "Our community grew closer than it had ever been.",
+        "A neighbour shared her generator so we could have hot tea.",
+    ],
+}
+
+FIRST_NAMES = ["Sarah", "Jen", "Michelle", "Lloyd", "Anne", "Philip", "Lisa", "Owen", "Maureen", "Tayla",
+               "Rose", "Chris", "Bettina", "Lauren", "Pauline", "Anonymous"]
+SURNAMES = ["", "", "", "Carpenter", "Hodge", "McKenzie", "Wootton", "Moore"]
+
+# Place names that exercise the geocoder's misspelling handling and its "not found" path.
+EXTRA_PLACES = ["Christhchurch Hospital", "Worcester Street Christchruch", "Lyttleton", "Chch CBD",
+                "Somewhere in the hills", "On the road to Kaikoura"]
+
+FIRST_DATE = datetime.date(2011, 7, 1)
+DATE_SPAN_DAYS = 5 * 365
+
+
+def place_names():
+    """Returns the place names to draw from: gazetteer entries (title-cased) plus EXTRA_PLACES."""
+    with open(PLACES_FILE, "r", encoding="utf-8") as f:
+        names = json.load(f)["names"]
+    return [name.title() for name in names] + EXTRA_PLACES
+
+
+def generate_story(story_number, rng, places, max_sentences=25):
+    """
+    Returns (file name, text, sentiment) for one synthetic story.
+    """
+    sentiment = rng.choices(list(SENTIMENT_WEIGHTS), weights=list(SENTIMENT_WEIGHTS.values()))[0]
+    date = FIRST_DATE + datetime.timedelta(days=rng.randrange(DATE_SPAN_DAYS))
+    author = f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}".strip()
+    file_name = f"[{date.isoformat()}] {story_number} [{rng.choice(places)}] {author}.txt"
+
+    # Mostly sentences of the story's own sentiment, with some neutral context mixed in.
+    sentences = [rng.choice(SENTENCES[sentiment] if rng.random() < 0.7 else SENTENCES["neutral"])
+                 for _ in range(rng.randint(3, max(3, max_sentences)))]
+    paragraphs = [" ".join(sentences[i:i + 4]) for i in range(0, len(sentences), 4)]
+    return file_name, "\n".join(paragraphs), sentiment
+
+
+def iter_synthetic_stories(count, seed=0, max_sentences=25):
+    """
+    Yields (file name, text, sentiment) for `count` stories, deterministically for a given seed.
+    Stories have 3 to `max_sentences` sentences (25 is about the real corpus' 1500 characters).
+    """
+    rng = random.Random(seed)
+    places = place_names()
+    for story_number in range(1, count + 1):
+        yield generate_story(story_number, rng, places, max_sentences)
+
+
+def generate_corpus(output_dir, count, seed=0, max_sentences=25):
+    """
+    Writes `count` synthetic .txt stories to `output_dir`.
+
+    Returns:
+        dict: {file name: sentiment the story was written with}, usable as ground truth.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    labels = {}
+    for file_name, text, sentiment in iter_synthetic_stories(count, seed, max_sentences):
+        with open(os.path.join(output_dir, file_name), "w", encoding="utf-8") as f:
+            f.write(text)
+        labels[file_name] = sentiment
+    return labels
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic story corpus.")
+    parser.add_argument("output_dir")
+    parser.add_argument("count", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-sentences", type=int, default=25, help="Longest story, in sentences.")
+    args = parser.parse_args()
+
+    labels = generate_corpus(args.output_dir, args.count, args.seed, args.max_sentences)
+    print(f"Wrote {len(labels)} synthetic stories to {args.output_dir}")
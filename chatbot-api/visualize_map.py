@@ -1,60 +1,103 @@
 # visualize_map.py
 # This script generates a static HTML map (story_map.html) to visualize the geocoded stories.
 # It serves as a simple mock and test visualization of the processed data.
+# The input can be a JSON array, a JSONL file, or "-" to read JSONL from a previous pipe stage.
+#
+# --fast renders from the coordinates geocode_stories.py already computed (no geocoding): the
+# heatmap is a NumPy-binned density grid and stories at the same spot share one marker.
+#   python visualize_map.py --fast                          # geocoded_stories.store / .json
+#   python visualize_map.py --fast --synthetic 20000        # render a synthetic corpus and time it
 
-import json
+import argparse
+import html
 import os
-import re
+import random
+import time
 import folium
+import numpy as np
 import requests
+from dotenv import load_dotenv
+
+# Load environment variables from .env file, before the modules below read their settings.
+load_dotenv()
+
+from gazetteer import OFFLINE_MODE, load_default_gazetteer
+from geocode_cache import GeocodeCache, normalize_location
+from http_client import get_session
 from folium.plugins import HeatMap
+from story_metadata import story_metadata
+from story_store import StoryStore
+from story_stream import iter_stories
 
 # --- Configuration ---
 BASE_DIR = os.path.dirname(__file__)
 ANALYZED_DATA_FILE = os.path.join(BASE_DIR, "analyzed_stories.json")
+GEOCODED_DATA_FILE = os.path.join(BASE_DIR, "geocoded_stories.json")
 OUTPUT_MAP_FILE = os.path.join(BASE_DIR, "story_map.html")
 PHOTON_URL = "http://127.0.0.1:2322/api"
+# Seconds to wait for Photon before giving up on a single lookup (shared with geocode_api.py).
+PHOTON_TIMEOUT = float(os.getenv("PHOTON_TIMEOUT", "10"))
+# Keep-alive connection reused for every Photon lookup (see http_client.py).
+photon_session = get_session("photon")
 SENTIMENT_COLORS = {
     'positive': 'green',
     'negative': 'red',
     'neutral': 'blue'
 }
-geocode_cache = {}
+# Fast mode: heatmap cell size in degrees (0.005 is roughly 550 m x 400 m in Christchurch) and the
+# weight each story adds to its cell, so the heatmap leans towards the harder experiences.
+HEATMAP_CELL_SIZE = float(os.getenv("MAP_HEATMAP_CELL_SIZE", "0.005"))
+SENTIMENT_WEIGHTS = {'negative': 1.0, 'neutral': 0.6, 'positive': 0.4}
+# Stories listed in the popup of a marker shared by several stories.
+MAX_STORIES_PER_POPUP = 10
+# Persistent cache shared with geocode_api.py; "not found" answers are cached too.
+geocode_cache = GeocodeCache()
+
+# Offline gazetteer (gazetteer_index.json) consulted before Photon, if it has been built.
+gazetteer = load_default_gazetteer()
 
 # --- Geocoding Function ---
 def get_coordinates(location_name):
-    """Geocodes a location name using a local Photon server, with caching."""
-    if location_name in geocode_cache:
-        return geocode_cache[location_name]
+    """
+    Geocodes a location name with caching: the persistent cache first, then the offline gazetteer,
+    then the local Photon server (skipped when GEOCODE_OFFLINE is set).
+    """
+    found, cached = geocode_cache.get(location_name)
+    if cached:
+        return (cached["latitude"], cached["longitude"])
+
+    coordinates = gazetteer.lookup(location_name) if gazetteer else None
+    if coordinates:
+        return (coordinates["latitude"], coordinates["longitude"])
+    if found or OFFLINE_MODE:
+        return None
 
     print(f"  - Geocoding '{location_name}' using local Photon...")
     try:
-        params = {"q": location_name, "lang": "en"}
-        response = requests.get(PHOTON_URL, params=params)
+        params = {"q": normalize_location(location_name), "lang": "en"}
+        response = photon_session.get(PHOTON_URL, params=params, timeout=PHOTON_TIMEOUT)
         response.raise_for_status()
         data = response.json()
         if data and data.get('features'):
             coords = data['features'][0]['geometry']['coordinates']
-            coordinates = (coords[1], coords[0])  # Convert to (lat, lon)
-            geocode_cache[location_name] = coordinates
-            return coordinates
+            geocode_cache.set(location_name, {"latitude": coords[1], "longitude": coords[0]})
+            return (coords[1], coords[0])  # Convert to (lat, lon)
         else:
-            geocode_cache[location_name] = None
+            geocode_cache.set(location_name, None)
             return None
     except requests.exceptions.RequestException as e:
+        # Connection failures are not cached so the next run tries again.
         print(f"  - Error connecting to Photon: {e}. Skipping.")
-        geocode_cache[location_name] = None
         return None
 
 # --- Main Visualization Function ---
-def create_story_map():
+def create_story_map(input_path=ANALYZED_DATA_FILE, output_path=OUTPUT_MAP_FILE):
     """Generates an interactive HTML map that fits all story markers."""
-    if not os.path.exists(ANALYZED_DATA_FILE):
-        print(f"Error: Analyzed data file not found at {ANALYZED_DATA_FILE}")
+    if input_path != "-" and not os.path.exists(input_path):
+        print(f"Error: Analyzed data file not found at {input_path}")
         return
 
-    with open(ANALYZED_DATA_FILE, 'r', encoding='utf-8') as f:
-        stories = json.load(f)
+    stories = iter_stories(input_path)
 
     # Initialize map. Location and zoom will be set automatically later.
     story_map = folium.Map(tiles="OpenStreetMap")
@@ -69,8 +112,7 @@ def create_story_map():
         if not story_id:
             continue
         
-        match = re.findall(r'\[([^\]]+)\]', story_id)
-        location_str = match[2].strip() if len(match) >= 3 else None
+        location_str = story_metadata(story)["location_name"]
 
         if not location_str:
             continue
@@ -102,9 +144,151 @@ def create_story_map():
 
     folium.LayerControl().add_to(story_map)
     
-    story_map.save(OUTPUT_MAP_FILE)
-    print(f"\nMap generation complete! Saved to {OUTPUT_MAP_FILE}")
+    story_map.save(output_path)
+    print(f"\nMap generation complete! Saved to {output_path}")
+    stats = geocode_cache.stats()
+    print(f"Geocode cache: {stats['hit_rate']:.0%} hit rate ({stats['misses']} cache misses)")
+
+# --- Fast Rendering Mode ---
+def load_precomputed_points(input_path=GEOCODED_DATA_FILE):
+    """
+    Returns (latitudes, longitudes, sentiments, get_story) for the stories that have coordinates.
+    Reads the columnar store next to a geocoded .json file when it is up to date, so story texts
+    are never loaded; `get_story(i)` returns the story_id and summary of point i on demand.
+    """
+    store_path = os.path.splitext(input_path)[0] + ".store" if input_path != "-" else None
+    meta_path = os.path.join(store_path, "meta.json") if store_path else None
+    if meta_path and os.path.exists(meta_path) and os.path.getmtime(meta_path) >= os.path.getmtime(input_path):
+        store = StoryStore(store_path)
+        located = np.flatnonzero(~np.isnan(store.latitude))
+        labels = np.array(store.sentiment_labels + [None], dtype=object)
+        codes = np.minimum(store.sentiment_codes[located], len(labels) - 1)
+        return (np.asarray(store.latitude[located]), np.asarray(store.longitude[located]), labels[codes],
+                lambda i: (store.story_id(located[i]), store.summary(located[i])))
+
+    latitudes, longitudes, sentiments, details = [], [], [], []
+    for story in iter_stories(input_path):
+        coordinates = (story.get('location') or {}).get('coordinates')
+        if coordinates:
+            latitudes.append(coordinates['latitude'])
+            longitudes.append(coordinates['longitude'])
+            sentiments.append(story.get('sentiment'))
+            details.append((story.get('story_id'), story.get('summary')))
+    return (np.array(latitudes, dtype=np.float64), np.array(longitudes, dtype=np.float64),
+            np.array(sentiments, dtype=object), details.__getitem__)
+
+def heatmap_grid(latitudes, longitudes, sentiments, cell_size=HEATMAP_CELL_SIZE):
+    """
+    Bins the points into a cell_size-degree grid, summing SENTIMENT_WEIGHTS per cell.
+
+    Returns:
+        list: [cell centre latitude, cell centre longitude, weight normalized to 0-1] per occupied cell.
+    """
+    if not len(latitudes):
+        return []
+    weights = np.array([SENTIMENT_WEIGHTS.get(s, 0.5) for s in sentiments])
+    rows = np.floor(latitudes / cell_size).astype(np.int64)
+    cols = np.floor(longitudes / cell_size).astype(np.int64)
+    cells, cell_of = np.unique(np.stack([rows, cols], axis=1), axis=0, return_inverse=True)
+    totals = np.bincount(cell_of.ravel(), weights, len(cells))
+    centres = (cells + 0.5) * cell_size
+    return np.column_stack([centres, totals / totals.max()]).tolist()
+
+def create_fast_story_map(input_path=GEOCODED_DATA_FILE, output_path=OUTPUT_MAP_FILE,
+                          cell_size=HEATMAP_CELL_SIZE, points=None):
+    """
+    Generates the story map from precomputed coordinates with one marker per distinct location.
+
+    Args:
+        input_path (str): Geocoded stories (.json/.jsonl, or "-").
+        output_path (str): HTML file to write.
+        cell_size (float): Heatmap cell size in degrees.
+        points (tuple): Optional output of load_precomputed_points(), used instead of input_path.
+
+    Returns:
+        dict: Story, marker and heatmap cell counts, render time (s) and HTML size (bytes).
+    """
+    started = time.perf_counter()
+    latitudes, longitudes, sentiments, get_story = points or load_precomputed_points(input_path)
+
+    story_map = folium.Map(tiles="OpenStreetMap")
+    story_marker_group = folium.FeatureGroup(name='Story Markers').add_to(story_map)
+
+    # Stories geocoded to the same place (e.g. a suburb centroid) share one marker.
+    spots, spot_of = np.unique(np.round(np.column_stack([latitudes, longitudes]), 6), axis=0, return_inverse=True)
+    spot_of = spot_of.ravel()
+    order = np.argsort(spot_of, kind="stable")
+    bounds = np.searchsorted(spot_of[order], np.arange(len(spots) + 1))
+
+    for spot, (latitude, longitude) in enumerate(spots):
+        members = order[bounds[spot]:bounds[spot + 1]]
+        labels, counts = np.unique(sentiments[members].astype(str), return_counts=True)
+        majority = labels[np.argmax(counts)]
+        listed = [get_story(i) for i in members[:MAX_STORIES_PER_POPUP]]
+
+        if len(members) == 1:
+            story_id, summary = listed[0]
+            popup_html = f"""<h4>{html.escape(story_id)}</h4><p><b>Sentiment:</b> {majority}</p><p><b>Summary:</b> {html.escape(summary or '')}</p>"""
+        else:
+            breakdown = ", ".join(f"{label}: {count}" for label, count in zip(labels, counts))
+            items = "".join(f"<li>{html.escape(story_id)}</li>" for story_id, _ in listed)
+            more = f"<p>…and {len(members) - len(listed)} more</p>" if len(members) > len(listed) else ""
+            popup_html = f"""<h4>{len(members)} stories</h4><p><b>Sentiment:</b> {breakdown}</p><ul>{items}</ul>{more}"""
+
+        folium.Marker(
+            location=(float(latitude), float(longitude)),
+            popup=folium.Popup(popup_html, max_width=300),
+            tooltip=f"{len(members)} stories" if len(members) > 1 else None,
+            icon=folium.Icon(color=SENTIMENT_COLORS.get(majority, 'gray'), icon='info-sign')
+        ).add_to(story_marker_group)
+
+    heatmap_data = heatmap_grid(latitudes, longitudes, sentiments, cell_size)
+    if heatmap_data:
+        HeatMap(heatmap_data, name='Story Heatmap').add_to(story_map)
+
+    if len(spots):
+        story_map.fit_bounds([spots.min(axis=0).tolist(), spots.max(axis=0).tolist()], padding=(50, 50))
+    else:
+        story_map.location = [-43.532, 172.636]
+        story_map.zoom_start = 11
+
+    folium.LayerControl().add_to(story_map)
+    story_map.save(output_path)
+
+    report = {"stories": len(latitudes), "markers": len(spots), "heatmap_cells": len(heatmap_data),
+              "render_seconds": time.perf_counter() - started, "html_bytes": os.path.getsize(output_path)}
+    print(f"\nMap generation complete! Saved to {output_path}")
+    print(f"   {report['stories']} stories -> {report['markers']} markers, {report['heatmap_cells']} heatmap cells")
+    print(f"   Render time: {report['render_seconds']:.2f}s, HTML size: {report['html_bytes'] / 1024:.0f} KB")
+    return report
+
+def synthetic_points(count, seed=0):
+    """
+    Builds `count` synthetic located stories for timing the fast mode: places are drawn from the
+    offline gazetteer (Christchurch-weighted like the real corpus) with the real sentiment mix.
+    """
+    if gazetteer is None:
+        raise RuntimeError("Synthetic stories need the gazetteer (python gazetteer.py build).")
+    rng = random.Random(seed)
+    places = rng.choices(range(len(gazetteer)), k=count)
+    sentiments = rng.choices(['negative', 'neutral', 'positive'], weights=[163, 83, 37], k=count)
+    latitudes = np.array([gazetteer.latitudes[p] for p in places])
+    longitudes = np.array([gazetteer.longitudes[p] for p in places])
+    get_story = lambda i: (f"[2011-09-01] {i} [{gazetteer.names[places[i]]}] Synthetic.txt", "Synthetic story.")
+    return latitudes, longitudes, np.array(sentiments, dtype=object), get_story
 
 # --- Main entry point ---
 if __name__ == "__main__":
-    create_story_map()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate story_map.html.")
+    parser.add_argument("input", nargs="?", help='Stories (.json, .jsonl or "-" for stdin).')
+    parser.add_argument("--fast", action="store_true", help="Use precomputed coordinates (geocoded stories).")
+    parser.add_argument("--cell-size", type=float, default=HEATMAP_CELL_SIZE, help="Fast mode heatmap cell size (degrees).")
+    parser.add_argument("--synthetic", type=int, help="Fast mode: render N synthetic stories instead of the input.")
+    parser.add_argument("--output", default=OUTPUT_MAP_FILE, help="HTML file to write.")
+    args = parser.parse_args()
+
+    if args.fast or args.synthetic:
+        points = synthetic_points(args.synthetic) if args.synthetic else None
+        create_fast_story_map(args.input or GEOCODED_DATA_FILE, args.output, args.cell_size, points)
+    else:
+        create_story_map(args.input or ANALYZED_DATA_FILE, args.output)
\ No newline at end of file